@@ -16,41 +16,171 @@ The exported files will be placed in the specified output directory (default: _s
 # dependencies = [
 #     "jinja2==3.1.3",
 #     "fire==0.7.0",
-#     "loguru==0.7.0"
+#     "loguru==0.7.0",
+#     "brotli==1.1.0",
+#     "pandas==2.3.0",
+#     "pyarrow==20.0.0"
 # ]
 # ///
 
+import ast
+import gzip
+import hashlib
+import json
+import os
+import re
 import subprocess
 import shutil
-from typing import List, Union
+import sys
+import tempfile
+import time
+import tomllib
+import urllib.request
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple, Union
 from pathlib import Path
 
+import brotli
 import jinja2
 import fire
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from loguru import logger
 
-def _export_html_wasm(notebook_path: Path, output_dir: Path, as_app: bool = False) -> bool:
+# Text assets that get precompressed .gz and .br variants next to the original file
+COMPRESSIBLE_SUFFIXES = {".html", ".css", ".js", ".json", ".csv", ".svg", ".txt", ".xml"}
+
+# Data assets inside public/ directories that get content-hash fingerprints
+FINGERPRINT_SUFFIXES = {".csv", ".json", ".parquet", ".arrow"}
+
+# Name of the manifest written into every public/ directory, mapping logical to fingerprinted names
+ASSET_MANIFEST_NAME = "asset-manifest.json"
+
+# Data mart CSVs in a public/ directory that get bundled as Parquet for the WebAssembly apps
+MART_PATTERN = "dm_*.csv"
+
+# Name of the manifest describing the bundled marts (file, rows, bytes, version)
+MARTS_MANIFEST_NAME = "marts-manifest.json"
+
+# Template and output name of the service worker that precaches the exported site
+SERVICE_WORKER_TEMPLATE = Path("templates") / "sw.js.j2"
+SERVICE_WORKER_NAME = "sw.js"
+
+# Origins of the Pyodide runtime and the packages it installs; their URLs are versioned
+RUNTIME_ORIGINS = ["https://cdn.jsdelivr.net", "https://files.pythonhosted.org"]
+
+# Template of the static view snapshots embedded in the dashboard page
+SNAPSHOTS_TEMPLATE = Path("templates") / "snapshots.html.j2"
+
+# Shared export environments, one per distinct script header, kept across builds
+ENV_CACHE_DIR = Path(".cache") / "build-envs"
+ENV_MARKER_NAME = "build-env.json"
+
+# Template of the startup telemetry hook injected into the exported app pages
+TELEMETRY_TEMPLATE = Path("templates") / "telemetry.html.j2"
+
+# Script that regenerates the loss ratio forecast read by the dashboard, before the apps are exported,
+# and the mart it simulates. The forecast records the content version of that mart, so the
+# simulation only reruns when the mart changed
+FORECAST_SCRIPT = Path(".github") / "scripts" / "simulate.py"
+FORECAST_INPUT = Path("apps") / "public" / "dm_insurance_profitability.csv"
+FORECAST_OUTPUT = Path("apps") / "public" / "dm_loss_ratio_forecast.csv"
+
+# Apps whose views are rendered headlessly at build time and embedded as static snapshots
+SNAPSHOT_APPS = [Path("apps") / "data_marts_dashboard.py"]
+
+# Runs the dashboard headlessly once per data mart, with no customer selected, and writes the
+# figures of every view as plotly JSON. The selectors are replaced through app.run(defs=...),
+# so the cells that define them do not run.
+SNAPSHOT_RUNNER = """
+import importlib.util, json, sys
+from types import SimpleNamespace
+import plotly.offline
+
+spec = importlib.util.spec_from_file_location("snapshot_notebook", sys.argv[1])
+notebook = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(notebook)
+
+_, defaults = notebook.app.run()
+snapshots = []
+for mart in defaults["data_mart_selector"].options.values():
+    _, defs = notebook.app.run(defs={
+        "mart_names": defaults["mart_names"],
+        "default_mart": mart,
+        "data_mart_selector": SimpleNamespace(value=mart),
+        "customer_selector": SimpleNamespace(value=None),
+        "display_selector": None,
+    })
+    figures = [json.loads(build().to_json()) for build, _ in defs["chart_slots"]]
+    snapshots.append({"mart": mart, "title": defs["display_name"], "figures": figures})
+
+with open(sys.argv[2], "w") as f:
+    json.dump({"plotlyjs_version": plotly.offline.get_plotlyjs_version(), "snapshots": snapshots}, f)
+"""
+
+# Pyodide release whose package index is used to estimate the download size of each app
+PYODIDE_CDN_URL = "https://cdn.jsdelivr.net/pyodide/v0.27.7/full/"
+
+# Package index and download sizes looked up by --profile-startup. They come from a pinned
+# Pyodide release and pinned PyPI releases, which never change, so they are kept across
+# builds and a later build profiles the same packages without network access
+PROFILE_CACHE_DIR = Path(".cache") / "startup-profile"
+
+# Seconds to wait for the Pyodide CDN or PyPI before leaving a size unknown
+LOOKUP_TIMEOUT_S = 10
+
+# Imports the given modules one by one in notebook order and prints the time of each as JSON,
+# with the installed distribution and version of every top-level module. Run inside the
+# notebook's own environment, so every import pays for its dependencies once.
+IMPORT_TIMER = """
+import importlib, importlib.metadata, json, sys, time
+timings = []
+for name in sys.argv[1:]:
+    start = time.perf_counter()
+    try:
+        importlib.import_module(name)
+        timings.append({"module": name, "import_time_s": round(time.perf_counter() - start, 4)})
+    except ImportError as e:
+        timings.append({"module": name, "import_time_s": None, "error": str(e)})
+distributions = {}
+for top_level, names in importlib.metadata.packages_distributions().items():
+    if top_level in {name.split(".")[0] for name in sys.argv[1:]}:
+        distributions[top_level] = [names[0], importlib.metadata.version(names[0])]
+print(json.dumps({"imports": timings, "distributions": distributions}))
+"""
+
+def _export_html_wasm(notebook_path: Path, output_dir: Path, as_app: bool = False, python: Path | None = None) -> dict:
     """Export a single marimo notebook to HTML/WebAssembly format.
 
     This function takes a marimo notebook (.py file) and exports it to HTML/WebAssembly format.
     If as_app is True, the notebook is exported in "run" mode with code hidden, suitable for
     applications. Otherwise, it's exported in "edit" mode, suitable for interactive notebooks.
+    The export runs in the shared environment of the notebook's dependencies when one is
+    given, and in a sandbox built from its script header otherwise.
+    The wall time, exit status and output size of the export are recorded for the build report.
 
     Args:
         notebook_path (Path): Path to the marimo notebook (.py file) to export
         output_dir (Path): Directory where the exported HTML file will be saved
         as_app (bool, optional): Whether to export as an app (run mode) or notebook (edit mode).
                                 Defaults to False.
+        python (Path | None, optional): Python of a shared environment with marimo and the
+                                        notebook's dependencies. Defaults to None (sandbox).
 
     Returns:
-        bool: True if export succeeded, False otherwise
+        dict: Export record with "notebook", "mode", "environment", "success", "exit_status"
+              (None if the command could not be run), "wall_time_s" and "html_bytes"
     """
     # Convert .py extension to .html for the output file
     output_path: Path = notebook_path.with_suffix(".html")
 
-    # Base command for marimo export
-    cmd: List[str] = ["uvx", "marimo", "export", "html-wasm", "--sandbox"]
+    # Base command for marimo export; without a shared environment, marimo builds one
+    if python is not None:
+        cmd: List[str] = [str(python), "-m", "marimo", "export", "html-wasm"]
+    else:
+        cmd: List[str] = ["uvx", "marimo", "export", "html-wasm", "--sandbox"]
 
     # Configure export mode based on whether it's an app or a notebook
     if as_app:
@@ -60,6 +190,17 @@ def _export_html_wasm(notebook_path: Path, output_dir: Path, as_app: bool = Fals
         logger.info(f"Exporting {notebook_path} to {output_path} as notebook")
         cmd.extend(["--mode", "edit"])  # Notebooks run in "edit" mode
 
+    record = {
+        "notebook": notebook_path.as_posix(),
+        "mode": "run" if as_app else "edit",
+        "environment": "shared" if python is not None else "sandbox",
+        "success": False,
+        "exit_status": None,
+        "wall_time_s": 0.0,
+        "html_bytes": 0,
+    }
+    start = time.perf_counter()
+
     try:
         # Create full output path and ensure directory exists
         output_file: Path = output_dir / notebook_path.with_suffix(".html")
@@ -70,21 +211,23 @@ def _export_html_wasm(notebook_path: Path, output_dir: Path, as_app: bool = Fals
 
         # Run marimo export command
         logger.debug(f"Running command: {cmd}")
-        subprocess.run(cmd, capture_output=True, text=True, check=True)
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        record.update(success=True, exit_status=result.returncode, html_bytes=output_file.stat().st_size)
         logger.info(f"Successfully exported {notebook_path}")
-        return True
     except subprocess.CalledProcessError as e:
         # Handle marimo export errors
+        record["exit_status"] = e.returncode
         logger.error(f"Error exporting {notebook_path}:")
         logger.error(f"Command output: {e.stderr}")
-        return False
     except Exception as e:
         # Handle unexpected errors
         logger.error(f"Unexpected error exporting {notebook_path}: {e}")
-        return False
+
+    record["wall_time_s"] = round(time.perf_counter() - start, 3)
+    return record
 
 
-def _generate_index(output_dir: Path, template_file: Path, notebooks_data: List[dict] | None = None, apps_data: List[dict] | None = None) -> None:
+def _generate_index(output_dir: Path, template_file: Path, notebooks_data: List[dict] | None = None, apps_data: List[dict] | None = None, build_report: dict | None = None, service_worker: str | None = None) -> None:
     """Generate an index.html file that lists all the notebooks.
 
     This function creates an HTML index page that displays links to all the exported
@@ -96,6 +239,8 @@ def _generate_index(output_dir: Path, template_file: Path, notebooks_data: List[
         apps_data (List[dict]): List of dictionaries with data for apps
         output_dir (Path): Directory where the index.html file will be saved
         template_file (Path, optional): Path to the template file. If None, uses the default template.
+        build_report (dict, optional): Build report to render in the index page, if the template supports it.
+        service_worker (str, optional): Path of the service worker the index page should register.
 
     Returns:
         None
@@ -119,7 +264,9 @@ def _generate_index(output_dir: Path, template_file: Path, notebooks_data: List[
         template = env.get_template(template_name)
 
         # Render the template with notebook and app data
-        rendered_html = template.render(notebooks=notebooks_data, apps=apps_data)
+        rendered_html = template.render(
+            notebooks=notebooks_data, apps=apps_data, build_report=build_report, service_worker=service_worker
+        )
 
         # Write the rendered HTML to the index.html file
         with open(index_path, "w") as f:
@@ -134,7 +281,7 @@ def _generate_index(output_dir: Path, template_file: Path, notebooks_data: List[
         logger.error(f"Error rendering template: {e}")
 
 
-def _copy_public_directory(source_folder: Path, output_dir: Path) -> None:
+def _copy_public_directory(source_folder: Path, output_dir: Path) -> int:
     """Copy the public directory from source folder to output directory.
 
     Args:
@@ -142,7 +289,7 @@ def _copy_public_directory(source_folder: Path, output_dir: Path) -> None:
         output_dir (Path): Directory where the public folder will be copied
 
     Returns:
-        None
+        int: Number of bytes copied (0 if there is no public directory)
     """
     public_dir = source_folder / "public"
     if public_dir.exists() and public_dir.is_dir():
@@ -155,30 +302,40 @@ def _copy_public_directory(source_folder: Path, output_dir: Path) -> None:
             shutil.rmtree(dest_public)
 
         shutil.copytree(public_dir, dest_public)
-        logger.info(f"Copied {public_dir} to {dest_public}")
-    else:
-        logger.debug(f"No public directory found in {source_folder}")
+        copied_bytes = sum(f.stat().st_size for f in dest_public.rglob("*") if f.is_file())
+        logger.info(f"Copied {public_dir} to {dest_public} ({copied_bytes:,} bytes)")
+        return copied_bytes
+
+    logger.debug(f"No public directory found in {source_folder}")
+    return 0
 
 
-def _export(folder: Path, output_dir: Path, as_app: bool=False) -> List[dict]:
+def _export(folder: Path, output_dir: Path, as_app: bool=False, environments: Dict[Path, Path] | None = None) -> Tuple[List[dict], dict]:
     """Export all marimo notebooks in a folder to HTML/WebAssembly format.
 
     This function finds all Python files in the specified folder and exports them
     to HTML/WebAssembly format using the export_html_wasm function. It returns a
-    list of dictionaries containing the data needed for the template.
+    list of dictionaries containing the data needed for the template, together with
+    the export records and copied asset bytes of the folder for the build report.
 
     Args:
         folder (Path): Path to the folder containing marimo notebooks
         output_dir (Path): Directory where the exported HTML files will be saved
         as_app (bool, optional): Whether to export as apps (run mode) or notebooks (edit mode).
+        environments (Dict[Path, Path] | None, optional): Python of the shared environment of
+                                                          each notebook, as returned by
+                                                          _prepare_environments
 
     Returns:
-        List[dict]: List of dictionaries with "display_name" and "html_path" for each notebook
+        Tuple[List[dict], dict]: List of dictionaries with "display_name" and "html_path" for each
+                                 notebook, and the folder report with "folder", "exports" and "public_bytes"
     """
+    folder_report = {"folder": folder.as_posix(), "exports": [], "public_bytes": 0}
+
     # Check if the folder exists
     if not folder.exists():
         logger.warning(f"Directory not found: {folder}")
-        return []
+        return [], folder_report
 
     # Find all Python files recursively in the folder
     notebooks = list(folder.rglob("*.py"))
@@ -187,7 +344,13 @@ def _export(folder: Path, output_dir: Path, as_app: bool=False) -> List[dict]:
     # Exit if no notebooks were found
     if not notebooks:
         logger.warning(f"No notebooks found in {folder}!")
-        return []
+        return [], folder_report
+
+    # Export every notebook, keeping the record of each export for the build report
+    environments = environments or {}
+    folder_report["exports"] = [
+        _export_html_wasm(nb, output_dir, as_app=as_app, python=environments.get(nb)) for nb in notebooks
+    ]
 
     # For each successfully exported notebook, add its data to the notebook_data list
     notebook_data = [
@@ -195,35 +358,863 @@ def _export(folder: Path, output_dir: Path, as_app: bool=False) -> List[dict]:
             "display_name": (nb.stem.replace("_", " ").title()),
             "html_path": str(nb.with_suffix(".html")),
         }
-        for nb in notebooks
-        if _export_html_wasm(nb, output_dir, as_app=as_app)
+        for nb, record in zip(notebooks, folder_report["exports"])
+        if record["success"]
     ]
 
     # Copy the public directory if it exists
-    _copy_public_directory(folder, output_dir)
+    folder_report["public_bytes"] = _copy_public_directory(folder, output_dir)
 
     logger.info(f"Successfully exported {len(notebook_data)} out of {len(notebooks)} files from {folder}")
-    return notebook_data
+    return notebook_data, folder_report
+
+
+def _pack_marts(public_dir: Path) -> Dict[str, dict]:
+    """Bundle the data mart CSVs of a public directory as Parquet files.
+
+    Parsing CSV with the pure pandas path is slow under Pyodide, and for all but the
+    smallest marts CSV is also larger on the wire. Each mart is converted once at build
+    time and a marts manifest with the file, format, row and column counts, sizes and a
+    content version of every mart is written next to them. Parquet has a fixed overhead
+    of a few kilobytes, so a mart whose Parquet file would be larger than its CSV keeps
+    the CSV as its bundled format.
+
+    Args:
+        public_dir (Path): Public directory in the output containing the mart CSVs
+
+    Returns:
+        Dict[str, dict]: Manifest entry for each mart, keyed by the mart name
+    """
+    marts: Dict[str, dict] = {}
+
+    for csv_path in sorted(public_dir.glob(MART_PATTERN)):
+        parquet_path = csv_path.with_suffix(".parquet")
+        try:
+            df = pd.read_csv(csv_path)
+            # The pandas schema metadata is not needed to read the marts back and is
+            # large relative to a small mart
+            table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+            pq.write_table(table, parquet_path, compression="snappy")
+        except Exception as e:
+            logger.error(f"Error packing {csv_path}: {e}")
+            continue
+
+        csv_bytes = csv_path.stat().st_size
+        parquet_bytes = parquet_path.stat().st_size
+        if parquet_bytes >= csv_bytes:
+            parquet_path.unlink()
+        bundled = parquet_path if parquet_path.exists() else csv_path
+
+        marts[csv_path.stem] = {
+            "file": bundled.name,
+            "format": bundled.suffix.lstrip("."),
+            "rows": len(df),
+            "columns": len(df.columns),
+            "bytes": bundled.stat().st_size,
+            "csv_bytes": csv_bytes,
+            # The version changes whenever the mart content changes
+            "version": hashlib.sha256(csv_path.read_bytes()).hexdigest()[:12],
+        }
+        logger.info(f"Packed {csv_path.name} as {bundled.name}: {csv_bytes:,} -> {marts[csv_path.stem]['bytes']:,} bytes")
+
+    if marts:
+        (public_dir / MARTS_MANIFEST_NAME).write_text(json.dumps(marts, indent=2, sort_keys=True))
+
+    return marts
+
+
+def _inject_into_head(html_path: Path, snippet: str) -> None:
+    """Insert an HTML snippet at the end of the <head> of an exported page.
+
+    Args:
+        html_path (Path): Exported HTML file to modify in place
+        snippet (str): HTML to insert just before </head>
+
+    Returns:
+        None
+    """
+    html = html_path.read_text(encoding="utf-8")
+    if "</head>" not in html:
+        logger.warning(f"No </head> found in {html_path}, skipping injection")
+        return
+    html_path.write_text(html.replace("</head>", f"{snippet}\n</head>", 1), encoding="utf-8")
+
+
+def _add_preload_hints(output_dir: Path, folder: Path, marts: Dict[str, dict], manifest: Dict[str, str]) -> None:
+    """Add <link rel=preload> hints for the bundled marts to the exported pages of a folder.
+
+    A page only gets hints for the marts its notebook refers to by name, so apps that
+    do not use the marts do not download them. The hints point at the fingerprinted
+    file names when the assets were fingerprinted.
+
+    Args:
+        output_dir (Path): Directory containing the exported site
+        folder (Path): Source folder of the notebooks (e.g. apps/)
+        marts (Dict[str, dict]): Marts manifest as returned by _pack_marts
+        manifest (Dict[str, str]): Asset manifest of the public directory (may be empty)
+
+    Returns:
+        None
+    """
+    for notebook in sorted(folder.rglob("*.py")):
+        html_path = output_dir / notebook.with_suffix(".html")
+        if not html_path.exists():
+            continue
+
+        source = notebook.read_text(encoding="utf-8")
+        used = [entry["file"] for name, entry in marts.items() if name in source]
+        if not used:
+            continue
+
+        # Paths are relative to the page, which may sit in a subfolder of the public/ directory's parent
+        public_url = Path(os.path.relpath(output_dir / folder / "public", html_path.parent)).as_posix()
+        hints = "\n".join(
+            f'<link rel="preload" href="{public_url}/{manifest.get(file, file)}" as="fetch" crossorigin="anonymous">'
+            for file in used
+        )
+        _inject_into_head(html_path, hints)
+        logger.info(f"Added {len(used)} preload hints to {html_path}")
+
+
+def _fingerprint_assets(output_dir: Path) -> Dict[str, Dict[str, str]]:
+    """Add content-hash fingerprints to the data assets in every public directory.
+
+    Each data file (CSV, JSON, Parquet, Arrow) inside a public/ directory of the output
+    is copied to a name that embeds the first eight hex digits of its SHA-256 digest,
+    e.g. dm_customer_360.csv -> dm_customer_360.1a2b3c4d.csv. The fingerprinted file is
+    the canonical variant, the one that is precached and precompressed; the original is
+    kept only so that hard-coded references keep working. An asset manifest that names
+    the canonical variant and maps the logical names to the fingerprinted ones is written
+    into the same public/ directory, where the apps read it to resolve URLs that can be
+    cached indefinitely.
+
+    Args:
+        output_dir (Path): Directory containing the exported site
+
+    Returns:
+        Dict[str, Dict[str, str]]: Manifest for each public directory, keyed by the
+                                   directory path relative to output_dir
+    """
+    manifests: Dict[str, Dict[str, str]] = {}
+
+    for public_dir in sorted(p for p in output_dir.rglob("public") if p.is_dir()):
+        manifest: Dict[str, str] = {}
+        for asset in sorted(public_dir.rglob("*")):
+            # Skip directories, non-data files and the manifests themselves
+            if not asset.is_file() or asset.suffix not in FINGERPRINT_SUFFIXES:
+                continue
+            if asset.name.endswith("manifest.json"):
+                continue
+
+            digest = hashlib.sha256(asset.read_bytes()).hexdigest()[:8]
+            fingerprinted = asset.with_name(f"{asset.stem}.{digest}{asset.suffix}")
+            shutil.copy2(asset, fingerprinted)
+            manifest[asset.relative_to(public_dir).as_posix()] = fingerprinted.relative_to(public_dir).as_posix()
+
+        if manifest:
+            manifest_path = public_dir / ASSET_MANIFEST_NAME
+            manifest_path.write_text(json.dumps({"canonical": "fingerprinted", "files": manifest}, indent=2, sort_keys=True))
+            manifests[public_dir.relative_to(output_dir).as_posix()] = manifest
+            logger.info(f"Fingerprinted {len(manifest)} assets in {public_dir}")
+
+    return manifests
+
+
+def _compress_assets(output_dir: Path, min_size: int = 1024, manifests: Dict[str, Dict[str, str]] | None = None) -> Dict[str, int]:
+    """Write gzip and brotli variants of the text assets in the output directory.
+
+    Every text asset (HTML, CSS, JS, JSON, CSV, SVG, ...) of at least min_size bytes gets
+    a .gz and a .br sibling, compressed at the highest level, so that a server can send
+    the precompressed file instead of compressing on every request. A variant is only
+    written if it is actually smaller than the original. Fingerprinted assets are only
+    compressed under their canonical, fingerprinted name, not under their plain name.
+
+    Args:
+        output_dir (Path): Directory containing the exported site
+        min_size (int, optional): Files smaller than this are not worth compressing.
+                                  Defaults to 1024.
+        manifests (Dict[str, Dict[str, str]] | None, optional): Asset manifests as returned
+                                  by _fingerprint_assets. Defaults to None.
+
+    Returns:
+        Dict[str, int]: Number of files compressed and total original, gzip and brotli bytes
+    """
+    totals = {"files": 0, "original_bytes": 0, "gzip_bytes": 0, "brotli_bytes": 0}
+    # Plain names of fingerprinted assets, which are served as is
+    originals = {output_dir / public_dir / name for public_dir, manifest in (manifests or {}).items() for name in manifest}
+
+    for asset in sorted(output_dir.rglob("*")):
+        if not asset.is_file() or asset.suffix not in COMPRESSIBLE_SUFFIXES or asset in originals:
+            continue
+        data = asset.read_bytes()
+        if len(data) < min_size:
+            continue
+
+        # mtime=0 keeps the gzip output byte-identical across builds
+        variants = {
+            ".gz": ("gzip_bytes", gzip.compress(data, compresslevel=9, mtime=0)),
+            ".br": ("brotli_bytes", brotli.compress(data, quality=11)),
+        }
+        totals["files"] += 1
+        totals["original_bytes"] += len(data)
+        for suffix, (total_key, compressed) in variants.items():
+            if len(compressed) < len(data):
+                asset.with_name(asset.name + suffix).write_bytes(compressed)
+                totals[total_key] += len(compressed)
+            else:
+                totals[total_key] += len(data)
+
+    logger.info(
+        f"Precompressed {totals['files']} assets: {totals['original_bytes']:,} bytes -> "
+        f"{totals['gzip_bytes']:,} (gzip) / {totals['brotli_bytes']:,} (brotli)"
+    )
+    return totals
+
+
+def _generate_service_worker(output_dir: Path, pages: List[str], manifests: Dict[str, Dict[str, str]], marts: Dict[str, dict]) -> None:
+    """Generate a service worker that precaches the exported pages and data assets.
+
+    The pages, the asset manifests and the data assets of the build are precached in a
+    cache named after a hash of their contents, so every build that changes something
+    installs a fresh cache. Mart files get a separate cache named after the mart versions
+    from the marts manifest, so they are only downloaded again when a mart changes.
+    The exported app pages register the worker as well, so that a first visit that
+    lands directly on an app is cached too.
+
+    Args:
+        output_dir (Path): Directory containing the exported site
+        pages (List[str]): HTML paths of the exported notebooks and apps, relative to output_dir
+        manifests (Dict[str, Dict[str, str]]): Asset manifests as returned by _fingerprint_assets
+        marts (Dict[str, dict]): Marts manifest of the apps as returned by _pack_marts
+
+    Returns:
+        None
+    """
+    # Register the worker from every exported page; the index registers it through its template
+    for page in pages:
+        html_path = output_dir / page
+        sw_url = Path(os.path.relpath(output_dir / SERVICE_WORKER_NAME, html_path.parent)).as_posix()
+        _inject_into_head(
+            html_path,
+            f'<script>if ("serviceWorker" in navigator) navigator.serviceWorker.register("{sw_url}");</script>',
+        )
+
+    # Marts are cached by version; the fingerprinted name is used when there is one
+    apps_manifest = manifests.get("apps/public", {})
+    mart_urls = [f"apps/public/{apps_manifest.get(entry['file'], entry['file'])}" for entry in marts.values()]
+
+    precache_urls = ["./", "index.html", *pages]
+    for public_dir, manifest in manifests.items():
+        precache_urls.append(f"{public_dir}/{ASSET_MANIFEST_NAME}")
+        # The other formats of a mart are never loaded, so they are not worth precaching
+        precache_urls.extend(
+            f"{public_dir}/{fingerprinted}" for name, fingerprinted in manifest.items() if Path(name).stem not in marts
+        )
+    if marts:
+        precache_urls.append(f"apps/public/{MARTS_MANIFEST_NAME}")
+    precache_urls = [url for url in dict.fromkeys(precache_urls) if url not in mart_urls]
+
+    # Hash the content of everything that is cached so that any change yields a new version
+    digest = hashlib.sha256()
+    for url in precache_urls + mart_urls:
+        path = output_dir / url
+        if path.is_file():
+            digest.update(url.encode() + path.read_bytes())
+    build_version = digest.hexdigest()[:12]
+    marts_version = hashlib.sha256("".join(e["version"] for e in marts.values()).encode()).hexdigest()[:12]
+
+    try:
+        env = jinja2.Environment(loader=jinja2.FileSystemLoader(SERVICE_WORKER_TEMPLATE.parent))
+        rendered_js = env.get_template(SERVICE_WORKER_TEMPLATE.name).render(
+            build_version=build_version,
+            marts_version=marts_version,
+            precache_urls=precache_urls,
+            mart_urls=mart_urls,
+            runtime_origins=RUNTIME_ORIGINS,
+        )
+        (output_dir / SERVICE_WORKER_NAME).write_text(rendered_js)
+        logger.info(
+            f"Generated {SERVICE_WORKER_NAME} (version {build_version}) precaching "
+            f"{len(precache_urls)} files and {len(mart_urls)} marts"
+        )
+    except (IOError, jinja2.exceptions.TemplateError) as e:
+        logger.error(f"Error generating the service worker: {e}")
+
+
+def _embed_snapshots(output_dir: Path, notebook_path: Path, python: Path | None = None) -> bool:
+    """Render static snapshots of every dashboard view and embed them in the exported page.
+
+    The notebook is run headlessly, in its shared environment or one built from its script
+    header, once for each data mart (the Customer 360 run is the default all-customers view). The
+    resulting figures are embedded in the exported page as plotly JSON together with a
+    small script that paints them with plotly.js as soon as the page loads, and removes
+    them once the live dashboard has rendered its first chart. Visitors see charts right
+    away instead of waiting for Pyodide, pandas and plotly to load.
+
+    Args:
+        output_dir (Path): Directory containing the exported site
+        notebook_path (Path): Path to the dashboard notebook (.py file)
+        python (Path | None, optional): Python of the notebook's shared environment.
+                                        Defaults to None.
+
+    Returns:
+        bool: True if the snapshots were embedded, False otherwise
+    """
+    html_path = output_dir / notebook_path.with_suffix(".html")
+    if not html_path.exists():
+        logger.debug(f"{html_path} was not exported, skipping snapshots")
+        return False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result_path = Path(tmp) / "snapshots.json"
+        cmd = _python_command(notebook_path, python)
+        cmd.extend(["-c", SNAPSHOT_RUNNER, str(notebook_path), str(result_path)])
+
+        try:
+            logger.debug(f"Running command: {cmd}")
+            subprocess.run(cmd, capture_output=True, text=True, check=True)
+            result = json.loads(result_path.read_text())
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Error rendering snapshots of {notebook_path}:")
+            logger.error(f"Command output: {e.stderr}")
+            return False
+        except Exception as e:
+            logger.error(f"Unexpected error rendering snapshots of {notebook_path}: {e}")
+            return False
+
+    try:
+        env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(SNAPSHOTS_TEMPLATE.parent),
+            autoescape=jinja2.select_autoescape(["html", "xml"])
+        )
+        snippet = env.get_template(SNAPSHOTS_TEMPLATE.name).render(**result)
+    except jinja2.exceptions.TemplateError as e:
+        logger.error(f"Error rendering template: {e}")
+        return False
+
+    _inject_into_head(html_path, snippet)
+    figures = sum(len(snapshot["figures"]) for snapshot in result["snapshots"])
+    logger.info(f"Embedded {len(result['snapshots'])} view snapshots ({figures} figures, {len(snippet):,} bytes) in {html_path}")
+    return True
+
+
+def _refresh_forecast(
+    script: Path = FORECAST_SCRIPT,
+    input: Path = FORECAST_INPUT,
+    output: Path = FORECAST_OUTPUT,
+) -> bool:
+    """Regenerate the loss ratio forecast of the dashboard if its mart changed.
+
+    The forecast records the content version (sha256[:12]) of the dm_insurance_profitability
+    it was simulated from. While that matches the current mart, the simulation is skipped
+    and the tracked forecast file is left untouched; otherwise a changed mart can never
+    ship with a stale forecast.
+
+    Args:
+        script (Path, optional): Path to the simulation script. Defaults to FORECAST_SCRIPT.
+        input (Path, optional): The mart the forecast is simulated from. Defaults to FORECAST_INPUT.
+        output (Path, optional): The forecast table. Defaults to FORECAST_OUTPUT.
+
+    Returns:
+        bool: True if the forecast was regenerated, False otherwise
+    """
+    if not script.exists() or not input.exists():
+        logger.debug(f"{script} or {input} not found, skipping the forecast")
+        return False
+
+    version = hashlib.sha256(input.read_bytes()).hexdigest()[:12]
+    try:
+        recorded = pd.read_csv(output, usecols=["mart_version"], dtype=str)["mart_version"]
+        if len(recorded) and (recorded == version).all():
+            logger.info(f"The loss ratio forecast is up to date with {input} ({version})")
+            return False
+    except (FileNotFoundError, ValueError):
+        # No forecast yet, or one without the version column
+        pass
+
+    cmd = _python_command(script)
+    cmd.extend([str(script), "--input", str(input), "--output", str(output)])
+    try:
+        logger.debug(f"Running command: {cmd}")
+        start = time.perf_counter()
+        subprocess.run(cmd, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error running {script}:")
+        logger.error(f"Command output: {e.stderr}")
+        return False
+
+    logger.info(f"Regenerated the loss ratio forecast with {script} in {time.perf_counter() - start:.1f}s")
+    return True
+
+
+def _inject_telemetry(output_dir: Path, pages: List[str]) -> None:
+    """Inject the startup telemetry hook into exported app pages.
+
+    The hook records performance.mark timings of the startup milestones of a page: the
+    Pyodide runtime ready, the notebook's packages loaded, the first cell output and the
+    first chart rendered. It follows the runtime by watching the messages of the marimo
+    web worker. The marks are shown in an on-page overlay, with a button to download them
+    as JSON; nothing is sent to a server.
+
+    Args:
+        output_dir (Path): Directory containing the exported site
+        pages (List[str]): HTML paths of the exported apps, relative to output_dir
+
+    Returns:
+        None
+    """
+    try:
+        env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(TELEMETRY_TEMPLATE.parent),
+            autoescape=jinja2.select_autoescape(["html", "xml"])
+        )
+        template = env.get_template(TELEMETRY_TEMPLATE.name)
+    except jinja2.exceptions.TemplateError as e:
+        logger.error(f"Error loading the telemetry template: {e}")
+        return
+
+    for page in pages:
+        _inject_into_head(output_dir / page, template.render(page=page))
+    logger.info(f"Injected startup telemetry into {len(pages)} app pages")
+
+
+def _script_header(notebook_path: Path) -> dict:
+    """Read the PEP 723 script header of a notebook.
+
+    Args:
+        notebook_path (Path): Path to the marimo notebook (.py file)
+
+    Returns:
+        dict: The header's fields, such as "requires-python" and "dependencies"; empty if
+              the notebook has no script header
+    """
+    source = notebook_path.read_text(encoding="utf-8")
+    match = re.search(r"(?m)^# /// script$\s(?P<content>(^#(| .*)$\s)+)^# ///$", source)
+    if match is None:
+        return {}
+
+    content = "".join(line[2:] if line.startswith("# ") else line[1:] for line in match.group("content").splitlines(keepends=True))
+    return tomllib.loads(content)
+
+
+def _script_dependencies(notebook_path: Path) -> List[str]:
+    """Read the dependencies declared in the PEP 723 script header of a notebook.
+
+    Args:
+        notebook_path (Path): Path to the marimo notebook (.py file)
+
+    Returns:
+        List[str]: Dependency specifiers, empty if the notebook has no script header
+    """
+    return _script_header(notebook_path).get("dependencies", [])
+
+
+def _python_command(notebook_path: Path, python: Path | None = None) -> List[str]:
+    """Return the command that starts Python with the dependencies of a notebook.
+
+    Args:
+        notebook_path (Path): Path to the marimo notebook (.py file)
+        python (Path | None, optional): Python of the notebook's shared environment. Defaults
+                                        to None, which runs uv with the script dependencies.
+
+    Returns:
+        List[str]: The command, to be extended with the arguments of Python
+    """
+    if python is not None:
+        return [str(python)]
+    cmd: List[str] = ["uv", "run", "--no-project", "--quiet"]
+    for dependency in _script_dependencies(notebook_path):
+        cmd.extend(["--with", dependency])
+    cmd.append("python")
+    return cmd
+
+
+def _prepare_environments(notebooks: List[Path], cache_dir: Path) -> Tuple[Dict[Path, Path], dict]:
+    """Create one warm environment per distinct script header, shared by its notebooks.
+
+    `marimo export --sandbox` resolves and installs an environment from the script header
+    for every export. Instead, the notebooks are grouped by their Python requirement and
+    dependencies (with marimo added when missing), and each group gets one environment,
+    installed with uv into cache_dir under a hash of the group's requirements. An
+    environment that is already there from an earlier build is used as it is. The time
+    saved is estimated from the install time of each environment, which the sandbox would
+    have spent once per notebook.
+
+    Args:
+        notebooks (List[Path]): Notebooks to export
+        cache_dir (Path): Directory of the environments, kept across builds
+
+    Returns:
+        Tuple[Dict[Path, Path], dict]: Python of the environment of each notebook (notebooks
+            whose environment could not be created are left out and exported in a sandbox),
+            and a report with "environments", "setup_time_s" and "estimated_time_saved_s"
+    """
+    groups: Dict[Tuple[str, Tuple[str, ...]], List[Path]] = {}
+    for notebook in notebooks:
+        header = _script_header(notebook)
+        dependencies = {re.sub(r"\s+", "", dependency) for dependency in header.get("dependencies", [])}
+        if not any(re.match(r"marimo(\W|$)", dependency, re.IGNORECASE) for dependency in dependencies):
+            dependencies.add("marimo")
+        key = (header.get("requires-python", ""), tuple(sorted(dependencies)))
+        groups.setdefault(key, []).append(notebook)
+
+    environments: Dict[Path, Path] = {}
+    records: List[dict] = []
+    for (requires_python, dependencies), members in groups.items():
+        digest = hashlib.sha256(json.dumps([requires_python, dependencies]).encode()).hexdigest()[:12]
+        env_dir = cache_dir / digest
+        python = env_dir / ("Scripts" if os.name == "nt" else "bin") / ("python.exe" if os.name == "nt" else "python")
+        marker = env_dir / ENV_MARKER_NAME
+        cached = marker.is_file() and python.exists()
+        start = time.perf_counter()
+
+        try:
+            if cached:
+                install_time_s = json.loads(marker.read_text())["install_time_s"]
+            else:
+                shutil.rmtree(env_dir, ignore_errors=True)
+                cmd: List[str] = ["uv", "venv", "--quiet", str(env_dir)]
+                if requires_python:
+                    cmd.extend(["--python", requires_python])
+                logger.debug(f"Running command: {cmd}")
+                subprocess.run(cmd, capture_output=True, text=True, check=True)
+                cmd = ["uv", "pip", "install", "--quiet", "--python", str(python), *dependencies]
+                logger.debug(f"Running command: {cmd}")
+                subprocess.run(cmd, capture_output=True, text=True, check=True)
+                install_time_s = round(time.perf_counter() - start, 3)
+                # Written last, so an interrupted install is redone by the next build
+                marker.write_text(json.dumps({
+                    "requires_python": requires_python,
+                    "dependencies": list(dependencies),
+                    "install_time_s": install_time_s,
+                }, indent=2))
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Error creating the environment for {', '.join(map(str, members))}, exporting them in a sandbox:")
+            logger.error(f"Command output: {e.stderr}")
+            continue
+        except Exception as e:
+            logger.error(f"Unexpected error creating the environment for {', '.join(map(str, members))}: {e}")
+            continue
+
+        setup_time_s = round(time.perf_counter() - start, 3)
+        environments.update({notebook: python for notebook in members})
+        records.append({
+            "environment": env_dir.as_posix(),
+            "requires_python": requires_python,
+            "dependencies": list(dependencies),
+            "notebooks": [notebook.as_posix() for notebook in members],
+            "cached": cached,
+            "install_time_s": install_time_s,
+            "setup_time_s": setup_time_s,
+            # A sandbox export installs the environment once per notebook
+            "estimated_time_saved_s": round(
+                len(members) * install_time_s - setup_time_s if cached else (len(members) - 1) * install_time_s, 3
+            ),
+        })
+        logger.info(
+            f"{'Reused' if cached else 'Created'} environment {digest} for {len(members)} notebooks "
+            f"in {setup_time_s:.1f}s (install time {install_time_s:.1f}s)"
+        )
+
+    report = {
+        "environments": records,
+        "setup_time_s": round(sum(record["setup_time_s"] for record in records), 3),
+        "estimated_time_saved_s": round(sum(record["estimated_time_saved_s"] for record in records), 3),
+    }
+    logger.info(
+        f"Prepared {len(records)} shared environments for {len(environments)} notebooks in "
+        f"{report['setup_time_s']:.1f}s, saving an estimated {report['estimated_time_saved_s']:.1f}s of installs"
+    )
+    return environments, report
+
+
+def _notebook_imports(notebook_path: Path) -> List[str]:
+    """List the third-party modules a notebook imports, in the order they are imported.
+
+    The standard library and marimo itself (which is part of the runtime) are left out.
+
+    Args:
+        notebook_path (Path): Path to the marimo notebook (.py file)
+
+    Returns:
+        List[str]: Imported module names, e.g. ["pandas", "plotly.express"]
+    """
+    tree = ast.parse(notebook_path.read_text(encoding="utf-8"))
+    nodes = sorted(
+        (node for node in ast.walk(tree) if isinstance(node, (ast.Import, ast.ImportFrom))),
+        key=lambda node: (node.lineno, node.col_offset),
+    )
+
+    modules: List[str] = []
+    for node in nodes:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        else:
+            names = [node.module] if node.module and node.level == 0 else []
+        for name in names:
+            top_level = name.split(".")[0]
+            if top_level in sys.stdlib_module_names or top_level == "marimo" or name in modules:
+                continue
+            modules.append(name)
+    return modules
+
+
+def _download_size(url: str, size_cache: Dict[str, int | None], offline: bool = False) -> int | None:
+    """Get the size of a remote file from the Content-Length of a HEAD request.
+
+    Args:
+        url (str): URL of the file
+        size_cache (Dict[str, int | None]): Sizes already looked up, shared across notebooks
+        offline (bool, optional): Only use the sizes already looked up. Defaults to False.
+
+    Returns:
+        int | None: Size in bytes, or None if it could not be determined
+    """
+    if url not in size_cache and not offline:
+        try:
+            request = urllib.request.Request(url, method="HEAD")
+            with urllib.request.urlopen(request, timeout=LOOKUP_TIMEOUT_S) as response:
+                length = response.headers.get("Content-Length")
+                size_cache[url] = int(length) if length is not None else None
+        except Exception as e:
+            logger.warning(f"Could not get the size of {url}: {e}")
+            size_cache[url] = None
+    return size_cache.get(url)
+
+
+def _package_downloads(
+    modules: List[str],
+    pyodide_lock: dict,
+    size_cache: Dict[str, int | None],
+    distributions: Dict[str, List[str]] | None = None,
+    offline: bool = False,
+) -> List[dict]:
+    """Estimate the packages an app downloads under Pyodide for its imports.
+
+    Modules provided by the Pyodide distribution are resolved to their package and its
+    dependency closure from the Pyodide lock file. Anything else is installed from PyPI
+    by micropip as a pure-Python wheel, whose size is taken from the PyPI JSON API for
+    the version installed in the notebook's environment. Without a known version the
+    size is left unknown, since the latest release changes from one build to the next.
+
+    Args:
+        modules (List[str]): Module names imported by the notebook
+        pyodide_lock (dict): Parsed pyodide-lock.json of the Pyodide release
+        size_cache (Dict[str, int | None]): Sizes already looked up, shared across notebooks
+        distributions (Dict[str, List[str]] | None, optional): Installed distribution name and
+                                                               version of each top-level module
+        offline (bool, optional): Only use the sizes already looked up. Defaults to False.
+
+    Returns:
+        List[dict]: One entry per package with "package", "source", "version" and "bytes" (None if unknown)
+    """
+    packages = pyodide_lock.get("packages", {})
+    import_to_package = {imp: name for name, pkg in packages.items() for imp in pkg.get("imports", [])}
+
+    # Walk the dependency closure of every imported Pyodide package
+    pending = [import_to_package[m.split(".")[0]] for m in modules if m.split(".")[0] in import_to_package]
+    closure: List[str] = []
+    while pending:
+        name = pending.pop()
+        if name in closure or name not in packages:
+            continue
+        closure.append(name)
+        pending.extend(packages[name].get("depends", []))
+
+    downloads = [
+        {
+            "package": name,
+            "source": "pyodide",
+            "version": packages[name].get("version"),
+            "bytes": _download_size(PYODIDE_CDN_URL + packages[name]["file_name"], size_cache, offline),
+        }
+        for name in sorted(closure)
+    ]
+
+    for top_level in sorted({m.split(".")[0] for m in modules} - set(import_to_package)):
+        package, version = (distributions or {}).get(top_level, [top_level, None])
+        pypi_url = f"https://pypi.org/pypi/{package}/{version}/json"
+        if version is not None and pypi_url not in size_cache and not offline:
+            try:
+                with urllib.request.urlopen(pypi_url, timeout=LOOKUP_TIMEOUT_S) as response:
+                    files = json.load(response)["urls"]
+                wheels = [f["size"] for f in files if f["filename"].endswith("-none-any.whl")]
+                size_cache[pypi_url] = wheels[0] if wheels else None
+            except Exception as e:
+                logger.warning(f"Could not look up {package} {version} on PyPI: {e}")
+                size_cache[pypi_url] = None
+        downloads.append({"package": package, "source": "pypi", "version": version, "bytes": size_cache.get(pypi_url)})
+
+    return downloads
+
+
+def _load_pyodide_lock() -> Tuple[dict, bool]:
+    """Load the package index of the pinned Pyodide release, from the profile cache if it is there.
+
+    Returns:
+        Tuple[dict, bool]: The parsed pyodide-lock.json (empty if it could not be loaded), and
+                           whether it was fetched or cached, i.e. whether lookups can be made
+    """
+    lock_file = PROFILE_CACHE_DIR / f"pyodide-lock-{PYODIDE_CDN_URL.rstrip('/').split('/')[-2]}.json"
+    if lock_file.exists():
+        return json.loads(lock_file.read_text()), True
+    try:
+        with urllib.request.urlopen(PYODIDE_CDN_URL + "pyodide-lock.json", timeout=LOOKUP_TIMEOUT_S) as response:
+            pyodide_lock = json.load(response)
+    except Exception as e:
+        logger.warning(f"Could not load the Pyodide package index, download sizes will be missing: {e}")
+        return {}, False
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    lock_file.write_text(json.dumps(pyodide_lock))
+    return pyodide_lock, True
+
+
+def _profile_startup(notebooks: List[Path], environments: Dict[Path, Path] | None = None) -> Dict[str, dict]:
+    """Profile the startup cost of exported notebooks: import times and package downloads.
+
+    For every notebook, its third-party imports are timed one by one, in notebook order,
+    inside an environment built from its script header, and the packages Pyodide has to
+    download for them are sized from the Pyodide package index and PyPI. Import times
+    are measured with CPython on the build machine; under Pyodide they are several times
+    slower but rank the same way, which is what matters for finding the slow imports.
+
+    The sizes need network access the first time. They are cached in PROFILE_CACHE_DIR,
+    and a build that cannot reach the Pyodide CDN leaves the sizes it has not cached
+    unknown (None) instead of failing.
+
+    Args:
+        notebooks (List[Path]): Notebooks to profile
+        environments (Dict[Path, Path] | None, optional): Python of the shared environment of
+                                                          each notebook
+
+    Returns:
+        Dict[str, dict]: Profile of each notebook with "imports", "packages" and
+                         "download_bytes", keyed by the notebook path
+    """
+    pyodide_lock, online = _load_pyodide_lock()
+    sizes_file = PROFILE_CACHE_DIR / "download-sizes.json"
+    size_cache: Dict[str, int | None] = json.loads(sizes_file.read_text()) if sizes_file.exists() else {}
+    profiles: Dict[str, dict] = {}
+
+    for notebook in notebooks:
+        modules = _notebook_imports(notebook)
+        cmd = _python_command(notebook, (environments or {}).get(notebook))
+        cmd.extend(["-c", IMPORT_TIMER, *modules])
+
+        try:
+            logger.debug(f"Running command: {cmd}")
+            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+            timed = json.loads(result.stdout.strip().splitlines()[-1])
+            imports, distributions = timed["imports"], timed["distributions"]
+        except Exception as e:
+            logger.error(f"Error timing the imports of {notebook}: {e}")
+            imports, distributions = [{"module": m, "import_time_s": None} for m in modules], {}
+
+        packages = _package_downloads(modules, pyodide_lock, size_cache, distributions, offline=not online)
+        profile = {
+            "imports": imports,
+            "packages": packages,
+            # A lower bound when some sizes are unknown
+            "download_bytes": sum(p["bytes"] or 0 for p in packages),
+            "unknown_sizes": sum(p["bytes"] is None for p in packages),
+        }
+        profiles[notebook.as_posix()] = profile
+
+        slowest = max(imports, key=lambda i: i["import_time_s"] or 0, default=None)
+        logger.info(
+            f"Startup profile of {notebook}: {len(packages)} packages, {profile['download_bytes']:,} bytes to download"
+            + (f" ({profile['unknown_sizes']} sizes unknown)" if profile["unknown_sizes"] else "")
+            + (f", slowest import {slowest['module']} ({slowest['import_time_s']}s)" if slowest else "")
+        )
+
+    # Failed lookups are not kept, so that a build with network access fills them in
+    known = {url: size for url, size in size_cache.items() if size is not None}
+    sizes_file.parent.mkdir(parents=True, exist_ok=True)
+    sizes_file.write_text(json.dumps(known, indent=2, sort_keys=True))
+    return profiles
+
+
+def _build_report(folder_reports: List[dict], build_time_s: float) -> dict:
+    """Summarize the export records of a build.
+
+    Args:
+        folder_reports (List[dict]): Folder reports as returned by _export
+        build_time_s (float): Wall time of the whole build in seconds
+
+    Returns:
+        dict: Report with the folder reports and a "totals" entry covering the whole build
+    """
+    exports = [record for folder_report in folder_reports for record in folder_report["exports"]]
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "folders": folder_reports,
+        "totals": {
+            "exports": len(exports),
+            "failed": sum(1 for record in exports if not record["success"]),
+            "export_time_s": round(sum(record["wall_time_s"] for record in exports), 3),
+            "html_bytes": sum(record["html_bytes"] for record in exports),
+            "public_bytes": sum(folder_report["public_bytes"] for folder_report in folder_reports),
+            "build_time_s": round(build_time_s, 3),
+        },
+    }
+
 
 def main(
     output_dir: Union[str, Path] = "_site",
     template: Union[str, Path] = "templates/tailwind.html.j2",
+    fingerprint: bool = True,
+    compress: bool = True,
+    report_in_index: bool = False,
+    pack_marts: bool = True,
+    profile_startup: bool = False,
+    service_worker: bool = True,
+    snapshots: bool = True,
+    telemetry: bool = True,
+    shared_envs: bool = True,
+    env_cache_dir: Union[str, Path] = ENV_CACHE_DIR,
+    forecast: bool = True,
 ) -> None:
     """Main function to export marimo notebooks.
 
     This function:
     1. Parses command line arguments
-    2. Exports all marimo notebooks in the 'notebooks' and 'apps' directories
-    3. Generates an index.html file that lists all the notebooks
+    2. Regenerates the loss ratio forecast read by the dashboard if its mart changed
+    3. Exports all marimo notebooks in the 'notebooks' and 'apps' directories, in shared
+       environments grouped by script header
+    4. Bundles the data marts of the apps as Parquet and adds preload hints for them,
+       embeds static snapshots of the dashboard views and injects the startup telemetry hook
+    5. Fingerprints the data assets and writes the asset manifests
+    6. Generates an index.html file that lists all the notebooks
+       and a service worker that precaches the exported site
+    7. Writes precompressed gzip and brotli variants of the text assets
+    8. Writes build-report.json with the time and size of every export
 
     Command line arguments:
         --output-dir: Directory where the exported files will be saved (default: _site)
         --template: Path to the template file (default: templates/index.html.j2)
+        --fingerprint: Add content-hash fingerprints to data assets (default: True)
+        --compress: Write .gz and .br variants of text assets (default: True)
+        --report-in-index: Render the build report in the index page (default: False)
+        --pack-marts: Bundle the app data marts as Parquet with preload hints (default: True)
+        --profile-startup: Add per-import times and package download sizes of each export
+                           to the build report. Sizes are looked up on the Pyodide CDN and
+                           PyPI and cached in .cache/startup-profile; offline, the ones not
+                           cached yet are left unknown (default: False)
+        --service-worker: Generate and register a service worker for offline caching (default: True)
+        --snapshots: Embed static snapshots of the dashboard views in its page (default: True)
+        --telemetry: Record startup timings in the exported apps, with an overlay and a
+                     JSON download (default: True)
+        --shared-envs: Export in one cached environment per distinct script header instead
+                       of a sandbox per notebook (default: True)
+        --env-cache-dir: Directory of the shared environments (default: .cache/build-envs)
+        --forecast: Regenerate the loss ratio forecast before the export when the mart it
+                    is simulated from changed (default: True)
 
     Returns:
         None
     """
     logger.info("Starting marimo build process")
+    build_start = time.perf_counter()
 
     # Convert output_dir explicitly to Path (not done by fire)
     output_dir: Path = Path(output_dir)
@@ -236,11 +1227,21 @@ def main(
     template_file: Path = Path(template)
     logger.info(f"Using template file: {template_file}")
 
+    # Install one environment per distinct script header, instead of one per export
+    environments, environments_report = {}, None
+    if shared_envs:
+        notebooks = [nb for folder in (Path("notebooks"), Path("apps")) if folder.exists() for nb in folder.rglob("*.py")]
+        environments, environments_report = _prepare_environments(notebooks, Path(env_cache_dir))
+
+    # Keep the forecast in step with the marts it is simulated from
+    if forecast:
+        _refresh_forecast()
+
     # Export notebooks from the notebooks/ directory
-    notebooks_data = _export(Path("notebooks"), output_dir, as_app=False)
+    notebooks_data, notebooks_report = _export(Path("notebooks"), output_dir, as_app=False, environments=environments)
 
     # Export apps from the apps/ directory
-    apps_data = _export(Path("apps"), output_dir, as_app=True)
+    apps_data, apps_report = _export(Path("apps"), output_dir, as_app=True, environments=environments)
 
     # Exit if no notebooks or apps were found
     if not notebooks_data and not apps_data:
@@ -256,8 +1257,64 @@ def main(
         shutil.copytree(layouts_dir, dest_layouts)
         logger.info(f"Copied layouts directory to {dest_layouts}")
 
+    # Bundle the data marts of the apps as Parquet for the WebAssembly build
+    apps_public = output_dir / "apps" / "public"
+    marts = _pack_marts(apps_public) if pack_marts and apps_public.is_dir() else {}
+
+    # Fingerprint data assets so they can be served with long-term cache headers
+    manifests = _fingerprint_assets(output_dir) if fingerprint else {}
+
+    # Let the browser start downloading the marts while the runtime boots
+    if marts:
+        _add_preload_hints(output_dir, Path("apps"), marts, manifests.get("apps/public", {}))
+
+    # Paint pre-rendered charts while the WebAssembly runtime boots
+    if snapshots:
+        for notebook_path in SNAPSHOT_APPS:
+            _embed_snapshots(output_dir, notebook_path, python=environments.get(notebook_path))
+
+    # Record how long visitors wait for the runtime, packages and first chart
+    if telemetry:
+        _inject_telemetry(output_dir, [entry["html_path"] for entry in apps_data])
+
+    build_report = _build_report([notebooks_report, apps_report], time.perf_counter() - build_start)
+    if environments_report is not None:
+        build_report["shared_environments"] = environments_report
+
+    # Profile what each exported notebook costs to start under Pyodide
+    if profile_startup:
+        exported = [
+            Path(record["notebook"])
+            for folder_report in build_report["folders"]
+            for record in folder_report["exports"]
+            if record["success"]
+        ]
+        build_report["startup_profile"] = _profile_startup(exported, environments)
+
     # Generate the index.html file that lists all notebooks and apps
-    _generate_index(output_dir=output_dir, notebooks_data=notebooks_data, apps_data=apps_data, template_file=template_file)
+    _generate_index(
+        output_dir=output_dir, notebooks_data=notebooks_data, apps_data=apps_data, template_file=template_file,
+        build_report=build_report if report_in_index else None,
+        service_worker=SERVICE_WORKER_NAME if service_worker else None,
+    )
+
+    # Generate the service worker once every file it precaches is final
+    if service_worker:
+        pages = [entry["html_path"] for entry in notebooks_data + apps_data]
+        _generate_service_worker(output_dir, pages, manifests, marts)
+
+    # Precompress last so that every generated file gets its variants
+    if compress:
+        build_report["compression"] = _compress_assets(output_dir, manifests=manifests)
+
+    # Write the build report, with the total time covering all stages
+    build_report["totals"]["build_time_s"] = round(time.perf_counter() - build_start, 3)
+    report_path = output_dir / "build-report.json"
+    report_path.write_text(json.dumps(build_report, indent=2))
+    logger.info(
+        f"Wrote {report_path}: {build_report['totals']['exports']} exports in "
+        f"{build_report['totals']['export_time_s']:.1f}s, {build_report['totals']['html_bytes']:,} bytes of HTML"
+    )
 
     logger.info(f"Build completed successfully. Output directory: {output_dir}")
 
@@ -0,0 +1,526 @@
+"""
+Multi-core partitioned aggregation over shared-memory column buffers.
+
+This script computes the aggregates behind the profitability and demographics views of
+the dashboard on several cores. A pool of worker processes loads a mart file: every
+worker parses one row partition of it (byte ranges of a CSV file, row groups of a
+Parquet file), factorizes its group columns locally and copies its codes and numeric
+columns into a multiprocessing.shared_memory block of its own. Only the distinct group
+values travel back to the parent, which merges them into global codes. The group-bys
+then run as partial np.bincount sums on the workers, which map the blocks without
+pickling any data, and the small partial results are added up. Parsing, factorizing and
+copying the columns, the expensive steps, thus all run in parallel.
+
+The aggregates are published next to the marts of the dashboard
+(apps/public/<mart>_<aggregate>.csv), stamped with the content version of the mart:
+the dashboard reads them instead of aggregating the mart itself, as long as they match
+the version it shows. The cost matrix and segment totals have the format of the files
+ingest.py maintains incrementally; this script recomputes them from the whole mart.
+
+The script can be run from the command line:
+    uv run .github/scripts/partitioned.py publish MART [--input INPUT] [--directory DIR]
+    uv run .github/scripts/partitioned.py benchmark [--rows ROWS] [--partition-by COLUMN]
+"""
+
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "fire==0.7.0",
+#     "loguru==0.7.0",
+#     "numpy==2.2.6",
+#     "pandas==2.3.0",
+#     "pyarrow==20.0.0"
+# ]
+# ///
+
+import csv
+import hashlib
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import fire
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from loguru import logger
+
+# Aggregates published per mart: name -> (group columns, summed columns, averaged columns).
+# Averaged columns are published as their sum and a <column>_count of non-missing values,
+# so that the dashboard can combine groups; every aggregate has a row count.
+AGGREGATES = {
+    "dm_customer_360": {
+        # Profitability view: cost matrix, segment deviation, loss ratio trend and flows
+        "cost_matrix": (
+            ["occupational_category", "heart_rate_category"], ["lifetime_premiums_paid", "lifetime_claims_amount"], [],
+        ),
+        "segment_totals": (["occupational_category"], ["lifetime_premiums_paid", "lifetime_claims_amount"], []),
+        "monthly_totals": (["sign_up_month"], ["lifetime_premiums_paid", "lifetime_claims_amount"], []),
+        "flows_health": (["occupational_category", "health_status"], [], []),
+        "flows_status": (["health_status", "insurance_status"], [], []),
+    },
+    "dm_health_by_demographics": {
+        # Demographics view: sleep against insurance cost, and heart rate, per age group
+        "age_group_totals": (["age_group"], ["avg_sleep_quality_score"], ["avg_sleep_hours", "avg_insurance_cost"]),
+        "age_gender_heart_rate": (["age_group", "gender"], [], ["avg_heart_rate_bpm"]),
+    },
+}
+
+# Group columns derived from the mart as in the dashboard -> the columns they are derived from
+DERIVED_COLUMNS = {
+    "heart_rate_category": ["current_heart_rate_bpm"],
+    "sign_up_month": ["insurance_sign_up_date", "created_at"],
+}
+
+# Column of the published aggregates with the content version of the mart they match
+VERSION_COLUMN = "mart_version"
+
+# Row partition of a file: row group indexes of a Parquet file, or a (start, end) byte range of a CSV file
+Partition = Union[List[int], Tuple[int, int]]
+
+
+def _partitions(path: Path, parts: int) -> List[Partition]:
+    """Split a file into at most `parts` row partitions of about equal size, as in profile_quality.py.
+
+    CSV byte ranges start at the beginning of a line, after the header; CSV values must
+    not contain line breaks.
+    """
+    if path.suffix == ".parquet":
+        row_groups = list(range(pq.ParquetFile(path).num_row_groups))
+        return [part for part in (row_groups[i::parts] for i in range(parts)) if part]
+
+    size = path.stat().st_size
+    with open(path, "rb") as file:
+        file.readline()
+        offsets = [file.tell()]
+        for i in range(1, parts):
+            file.seek(max(offsets[-1], offsets[0] + (size - offsets[0]) * i // parts))
+            file.readline()
+            offsets.append(min(file.tell(), size))
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
+
+
+class _ByteRange(io.RawIOBase):
+    """Readable view of the bytes [start, end) of a file."""
+
+    def __init__(self, path: Path, start: int, end: int):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer)[:self._remaining]
+        read = self._file.readinto(view)
+        self._remaining -= read
+        return read
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+def _read_partition(path: Path, partition: Partition, columns: List[str]) -> pd.DataFrame:
+    """Read the given columns of one partition; columns missing from the file are left out."""
+    if path.suffix == ".parquet":
+        parquet = pq.ParquetFile(path)
+        available = [column for column in columns if column in parquet.schema_arrow.names]
+        return parquet.read_row_groups(partition, columns=available).to_pandas()
+
+    with open(path, newline="") as file:
+        names = next(csv.reader(file))
+    with _ByteRange(path, *partition) as raw:
+        return pd.read_csv(
+            io.BufferedReader(raw), header=None, names=names, usecols=[c for c in columns if c in names],
+        )
+
+
+def _derive(df: pd.DataFrame) -> pd.DataFrame:
+    """Add the derived group columns whose inputs are present, as in the dashboard."""
+    if "current_heart_rate_bpm" in df:
+        bpm = df["current_heart_rate_bpm"]
+        df["heart_rate_category"] = np.select(
+            [bpm.isna(), bpm > 100, bpm < 60], ["Unknown", "High", "Low"], default="Normal"
+        )
+    date_column = next((c for c in DERIVED_COLUMNS["sign_up_month"] if c in df), None)
+    if date_column is not None:
+        dates = pd.to_datetime(df[date_column], errors="coerce")
+        df["sign_up_month"] = dates.dt.to_period("M").dt.to_timestamp()
+    return df
+
+
+def _hash_partitions(values: pd.Series, parts: int) -> np.ndarray:
+    """Return the partition of every value: a hash of it modulo parts, the same in every worker."""
+    hashes = pd.util.hash_array(values.astype("string").to_numpy(dtype=object, na_value=""))
+    return (hashes % np.uint64(parts)).astype(np.int32)
+
+
+def _block_views(buffer: memoryview, block: dict) -> Dict[str, np.ndarray]:
+    """Map the columns of a shared block as NumPy arrays, without copying."""
+    return {
+        column: np.ndarray((block["rows"],), dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+        for column, (offset, dtype) in block["layout"].items()
+    }
+
+
+def _load_partition(
+    path: Path, partition: Partition, keys: List[str], values: List[str], partition_by: Union[str, None], parts: int
+) -> dict:
+    """Parse one partition of a mart into a new shared block. Runs in a worker process.
+
+    The group columns are factorized locally (missing values are a group of their own),
+    and the rows are ordered by their key partition if there is one, so that every key
+    partition is a contiguous slice of the block.
+
+    Returns:
+        dict: Name, number of rows and column layout of the block, the distinct values of
+            every group column (indexed by the local codes) and the bounds of the key partitions
+    """
+    key_column = partition_by.removeprefix("hash:") if partition_by else None
+    wanted = [c for c in keys + values + ([key_column] if key_column else []) if c not in DERIVED_COLUMNS]
+    wanted += [source for c in keys if c in DERIVED_COLUMNS for source in DERIVED_COLUMNS[c]]
+    df = _derive(_read_partition(path, partition, list(dict.fromkeys(wanted))))
+
+    order, bounds = slice(None), [0, len(df)]
+    if key_column:
+        key_partitions = _hash_partitions(df[key_column], parts)
+        order = np.argsort(key_partitions, kind="stable")
+        bounds = np.searchsorted(key_partitions[order], np.arange(parts + 1)).tolist()
+
+    arrays, uniques = {}, {}
+    for column in values:
+        arrays[column] = df[column].to_numpy(dtype=np.float64)[order]
+    for column in keys:
+        codes, uniques[column] = pd.factorize(df[column], use_na_sentinel=False)
+        arrays[column] = codes.astype(np.int32)[order]
+
+    layout, size = {}, 0
+    for column, array in arrays.items():
+        layout[column] = (size, array.dtype.str)
+        size += -(-array.nbytes // 8) * 8
+    # The block outlives this task: the parent unlinks it when the mart is closed
+    shm = SharedMemory(create=True, size=max(size, 1))
+    block = {"name": shm.name, "rows": len(df), "layout": layout}
+    try:
+        for column, view in _block_views(shm.buf, block).items():
+            view[:] = arrays[column]
+            del view
+    finally:
+        shm.close()
+    return {**block, "uniques": {column: np.asarray(uniques[column]) for column in keys}, "bounds": bounds}
+
+
+def _bincount_groups(
+    slices: List[Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]],
+    by: List[str],
+    values: List[str],
+    shape: Tuple[int, ...],
+) -> Dict[str, np.ndarray]:
+    """Count the rows and sum the values per group over (columns, remaps) slices of blocks."""
+    n_groups = int(np.prod(shape))
+    result = {"count": np.zeros(n_groups, dtype=np.int64)}
+    for column in values:
+        result[column] = np.zeros(n_groups)
+        result[f"{column}_count"] = np.zeros(n_groups, dtype=np.int64)
+
+    for columns, remaps in slices:
+        ids = np.zeros(len(next(iter(columns.values()))), dtype=np.int64)
+        for column, size in zip(by, shape):
+            ids = ids * size + remaps[column][columns[column]]
+        result["count"] += np.bincount(ids, minlength=n_groups)
+        for column in values:
+            known = ~np.isnan(columns[column])
+            result[column] += np.bincount(ids[known], weights=columns[column][known], minlength=n_groups)
+            result[f"{column}_count"] += np.bincount(ids[known], minlength=n_groups)
+    return result
+
+
+def _partial_groupby(
+    tasks: List[Tuple[dict, Dict[str, np.ndarray], int, int]],
+    by: List[str],
+    values: List[str],
+    shape: Tuple[int, ...],
+) -> Dict[str, np.ndarray]:
+    """Group the rows [start, stop) of some shared blocks. Runs in a worker process.
+
+    Each task is a block, the maps from its local codes to the global ones, and a row range.
+    """
+    attached = [SharedMemory(name=block["name"]) for block, _, _, _ in tasks]
+    try:
+        return _bincount_groups(
+            [
+                ({column: view[start:stop] for column, view in _block_views(shm.buf, block).items()}, remaps)
+                for shm, (block, remaps, start, stop) in zip(attached, tasks)
+            ],
+            by, values, shape,
+        )
+    finally:
+        # The views above only live in the call, so the blocks can be closed
+        for shm in attached:
+            shm.close()
+
+
+class PartitionedMart:
+    """Columns of a mart file in shared memory, loaded and aggregated by a pool of worker processes.
+
+    Use it as a context manager, or call close(), to free the shared blocks and the pool.
+
+    Args:
+        path (Union[str, Path]): CSV or Parquet file of the mart
+        keys (List[str]): Columns to group by, including derived ones such as heart_rate_category
+        values (List[str]): Numeric columns to aggregate
+        workers (int, optional): Number of worker processes and of file partitions. Defaults to
+            the number of CPUs.
+        partition_by (Union[str, None], optional): Column, or "hash:<column>" such as hash:PersonID,
+            whose values decide which worker aggregates a row, so that all rows of a key are
+            aggregated by one worker. Both hash the values. Defaults to None: every worker
+            aggregates the rows it loaded.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        keys: List[str],
+        values: List[str],
+        workers: int = None,
+        partition_by: Union[str, None] = None,
+    ):
+        self.path = Path(path)
+        self.workers = workers or os.cpu_count() or 1
+        self.partition_by = partition_by
+        # Workers share the parent's resource tracker, which only unlinks the blocks they
+        # create if this process fails to
+        resource_tracker.ensure_running()
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._blocks: List[dict] = []
+        try:
+            self._blocks = list(self._pool.map(
+                _load_partition, repeat(self.path), _partitions(self.path, self.workers),
+                repeat(keys), repeat(values), repeat(partition_by), repeat(self.workers),
+            ))
+        except Exception:
+            self.close()
+            raise
+
+        # Global codes: the sorted union of the distinct values of every partition, missing last
+        self.uniques = {
+            key: pd.Index(np.concatenate([block["uniques"][key] for block in self._blocks])).unique().sort_values(
+                na_position="last"
+            ) if self._blocks else pd.Index([])
+            for key in keys
+        }
+        self._remaps = [
+            {key: self.uniques[key].get_indexer(block["uniques"][key]).astype(np.int64) for key in keys}
+            for block in self._blocks
+        ]
+        self.rows = sum(block["rows"] for block in self._blocks)
+
+    def groupby(self, by: List[str], sums: List[str] = (), means: List[str] = ()) -> pd.DataFrame:
+        """Group the mart by `by`, summing and averaging columns, on the worker processes.
+
+        Args:
+            by (List[str]): Group columns, among the keys of the mart
+            sums (List[str], optional): Columns to sum; missing values count as zero
+            means (List[str], optional): Columns to average, published as their sum and a
+                <column>_count of non-missing values
+
+        Returns:
+            pd.DataFrame: One row per non-empty group, sorted by `by` with missing values last,
+                with the sums, the mean sums and counts, and a "count" of rows
+        """
+        values = list(dict.fromkeys([*sums, *means]))
+        shape = tuple(len(self.uniques[column]) for column in by)
+        if self.partition_by is None:
+            # One task per block, on the worker count of the loads
+            slices = [[(block, remaps, 0, block["rows"])] for block, remaps in zip(self._blocks, self._remaps)]
+        else:
+            # One task per key partition, over its slice of every block
+            slices = [
+                [(block, remaps, block["bounds"][part], block["bounds"][part + 1])
+                 for block, remaps in zip(self._blocks, self._remaps)]
+                for part in range(self.workers)
+            ]
+        partials = list(self._pool.map(_partial_groupby, slices, repeat(by), repeat(values), repeat(shape)))
+
+        totals = {key: np.sum([partial[key] for partial in partials], axis=0) for key in partials[0]} if partials else {}
+        present = np.flatnonzero(totals.get("count", []))
+        codes = np.unravel_index(present, shape) if len(by) else ()
+        result = pd.DataFrame({column: self.uniques[column].take(code) for column, code in zip(by, codes)})
+        for column in sums:
+            result[column] = totals[column][present]
+        for column in means:
+            result[column] = totals[column][present]
+            result[f"{column}_count"] = totals[f"{column}_count"][present]
+        result["count"] = totals["count"][present] if len(present) else np.zeros(0, dtype=np.int64)
+        return result
+
+    def close(self) -> None:
+        """Unlink the shared blocks and shut the pool down."""
+        for block in self._blocks:
+            try:
+                shm = SharedMemory(name=block["name"])
+                shm.close()
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        self._blocks = []
+        self._pool.shutdown()
+
+    def __enter__(self) -> "PartitionedMart":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def aggregate(
+    mart: str,
+    input: Union[str, Path] = None,
+    workers: int = None,
+    partition_by: Union[str, None] = None,
+) -> Dict[str, pd.DataFrame]:
+    """Compute every aggregate of a mart from one parallel load of it.
+
+    Args:
+        mart (str): Name of the mart, one of AGGREGATES
+        input (Union[str, Path], optional): CSV or Parquet file of the mart. Defaults to apps/public/<mart>.csv.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        partition_by (Union[str, None], optional): Key partitioning, see PartitionedMart
+
+    Returns:
+        Dict[str, pd.DataFrame]: The aggregates by name
+    """
+    if mart not in AGGREGATES:
+        raise ValueError(f"Unknown mart {mart!r}, expected one of {sorted(AGGREGATES)}")
+    specs = AGGREGATES[mart]
+    keys = list(dict.fromkeys(column for by, _, _ in specs.values() for column in by))
+    values = list(dict.fromkeys(column for _, sums, means in specs.values() for column in sums + means))
+    with PartitionedMart(input or f"apps/public/{mart}.csv", keys, values, workers, partition_by) as frame:
+        return {name: frame.groupby(by, sums, means) for name, (by, sums, means) in specs.items()}
+
+
+def publish(
+    mart: str,
+    input: Union[str, Path] = None,
+    directory: Union[str, Path] = "apps/public",
+    workers: int = None,
+) -> List[Path]:
+    """Compute the aggregates of a mart and write them next to the marts of the dashboard.
+
+    Command line arguments:
+        --input: CSV or Parquet file of the mart (default: apps/public/<mart>.csv)
+        --directory: Public directory of the dashboard (default: apps/public)
+        --workers: Number of worker processes (default: number of CPUs)
+
+    Returns:
+        List[Path]: The written files, <mart>_<aggregate>.csv
+    """
+    start = time.perf_counter()
+    input = Path(input or f"apps/public/{mart}.csv")
+    # Same content version as the marts manifest of the build, for a mart published as is
+    version = hashlib.sha256(input.read_bytes()).hexdigest()[:12]
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    written = []
+    for name, result in aggregate(mart, input, workers).items():
+        path = directory / f"{mart}_{name}.csv"
+        result.assign(**{VERSION_COLUMN: version}).to_csv(path, index=False)
+        written.append(path)
+        logger.info(f"Published {path} ({len(result)} groups)")
+    logger.info(f"Aggregated {mart} ({version}) in {time.perf_counter() - start:.2f}s")
+    return written
+
+
+def _pandas_aggregate(mart: str, path: Path) -> Dict[str, pd.DataFrame]:
+    """The aggregates of a mart on one core with pandas, for the benchmark.
+
+    Like the workers, it only parses the columns the aggregates read.
+    """
+    specs = AGGREGATES[mart]
+    columns = set()
+    for by, sums, means in specs.values():
+        columns.update(sums + means + [c for c in by if c not in DERIVED_COLUMNS])
+        columns.update(source for c in by if c in DERIVED_COLUMNS for source in DERIVED_COLUMNS[c])
+    if path.suffix == ".parquet":
+        available = pq.read_schema(path).names
+        df = pd.read_parquet(path, columns=[c for c in available if c in columns])
+    else:
+        df = pd.read_csv(path, usecols=lambda column: column in columns)
+    df = _derive(df)
+    results = {}
+    for name, (by, sums, means) in specs.items():
+        grouped = df.groupby(by, dropna=False, sort=True)
+        result = grouped[list(sums) + list(means)].sum()
+        for column in means:
+            result[f"{column}_count"] = grouped[column].count()
+        result["count"] = grouped.size()
+        results[name] = result.reset_index()
+    return results
+
+
+def _timed(func, *args, **kwargs) -> Tuple[float, object]:
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def benchmark(
+    input: Union[str, Path] = "data/dm_customer_360.csv",
+    rows: int = 3_000_000,
+    file_format: str = "csv",
+    partition_by: Union[str, None] = None,
+    workers: int = None,
+) -> None:
+    """Benchmark the partitioned aggregates of dm_customer_360 against pandas on a replicated mart.
+
+    Both sides start from the file, so parsing is timed too, and the results are checked
+    to be equal.
+
+    Command line arguments:
+        --input: Customer-level CSV or Parquet file (default: data/dm_customer_360.csv)
+        --rows: Number of rows to replicate the input to (default: 3,000,000)
+        --file-format: Format of the replicated mart, csv or parquet (default: csv)
+        --partition-by: Key column, or "hash:<column>" such as hash:PersonID (default: none)
+        --workers: Largest number of worker processes to try (default: number of CPUs)
+
+    Returns:
+        None
+    """
+    input = Path(input)
+    df = pd.read_parquet(input) if input.suffix == ".parquet" else pd.read_csv(input)
+    df = df.sample(rows, replace=True, random_state=0, ignore_index=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / f"dm_customer_360.{file_format}"
+        if file_format == "parquet":
+            df.to_parquet(path, index=False, row_group_size=max(rows // 64, 1))
+        else:
+            df.to_csv(path, index=False)
+        del df
+        logger.info(f"Aggregating {rows:,} rows of {path.name}, partitioned by {partition_by or 'file ranges'}")
+
+        serial_time, expected = _timed(_pandas_aggregate, "dm_customer_360", path)
+        logger.info(f"pandas, 1 core: {serial_time:.2f}s")
+
+        max_workers = workers or os.cpu_count() or 1
+        counts = sorted({1, max_workers} | {2**i for i in range(1, max_workers.bit_length()) if 2**i < max_workers})
+        for count in counts:
+            elapsed, actual = _timed(aggregate, "dm_customer_360", path, count, partition_by)
+            for name, result in actual.items():
+                pd.testing.assert_frame_equal(result, expected[name], check_dtype=False)
+            logger.info(f"partitioned, {count} workers: {elapsed:.2f}s ({serial_time / elapsed:.1f}x pandas)")
+
+
+if __name__ == '__main__':
+    fire.Fire({"publish": publish, "benchmark": benchmark})
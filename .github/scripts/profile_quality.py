@@ -0,0 +1,298 @@
+"""
+Data-quality profiler for the customer-level data.
+
+This script computes the missing, invalid and extreme value counts and percentages
+of dm_data_quality_dashboard from customer-level data such as dm_customer_360, so
+new data can be profiled without the warehouse. It writes a frame with the same
+schema as the mart, with an "All Sources" row and one row per occupation and per
+wealth bracket.
+
+The input is split into row partitions (byte ranges of a CSV file, row groups of a
+Parquet file), and each worker of a process pool parses only its own partition, in
+chunks and only the columns it needs, so the input is parsed once and can be far
+larger than memory.
+
+The script can be run from the command line with optional arguments:
+    uv run .github/scripts/profile_quality.py [--input INPUT] [--output OUTPUT]
+"""
+
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "fire==0.7.0",
+#     "loguru==0.7.0",
+#     "numpy==2.2.6",
+#     "pandas==2.3.0",
+#     "pyarrow==20.0.0"
+# ]
+# ///
+
+import csv
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import repeat
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple, Union
+
+import fire
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from loguru import logger
+
+# Quality checks in the column order of the mart: name -> (input columns, vectorized flag)
+CHECKS = {
+    "missing_blood_oxygen": (
+        ["current_blood_oxygen_pct"],
+        lambda df: df["current_blood_oxygen_pct"].isna(),
+    ),
+    "missing_stress_level": (
+        ["current_stress_level"],
+        lambda df: df["current_stress_level"].isna(),
+    ),
+    "invalid_heart_rate": (
+        ["current_heart_rate_bpm"],
+        lambda df: (df["current_heart_rate_bpm"] <= 0) | (df["current_heart_rate_bpm"] > 300),
+    ),
+    "invalid_steps": (
+        ["current_daily_steps"],
+        lambda df: df["current_daily_steps"] < 0,
+    ),
+    "invalid_blood_oxygen": (
+        ["current_blood_oxygen_pct"],
+        lambda df: (df["current_blood_oxygen_pct"] < 0) | (df["current_blood_oxygen_pct"] > 100),
+    ),
+    "extreme_heart_rate": (
+        ["current_heart_rate_bpm"],
+        lambda df: (df["current_heart_rate_bpm"] < 40) | (df["current_heart_rate_bpm"] > 200),
+    ),
+    "extreme_sleep_hours": (
+        ["current_sleep_hours"],
+        lambda df: (df["current_sleep_hours"] < 3) | (df["current_sleep_hours"] > 12),
+    ),
+    "extreme_step_count": (
+        ["current_daily_steps"],
+        lambda df: df["current_daily_steps"] > 30000,
+    ),
+    "negative_cost": (
+        ["avg_annual_premium"],
+        lambda df: df["avg_annual_premium"] < 0,
+    ),
+    "excessive_claims": (
+        ["avg_annual_claims", "avg_annual_premium"],
+        lambda df: df["avg_annual_claims"] > df["avg_annual_premium"],
+    ),
+}
+
+# data_source value of the mart -> column to group by (None for the whole input)
+GROUPINGS = {
+    "All Sources": None,
+    "By Occupation": "occupational_category",
+    "By Wealth Bracket": "wealth_bracket",
+}
+
+PERSON_COLUMN = "PersonID"
+
+
+def _partitions(path: Path, parts: int) -> List[Union[Tuple[int, int], List[int]]]:
+    """Split the input into at most `parts` partitions of about equal size.
+
+    Parquet files are split into lists of row groups and CSV files into byte ranges that start
+    at the beginning of a line, after the header. CSV values must not contain line breaks.
+
+    Args:
+        path (Path): Path to the CSV or Parquet input
+        parts (int): Maximum number of partitions
+
+    Returns:
+        List[Union[Tuple[int, int], List[int]]]: Row group indexes or (start, end) byte offsets
+    """
+    if path.suffix == ".parquet":
+        row_groups = list(range(pq.ParquetFile(path).num_row_groups))
+        return [part for part in (row_groups[i::parts] for i in range(parts)) if part]
+
+    size = path.stat().st_size
+    with open(path, "rb") as file:
+        file.readline()
+        offsets = [file.tell()]
+        for i in range(1, parts):
+            file.seek(max(offsets[-1], offsets[0] + (size - offsets[0]) * i // parts))
+            file.readline()
+            offsets.append(min(file.tell(), size))
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
+
+
+class _ByteRange(io.RawIOBase):
+    """Readable view of the bytes [start, end) of a file."""
+
+    def __init__(self, path: Path, start: int, end: int):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer)[:self._remaining]
+        read = self._file.readinto(view)
+        self._remaining -= read
+        return read
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+def _read_partition(
+    path: Path, partition: Union[Tuple[int, int], List[int]], columns: List[str], chunk_size: int
+) -> Iterator[pd.DataFrame]:
+    """Yield the given columns of one partition of a CSV or Parquet file in chunks of at most chunk_size rows."""
+    if path.suffix == ".parquet":
+        yield from (
+            batch.to_pandas()
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, row_groups=partition, columns=columns)
+        )
+        return
+
+    with open(path, newline="") as file:
+        names = next(csv.reader(file))
+    with _ByteRange(path, *partition) as raw:
+        yield from pd.read_csv(
+            io.BufferedReader(raw), header=None, names=names, usecols=columns, chunksize=chunk_size
+        )
+
+
+def _group_keys(chunk: pd.DataFrame, column: Union[str, None]) -> pd.Series:
+    """Return the group of every row; the whole input forms the single group "Overall"."""
+    if column is None:
+        return pd.Series("Overall", index=chunk.index)
+    return chunk[column]
+
+
+def _profile_partition(
+    path: Path, partition: Union[Tuple[int, int], List[int]], chunk_size: int
+) -> Dict[str, Tuple[pd.DataFrame, Dict[str, np.ndarray]]]:
+    """Count the records and the rows flagged by each check, per group of every grouping.
+
+    Runs in a worker process, which parses only its own partition of the input and only the
+    columns used by the checks and groupings.
+
+    Args:
+        path (Path): Path to the CSV or Parquet input
+        partition (Union[Tuple[int, int], List[int]]): Byte range or row groups, from _partitions
+        chunk_size (int): Number of rows read at a time
+
+    Returns:
+        Dict[str, Tuple[pd.DataFrame, Dict[str, np.ndarray]]]: Per grouping, total_records and one
+        column per check indexed by group, and the distinct person IDs of every group
+    """
+    group_columns = [column for column in GROUPINGS.values() if column]
+    check_columns = {column for columns, _ in CHECKS.values() for column in columns}
+    columns = sorted(check_columns | set(group_columns) | {PERSON_COLUMN})
+
+    counts = {}
+    persons = {source: {} for source in GROUPINGS}
+    for chunk in _read_partition(path, partition, columns, chunk_size):
+        flags = pd.DataFrame({"total_records": 1, **{name: flag(chunk) for name, (_, flag) in CHECKS.items()}},
+                             index=chunk.index).astype("int64")
+        for source, column in GROUPINGS.items():
+            keys = _group_keys(chunk, column)
+            part = flags.groupby(keys).sum()
+            counts[source] = part if source not in counts else counts[source].add(part, fill_value=0)
+            for group, ids in chunk[PERSON_COLUMN].groupby(keys).unique().items():
+                persons[source].setdefault(group, []).append(ids)
+
+    return {
+        source: (
+            counts.get(source, pd.DataFrame(columns=["total_records", *CHECKS], dtype="int64")),
+            {group: pd.unique(np.concatenate(ids)) for group, ids in persons[source].items()},
+        )
+        for source in GROUPINGS
+    }
+
+
+def profile(path: Union[str, Path], workers: int = None, chunk_size: int = 1_000_000) -> pd.DataFrame:
+    """Profile customer-level data into the schema of dm_data_quality_dashboard.
+
+    The input is split into one partition per worker, so that it is parsed only once in total.
+
+    Args:
+        path (Union[str, Path]): Path to the CSV or Parquet input
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        chunk_size (int, optional): Number of rows a worker reads at a time. Defaults to 1,000,000.
+
+    Returns:
+        pd.DataFrame: One row per data source and quality dimension, as in the mart
+    """
+    path = Path(path)
+    workers = workers or os.cpu_count() or 1
+    partitions = _partitions(path, workers)
+    logger.info(f"Profiling {path} in {len(partitions)} partitions on {workers} worker processes")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_profile_partition, repeat(path), partitions, repeat(chunk_size)))
+
+    frames = []
+    for source in GROUPINGS:
+        counts = pd.concat([result[source][0] for result in results]).groupby(level=0).sum()
+        persons = {}
+        for result in results:
+            for group, ids in result[source][1].items():
+                persons.setdefault(group, []).append(ids)
+
+        frame = pd.DataFrame({
+            "total_records": counts["total_records"].astype("int64"),
+            "unique_persons": pd.Series({group: len(pd.unique(np.concatenate(ids))) for group, ids in persons.items()}),
+        })
+        for name in CHECKS:
+            frame[f"{name}_count"] = counts[name].astype("int64")
+            frame[f"{name}_pct"] = (frame[f"{name}_count"] / frame["total_records"] * 100).round(2)
+        frame = frame.sort_index().rename_axis("quality_dimension").reset_index()
+        frame.insert(0, "data_source", source)
+        frames.append(frame)
+
+    result = pd.concat(frames, ignore_index=True)
+    # Same score as the mart: completeness of the profiled fields
+    result["overall_quality_score"] = (
+        100 - (result["missing_blood_oxygen_pct"] + result["missing_stress_level_pct"]) / 5
+    ).round(2)
+    result["created_at"] = str(datetime.now(timezone.utc))
+    return result
+
+
+def main(
+    input: Union[str, Path] = "data/dm_customer_360.csv",
+    output: Union[str, Path] = "data/dm_data_quality_profile.csv",
+    workers: int = None,
+    chunk_size: int = 1_000_000,
+) -> None:
+    """Profile customer-level data and write the result.
+
+    Command line arguments:
+        --input: CSV or Parquet file with customer-level data (default: data/dm_customer_360.csv)
+        --output: CSV or Parquet file to write (default: data/dm_data_quality_profile.csv)
+        --workers: Number of worker processes (default: number of CPUs)
+        --chunk-size: Number of rows a worker reads at a time (default: 1,000,000)
+
+    Returns:
+        None
+    """
+    start = time.perf_counter()
+    result = profile(input, workers=workers, chunk_size=chunk_size)
+
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if output.suffix == ".parquet":
+        result.to_parquet(output, index=False)
+    else:
+        result.to_csv(output, index=False)
+    logger.info(f"Wrote {len(result)} profile rows to {output} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
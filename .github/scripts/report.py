@@ -0,0 +1,340 @@
+"""
+Batch export of static dashboard reports.
+
+This script runs apps/data_marts_dashboard.py headlessly, like the snapshot step of the
+build, and writes the charts of every mart view as a static HTML page, for readers who
+cannot open the live dashboard. With --customers, it also writes the Customer 360
+drill-down of each listed customer.
+
+Views and batches of customers are rendered on a process pool. Each worker runs the
+notebook once when it starts; for a customer it then only re-runs the cell that builds
+the charts, with the customer selected, so a customer costs about as much as building
+their figures. The pages load one shared copy of plotly.js instead of inlining it, and
+an index page links them all, so the output folder can be zipped and opened offline.
+
+The script can be run from the command line with optional arguments:
+    uv run .github/scripts/report.py [--output-dir OUTPUT_DIR] [--customers CUSTOMERS]
+"""
+
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "fire==0.7.0",
+#     "loguru==0.7.0",
+#     "marimo>=0.16.0",
+#     "pandas>=2.0.0",
+#     "plotly>=5.0.0",
+#     "pyarrow>=14.0.0",
+#     "duckdb>=1.0.0"
+# ]
+# ///
+
+import asyncio
+import html
+import importlib.util
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from types import ModuleType, SimpleNamespace
+from typing import Dict, List, Tuple, Union
+
+import fire
+import pandas as pd
+import plotly.offline
+from loguru import logger
+
+CUSTOMER_MART = "dm_customer_360"
+
+# Customers per task: small enough to spread them over the workers and log progress,
+# large enough that the tasks' overhead does not matter
+MAX_BATCH_SIZE = 250
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+{scripts}<style>
+body {{ font-family: system-ui, sans-serif; margin: 2rem auto; max-width: 1200px; color: #222; }}
+.chart {{ margin-bottom: 2rem; }}
+.error {{ color: #b00020; }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+# State of a worker process: the notebook module, the globals of its default run and
+# those of its Customer 360 run
+_notebook = None
+_defaults = None
+_customer_defs = None
+
+
+def _load_notebook(notebook_path: Path) -> ModuleType:
+    """Import a marimo notebook as a module.
+
+    Args:
+        notebook_path (Path): Path to the notebook
+
+    Returns:
+        ModuleType: The notebook module, with its `app`
+    """
+    spec = importlib.util.spec_from_file_location("report_notebook", notebook_path)
+    notebook = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(notebook)
+    return notebook
+
+
+def _run_view(mart: str) -> Dict:
+    """Run the notebook with a mart selected and no customer.
+
+    Args:
+        mart (str): Name of the mart
+
+    Returns:
+        Dict: The globals defined by the run
+    """
+    _, defs = _notebook.app.run(defs={
+        "mart_names": _defaults["mart_names"],
+        "default_mart": mart,
+        "data_mart_selector": SimpleNamespace(value=mart),
+        "customer_selector": SimpleNamespace(value=None),
+        "display_selector": None,
+    })
+    return defs
+
+
+def _init_worker(notebook_path: Path, with_customers: bool) -> None:
+    """Load the notebook in a worker process.
+
+    Args:
+        notebook_path (Path): Path to the notebook
+        with_customers (bool): Whether to run the Customer 360 view for customer tasks
+    """
+    global _notebook, _defaults, _customer_defs
+    _notebook = _load_notebook(notebook_path)
+    _, _defaults = _notebook.app.run()
+    if with_customers:
+        _customer_defs = _run_view(CUSTOMER_MART)
+
+
+def _figure_divs(chart_slots: List[Tuple]) -> Tuple[List[str], int]:
+    """Build the figures of the chart slots of a run as HTML divs.
+
+    A chart that fails is replaced by its error message, so one bad row does not lose the
+    rest of the page.
+
+    Args:
+        chart_slots (List[Tuple]): The (build, height) slots defined by the notebook
+
+    Returns:
+        Tuple[List[str], int]: The divs, and the number of charts that failed
+    """
+    divs, failed = [], 0
+    for build, _ in chart_slots:
+        try:
+            div = build().to_html(full_html=False, include_plotlyjs=False)
+        except Exception as e:
+            failed += 1
+            div = f'<p class="error">Chart failed: {html.escape(f"{type(e).__name__}: {e}")}</p>'
+        divs.append(f'<div class="chart">{div}</div>')
+    return divs, failed
+
+
+def _write_page(path: Path, title: str, divs: List[str], plotlyjs: str) -> None:
+    """Write a report page that loads the shared plotly.js.
+
+    Args:
+        path (Path): File to write
+        title (str): Title of the page
+        divs (List[str]): HTML of the charts
+        plotlyjs (str): URL of plotly.js, relative to the page
+    """
+    body = "\n".join([f'<p><a href="../index.html">All reports</a></p>\n<h1>{html.escape(title)}</h1>', *divs])
+    path.write_text(PAGE_TEMPLATE.format(title=html.escape(title), scripts=f'<script src="{plotlyjs}"></script>\n', body=body))
+
+
+def render_view(mart: str, output_dir: Path, plotlyjs: str) -> Dict:
+    """Render the report page of a mart view in a worker.
+
+    Args:
+        mart (str): Name of the mart
+        output_dir (Path): Report folder
+        plotlyjs (str): URL of plotly.js, relative to the pages
+
+    Returns:
+        Dict: Record with "mart", "title", "page", "figures" and "failed"
+    """
+    defs = _run_view(mart)
+    divs, failed = _figure_divs(defs["chart_slots"])
+    page = Path("views") / f"{mart}.html"
+    _write_page(output_dir / page, defs["display_name"], divs, plotlyjs)
+    return {"mart": mart, "title": defs["display_name"], "page": page.as_posix(), "figures": len(divs), "failed": failed}
+
+
+def render_customers(customers: List, output_dir: Path, plotlyjs: str) -> List[Dict]:
+    """Render the Customer 360 report pages of a batch of customers in a worker.
+
+    Only the chart cell of the notebook is run again for each customer, with the other
+    globals taken from the worker's Customer 360 run.
+
+    Args:
+        customers (List): PersonIDs of the customers
+        output_dir (Path): Report folder
+        plotlyjs (str): URL of plotly.js, relative to the pages
+
+    Returns:
+        List[Dict]: One record per customer, with "customer", "page", "figures" and "failed"
+    """
+    cell = _notebook.build_chart_slots
+    refs = {name: _customer_defs[name] for name in cell.refs if name in _customer_defs}
+    records = []
+    for customer in customers:
+        result = cell.run(**{**refs, "customer_selector": SimpleNamespace(value=customer)})
+        # The cell is a coroutine when one of its ancestors is
+        _, defs = asyncio.run(result) if asyncio.iscoroutine(result) else result
+        divs, failed = _figure_divs(defs["chart_slots"])
+        page = Path("customers") / f"{customer}.html"
+        _write_page(output_dir / page, f"Customer {customer}", divs, plotlyjs)
+        records.append({"customer": customer, "page": page.as_posix(), "figures": len(divs), "failed": failed})
+    return records
+
+
+def _customer_ids(customers: Union[str, int, List, Tuple], notebook_path: Path) -> List:
+    """Resolve the --customers argument to a list of PersonIDs.
+
+    Args:
+        customers (Union[str, int, List, Tuple]): "all" for every customer of the mart, a
+            file with one PersonID per line (or a CSV with a PersonID column), or a
+            comma-separated list of PersonIDs
+        notebook_path (Path): Path to the notebook, next to its public/ folder
+
+    Returns:
+        List: The PersonIDs, in order and without duplicates
+    """
+    if isinstance(customers, (list, tuple)):
+        ids = list(customers)
+    elif isinstance(customers, int):
+        ids = [customers]
+    elif customers == "all":
+        public = notebook_path.parent / "public"
+        mart = public / f"{CUSTOMER_MART}.parquet"
+        if mart.exists():
+            ids = pd.read_parquet(mart, columns=["PersonID"])["PersonID"].tolist()
+        else:
+            ids = pd.read_csv(public / f"{CUSTOMER_MART}.csv", usecols=["PersonID"])["PersonID"].tolist()
+    elif Path(customers).is_file():
+        path = Path(customers)
+        if path.suffix == ".csv":
+            ids = pd.read_csv(path, usecols=["PersonID"])["PersonID"].tolist()
+        else:
+            ids = [line.strip() for line in path.read_text().splitlines() if line.strip()]
+    else:
+        ids = [part.strip() for part in str(customers).split(",") if part.strip()]
+    # PersonIDs are integers in the mart
+    ids = [int(customer) if isinstance(customer, str) and customer.isdigit() else customer for customer in ids]
+    return list(dict.fromkeys(ids))
+
+
+def _notebook_marts(notebook_path: Path) -> List[str]:
+    """List the marts of the notebook's mart selector.
+
+    Args:
+        notebook_path (Path): Path to the notebook
+
+    Returns:
+        List[str]: Names of the marts, in selector order
+    """
+    _, defaults = _load_notebook(notebook_path).app.run()
+    return list(defaults["data_mart_selector"].options.values())
+
+
+def _write_index(output_dir: Path, views: List[Dict], customers: List[Dict]) -> None:
+    """Write the index page of the report folder.
+
+    Args:
+        output_dir (Path): Report folder
+        views (List[Dict]): Records of the views
+        customers (List[Dict]): Records of the customers
+    """
+    def link(record: Dict, title: str) -> str:
+        failed = f' <span class="error">({record["failed"]} failed)</span>' if record["failed"] else ""
+        return f'<li><a href="{record["page"]}">{html.escape(title)}</a> &middot; {record["figures"]} charts{failed}</li>'
+
+    body = ["<h1>Data marts reports</h1>", "<h2>Views</h2>", "<ul>"]
+    body += [link(record, record["title"]) for record in views]
+    body.append("</ul>")
+    if customers:
+        body += [f"<h2>Customers ({len(customers):,})</h2>", "<ul>"]
+        body += [link(record, f"Customer {record['customer']}") for record in customers]
+        body.append("</ul>")
+    (output_dir / "index.html").write_text(PAGE_TEMPLATE.format(title="Data marts reports", scripts="", body="\n".join(body)))
+
+
+def main(
+    output_dir: Union[str, Path] = "_reports",
+    notebook: Union[str, Path] = "apps/data_marts_dashboard.py",
+    customers: Union[str, int, List, Tuple] = None,
+    workers: int = None,
+) -> None:
+    """Export the dashboard views, and optionally customers, as static HTML reports.
+
+    Command line arguments:
+        --output-dir: Report folder (default: _reports)
+        --notebook: Dashboard notebook (default: apps/data_marts_dashboard.py)
+        --customers: Customers to render: "all", a file of PersonIDs or a comma-separated
+                     list (default: none)
+        --workers: Number of worker processes (default: number of CPUs)
+
+    Returns:
+        None
+    """
+    start = time.perf_counter()
+    output_dir, notebook_path = Path(output_dir), Path(notebook).resolve()
+    workers = workers or os.cpu_count()
+    customer_ids = _customer_ids(customers, notebook_path) if customers is not None else []
+
+    for folder in ["assets", "views", "customers"]:
+        (output_dir / folder).mkdir(parents=True, exist_ok=True)
+    plotlyjs_file = Path("assets") / f"plotly-{plotly.offline.get_plotlyjs_version()}.min.js"
+    (output_dir / plotlyjs_file).write_text(plotly.offline.get_plotlyjs())
+    plotlyjs = f"../{plotlyjs_file.as_posix()}"
+
+    marts = _notebook_marts(notebook_path)
+    batch_size = max(1, min(MAX_BATCH_SIZE, math.ceil(len(customer_ids) / (4 * workers))))
+    batches = [customer_ids[i:i + batch_size] for i in range(0, len(customer_ids), batch_size)]
+    logger.info(f"Rendering {len(marts)} views and {len(customer_ids):,} customers on {workers} workers")
+
+    views, customer_records = [], []
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(notebook_path, bool(batches))
+    ) as executor:
+        futures = [executor.submit(render_view, mart, output_dir, plotlyjs) for mart in marts]
+        futures += [executor.submit(render_customers, batch, output_dir, plotlyjs) for batch in batches]
+        for future in as_completed(futures):
+            result = future.result()
+            if isinstance(result, dict):
+                views.append(result)
+                logger.info(f"Rendered {result['title']} ({result['figures']} charts) in {time.perf_counter() - start:.1f}s")
+            else:
+                customer_records += result
+                logger.info(f"Rendered {len(customer_records):,}/{len(customer_ids):,} customers in {time.perf_counter() - start:.1f}s")
+
+    views.sort(key=lambda record: marts.index(record["mart"]))
+    order = {customer: i for i, customer in enumerate(customer_ids)}
+    customer_records.sort(key=lambda record: order[record["customer"]])
+    _write_index(output_dir, views, customer_records)
+
+    failed = sum(record["failed"] for record in views + customer_records)
+    if failed:
+        logger.warning(f"{failed} charts failed; their pages show the error instead")
+    logger.info(f"Wrote {len(views) + len(customer_records):,} pages to {output_dir} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
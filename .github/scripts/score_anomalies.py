@@ -0,0 +1,321 @@
+"""
+Anomaly scoring for the customer-level data.
+
+This script scores every customer of dm_customer_360 against robust statistics of
+their segment (occupation and age band): the median and MAD of daily steps, heart
+rate, sleep hours and annual claims. It also labels each customer by comparing the
+self-reported activity level with the robust z-score of their recorded steps, so the
+label is relative to comparable customers rather than to fixed step counts. The results
+are written to the dm_customer_anomalies table, which the dashboard reads for its
+anomaly chart. The table records the content version of the dm_customer_360 it was
+scored from, and the dashboard rejects it once the mart has changed.
+
+The table is refreshed incrementally: a customer is only scored again when their
+input row or the statistics of their segment changed since the last run. The hashes
+that tell are kept in a state file next to the snapshots of ingest.py, not in the
+published table that the dashboard downloads.
+
+The script can be run from the command line with optional arguments:
+    uv run .github/scripts/score_anomalies.py [--input INPUT] [--output OUTPUT] [--state STATE]
+"""
+
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "fire==0.7.0",
+#     "loguru==0.7.0",
+#     "numpy==2.2.6",
+#     "pandas==2.3.0",
+#     "pyarrow==20.0.0"
+# ]
+# ///
+
+import hashlib
+import time
+from pathlib import Path
+from typing import Dict, List, Union
+
+import fire
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+# Columns that identify a customer row (a person can hold several policies)
+KEY_COLUMNS = ["PersonID", "insurance_sign_up_date"]
+
+# Scored metric -> input column
+METRICS = {
+    "steps": "current_daily_steps",
+    "heart_rate": "current_heart_rate_bpm",
+    "sleep": "current_sleep_hours",
+    "claims": "avg_annual_claims",
+}
+
+# Age bands, as in dm_health_by_demographics
+AGE_BINS = [0, 30, 40, 50, 60, 70, np.inf]
+AGE_BANDS = ["18-29", "30-39", "40-49", "50-59", "60-69", "70+"]
+
+# Segments smaller than this use the statistics of the occupation, then of everyone
+MIN_SEGMENT_SIZE = 5
+
+# Robust z-score above which a metric counts as an outlier
+OUTLIER_THRESHOLD = 3.5
+
+# Self-reported activity level (including the misspellings in the source) -> 1..3
+ACTIVITY_LEVELS = {
+    "sedentary": 1, "seddentary": 1,
+    "active": 2, "actve": 2,
+    "highly_active": 3, "highly active": 3,
+}
+
+INPUT_COLUMNS = KEY_COLUMNS + ["occupational_category", "age", "current_activity_level"] + list(METRICS.values())
+
+# Columns of the refresh state: which input and segment statistics each row was scored from
+HASH_COLUMNS = ["row_hash", "stats_hash"]
+
+# Column of the published table with the content version of the input it was scored from, as
+# in the marts manifest of the build; the dashboard does not show a table of another version
+VERSION_COLUMN = "mart_version"
+
+
+def _segments(df: pd.DataFrame) -> pd.DataFrame:
+    """Return the occupation and age band of every row."""
+    age_band = pd.cut(df["age"], bins=AGE_BINS, labels=AGE_BANDS, right=False)
+    return pd.DataFrame({
+        "occupation": df["occupational_category"].fillna("unknown"),
+        "age_band": age_band.astype("object").fillna("unknown"),
+    }, index=df.index)
+
+
+def _robust_stats(values: pd.DataFrame, keys: list) -> pd.DataFrame:
+    """Return the size, and the median and scaled MAD of every metric, per group of keys.
+
+    The MAD is scaled by 1.4826 to estimate the standard deviation of normal data. Where
+    it is zero (over half the values equal), the scaled interquartile range is used.
+    """
+    grouped = values.groupby(keys)[list(METRICS)]
+    medians = grouped.median()
+    deviations = (values[list(METRICS)] - grouped.transform("median")).abs()
+    mads = deviations.groupby([values[key] for key in keys]).median() * 1.4826
+    iqrs = (grouped.quantile(0.75) - grouped.quantile(0.25)) / 1.349
+    mads = mads.mask(mads == 0, iqrs)
+
+    stats = pd.concat([medians.add_suffix("_median"), mads.add_suffix("_mad")], axis=1)
+    stats["segment_size"] = grouped.size()
+    return stats.reset_index()
+
+
+def segment_stats(df: pd.DataFrame) -> pd.DataFrame:
+    """Return the statistics every row is scored against.
+
+    Rows in segments (occupation and age band) with at least MIN_SEGMENT_SIZE customers
+    get the statistics of their segment; smaller segments fall back to the occupation,
+    and small occupations to all customers.
+
+    Args:
+        df (pd.DataFrame): Customer rows with the INPUT_COLUMNS
+
+    Returns:
+        pd.DataFrame: Per row (same index as df) the segment used and its median/MAD per metric
+    """
+    values = pd.concat([_segments(df), df[list(METRICS.values())].set_axis(list(METRICS), axis=1)], axis=1)
+    values["everyone"] = "all"
+
+    stats = None
+    for level, keys in (("segment", ["occupation", "age_band"]), ("occupation", ["occupation"]), ("all", ["everyone"])):
+        level_stats = values[keys].merge(_robust_stats(values, keys), on=keys, how="left").drop(columns=keys)
+        level_stats = level_stats.set_axis(values.index)
+        level_stats.insert(0, "stats_level", level)
+        if level != "all":
+            level_stats = level_stats.where(level_stats["segment_size"] >= MIN_SEGMENT_SIZE)
+        stats = level_stats if stats is None else stats.fillna(level_stats)
+
+    return pd.concat([values[["occupation", "age_band"]], stats], axis=1)
+
+
+def score_chunk(df: pd.DataFrame, stats: pd.DataFrame) -> pd.DataFrame:
+    """Score a chunk of customer rows against their segment statistics, vectorized.
+
+    The anomaly status compares the self-reported activity level with the robust z-score
+    of the daily steps within the segment: a highly active customer whose steps are more
+    than OUTLIER_THRESHOLD below the segment median is an over-reporter, a sedentary one
+    that far above it an under-reporter. Other customers with an outlying metric are
+    segment outliers; reports on the matching side of the median are verified.
+
+    Args:
+        df (pd.DataFrame): Customer rows with the INPUT_COLUMNS
+        stats (pd.DataFrame): Rows of segment_stats() for the same index
+
+    Returns:
+        pd.DataFrame: Robust z-score per metric, the overall score and the activity label
+    """
+    scores = pd.DataFrame(index=df.index)
+    for metric, column in METRICS.items():
+        z = (df[column] - stats[f"{metric}_median"]) / stats[f"{metric}_mad"]
+        scores[f"{metric}_z"] = z.replace([np.inf, -np.inf], np.nan).round(3)
+    z_columns = [f"{metric}_z" for metric in METRICS]
+    scores["anomaly_score"] = scores[z_columns].abs().max(axis=1).fillna(0).round(3)
+    scores["outlier_metrics"] = [
+        ",".join(metric for metric, flagged in zip(METRICS, row) if flagged)
+        for row in (scores[z_columns].abs() > OUTLIER_THRESHOLD).to_numpy()
+    ]
+
+    # Self-reported activity level against the recorded steps of the segment
+    level = df["current_activity_level"].str.lower().map(ACTIVITY_LEVELS).fillna(0).astype("int64")
+    steps_z = scores["steps_z"]
+    scores["activity_level_numeric"] = level
+    scores["anomaly_status"] = np.select(
+        [
+            (level == 3) & (steps_z < -OUTLIER_THRESHOLD),
+            (level == 1) & (steps_z > OUTLIER_THRESHOLD),
+            scores["outlier_metrics"] != "",
+            (level == 3) & (steps_z >= 0),
+            (level == 1) & (steps_z <= 0),
+        ],
+        ["Over-Reporter", "Under-Reporter", "Segment Outlier", "Verified Active", "Verified Sedentary"],
+        default="Normal Range",
+    )
+    return scores
+
+
+def _canonical(df: pd.DataFrame) -> pd.DataFrame:
+    """Return the values of df as strings that do not depend on the inferred dtypes, as in ingest.py.
+
+    Numbers are written as floats, so 5 read as int64 and 5.0 read as float64 (the same
+    column once it has a missing value) give the same string; missing values stay missing.
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            values = values.astype("float64")
+        columns[column] = values.astype("string")
+    return pd.DataFrame(columns, index=df.index)
+
+
+def _hash_rows(df: pd.DataFrame) -> pd.Series:
+    return pd.util.hash_pandas_object(_canonical(df), index=False).astype("uint64").astype("string")
+
+
+def refresh(
+    df: pd.DataFrame,
+    previous: Union[pd.DataFrame, None] = None,
+    chunk_size: int = 100_000,
+) -> Dict[str, object]:
+    """Return the anomaly table of df, reusing the rows of a previous table that are still valid.
+
+    Args:
+        df (pd.DataFrame): Customer rows with the INPUT_COLUMNS
+        previous (pd.DataFrame, optional): The anomaly table of the last run, with its HASH_COLUMNS
+        chunk_size (int, optional): Number of rows scored at a time. Defaults to 100,000.
+
+    Returns:
+        Dict[str, object]: The table with its HASH_COLUMNS, and the number of rescored and reused rows
+    """
+    df = df[INPUT_COLUMNS].reset_index(drop=True)
+    stats = segment_stats(df)
+    stats_columns = [c for c in stats.columns if c.endswith(("_median", "_mad"))]
+
+    base = df[KEY_COLUMNS].copy()
+    base["row_hash"] = _hash_rows(df)
+    base["stats_hash"] = _hash_rows(stats[["stats_level"] + stats_columns])
+
+    stale = pd.Series(True, index=df.index)
+    if previous is not None and set(HASH_COLUMNS + KEY_COLUMNS) <= set(previous.columns):
+        previous = previous.astype({column: "string" for column in HASH_COLUMNS})
+        matched = base.merge(
+            previous[KEY_COLUMNS + HASH_COLUMNS].drop_duplicates(KEY_COLUMNS),
+            on=KEY_COLUMNS, how="left", suffixes=("", "_previous"),
+        )
+        stale = ~((matched["row_hash"] == matched["row_hash_previous"])
+                  & (matched["stats_hash"] == matched["stats_hash_previous"])).fillna(False)
+        stale.index = df.index
+
+    to_score = df.index[stale]
+    scored = [
+        score_chunk(df.loc[chunk], stats.loc[chunk])
+        for chunk in (to_score[i:i + chunk_size] for i in range(0, len(to_score), chunk_size))
+    ]
+
+    parts = []
+    if scored:
+        parts.append(pd.concat([
+            base.loc[to_score],
+            stats.loc[to_score, ["occupation", "age_band", "stats_level"]],
+            df.loc[to_score, ["current_daily_steps"]],
+            pd.concat(scored),
+        ], axis=1))
+    if not stale.all():
+        parts.append(base.loc[~stale, KEY_COLUMNS].merge(previous, on=KEY_COLUMNS, how="left"))
+    table = pd.concat(parts, ignore_index=True)
+
+    table = table.merge(base[KEY_COLUMNS].reset_index(), on=KEY_COLUMNS).sort_values("index")
+    return {
+        "table": table.drop(columns="index").reset_index(drop=True),
+        "rescored": int(stale.sum()),
+        "reused": int((~stale).sum()),
+    }
+
+
+def _read_table(path: Path, columns: Union[List[str], None] = None, dtype: Union[dict, None] = None) -> pd.DataFrame:
+    """Read a CSV or Parquet file, only the given columns if any; dtype applies to CSV."""
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns, dtype=dtype)
+
+
+def _write_table(df: pd.DataFrame, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == ".parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def main(
+    input: Union[str, Path] = "data/dm_customer_360.csv",
+    output: Union[str, Path] = "apps/public/dm_customer_anomalies.csv",
+    state: Union[str, Path] = "data/snapshots/dm_customer_anomalies.state.parquet",
+    chunk_size: int = 100_000,
+    full: bool = False,
+) -> None:
+    """Score the customers and write or refresh the anomaly table.
+
+    Command line arguments:
+        --input: CSV or Parquet file with customer-level data (default: data/dm_customer_360.csv)
+        --output: Anomaly table to refresh (default: apps/public/dm_customer_anomalies.csv)
+        --state: File with the row and statistics hashes of the last run
+                 (default: data/snapshots/dm_customer_anomalies.state.parquet)
+        --chunk-size: Number of rows scored at a time (default: 100,000)
+        --full: Score every row again, ignoring the existing table (default: False)
+
+    Returns:
+        None
+    """
+    start = time.perf_counter()
+    input, output, state = Path(input), Path(output), Path(state)
+    df = _read_table(input, columns=INPUT_COLUMNS)
+
+    previous = None
+    if output.exists() and state.exists() and not full:
+        # A table without state (or the reverse) is scored again in full
+        hashes = {column: "string" for column in HASH_COLUMNS}
+        previous = _read_table(output).drop(columns=HASH_COLUMNS + [VERSION_COLUMN], errors="ignore").merge(
+            _read_table(state, dtype=hashes), on=KEY_COLUMNS,
+        )
+
+    result = refresh(df, previous, chunk_size=chunk_size)
+
+    table = result["table"]
+    # Reused rows are valid for the new input as well, so every row gets its version
+    version = hashlib.sha256(input.read_bytes()).hexdigest()[:12]
+    _write_table(table.drop(columns=HASH_COLUMNS).assign(**{VERSION_COLUMN: version}), output)
+    _write_table(table[KEY_COLUMNS + HASH_COLUMNS], state)
+    logger.info(
+        f"Wrote {len(table)} rows to {output} ({result['rescored']} scored, "
+        f"{result['reused']} unchanged) in {time.perf_counter() - start:.2f}s"
+    )
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -0,0 +1,353 @@
+"""
+Static file server for the exported site.
+
+This script serves the output of build.py for local and staging testing, in place of
+`python -m http.server`. It sends the .br and .gz variants written by the build when
+the client accepts them, answers conditional requests (If-None-Match and
+If-Modified-Since) with 304 Not Modified, and serves byte ranges of large files such as
+the data marts. Fingerprinted assets are sent with long-lived immutable Cache-Control
+headers, like a production CDN would, and the other files are revalidated.
+
+Connections are kept alive and handled by a thread pool, and file bodies are sent with
+sendfile. Every request is logged with its status, size, encoding and latency.
+
+The script can be run from the command line with optional arguments:
+    uv run .github/scripts/serve.py [--directory DIRECTORY] [--port PORT]
+"""
+
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "fire==0.7.0",
+#     "loguru==0.7.0"
+# ]
+# ///
+
+import email.utils
+import os
+import re
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import fire
+from loguru import logger
+
+# Precompressed variants written by build.py, in order of preference
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+# Names of the content-hash fingerprinted files of build.py, such as dm_customer_360.1a2b3c4d.csv
+FINGERPRINTED = re.compile(r"\.[0-9a-f]{8}\.[A-Za-z0-9]+$")
+
+# Types missing from some mimetypes databases
+EXTRA_TYPES = {
+    ".wasm": "application/wasm",
+    ".mjs": "text/javascript",
+    ".parquet": "application/vnd.apache.parquet",
+    ".arrow": "application/vnd.apache.arrow.file",
+}
+
+SINGLE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Latencies kept for the summary: the most recent requests only, so memory stays bounded
+LATENCY_WINDOW = 10_000
+
+
+def _accepted_encodings(header: Optional[str]) -> List[str]:
+    """Parse an Accept-Encoding header.
+
+    Args:
+        header (Optional[str]): Value of the header
+
+    Returns:
+        List[str]: The accepted encodings (those without q=0)
+    """
+    accepted = []
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = re.search(r"q=([0-9.]+)", params)
+        if coding and not (quality and float(quality.group(1)) == 0):
+            accepted.append(coding.strip().lower())
+    return accepted
+
+
+def _byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range Range header.
+
+    Args:
+        header (str): Value of the header, such as "bytes=0-1023" or "bytes=-500"
+        size (int): Size of the file
+
+    Returns:
+        Optional[Tuple[int, int]]: The first and last byte of the range, (0, -1) when it
+            cannot be satisfied, or None when the header is not a single byte range
+            (the whole file is sent then)
+    """
+    match = SINGLE_RANGE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last bytes of the file
+        return (max(size - int(last), 0), size - 1) if int(last) > 0 and size else (0, -1)
+    first, last = int(first), min(int(last), size - 1) if last else size - 1
+    return (first, last) if first <= last and first < size else (0, -1)
+
+
+class StaticHandler(SimpleHTTPRequestHandler):
+    """Request handler that serves precompressed, conditional and range responses."""
+
+    protocol_version = "HTTP/1.1"
+    extensions_map = {**SimpleHTTPRequestHandler.extensions_map, **EXTRA_TYPES}
+
+    def do_GET(self) -> None:
+        self._serve(head=False)
+
+    def do_HEAD(self) -> None:
+        self._serve(head=True)
+
+    def log_message(self, format: str, *args) -> None:
+        # Requests are logged by _serve, with their latency
+        pass
+
+    def _serve(self, head: bool) -> None:
+        """Serve a file, logging the request when the response is complete.
+
+        Args:
+            head (bool): Whether to send the headers only
+        """
+        start = time.perf_counter()
+        status, sent, encoding = self._respond(head)
+        latency_ms = 1000 * (time.perf_counter() - start)
+        self.server.record(latency_ms)
+        logger.info(
+            f"{self.client_address[0]} {self.command} {self.path} {status} {sent:,} bytes"
+            f"{f' {encoding}' if encoding else ''} {latency_ms:.1f} ms"
+        )
+
+    def _respond(self, head: bool) -> Tuple[int, int, Optional[str]]:
+        """Send the response to the current request.
+
+        Args:
+            head (bool): Whether to send the headers only
+
+        Returns:
+            Tuple[int, int, Optional[str]]: Status, body bytes sent and content encoding
+        """
+        path = Path(self.translate_path(self.path))
+        if path.is_dir():
+            if not self.path.split("?", 1)[0].endswith("/"):
+                self.send_response(HTTPStatus.MOVED_PERMANENTLY)
+                self.send_header("Location", self.path.split("?", 1)[0] + "/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return HTTPStatus.MOVED_PERMANENTLY, 0, None
+            path = path / "index.html"
+        if not path.is_file():
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return HTTPStatus.NOT_FOUND, 0, None
+
+        # The precompressed variant the client accepts, if the build wrote one
+        encoding, served = None, path
+        accepted = _accepted_encodings(self.headers.get("Accept-Encoding"))
+        for coding, suffix in ENCODINGS.items():
+            variant = path.with_name(path.name + suffix)
+            if coding in accepted and variant.is_file():
+                encoding, served = coding, variant
+                break
+
+        stat = served.stat()
+        # Each variant is its own representation, with its own validator
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{f"-{encoding}" if encoding else ""}"'
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        headers = {
+            "Content-Type": self.guess_type(str(path)),
+            "ETag": etag,
+            "Last-Modified": last_modified,
+            "Cache-Control": "public, max-age=31536000, immutable" if FINGERPRINTED.search(path.name) else "no-cache",
+            "Accept-Ranges": "bytes",
+        }
+        if any(path.with_name(path.name + suffix).is_file() for suffix in ENCODINGS.values()):
+            headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            headers["Content-Encoding"] = encoding
+
+        if self._not_modified(etag, stat.st_mtime):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            for name in ("ETag", "Last-Modified", "Cache-Control", "Vary"):
+                if name in headers:
+                    self.send_header(name, headers[name])
+            self.end_headers()
+            return HTTPStatus.NOT_MODIFIED, 0, encoding
+
+        status, first, last = HTTPStatus.OK, 0, stat.st_size - 1
+        byte_range = self._requested_range(etag, last_modified, stat.st_size)
+        if byte_range == (0, -1):
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{stat.st_size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, 0, encoding
+        if byte_range:
+            status, (first, last) = HTTPStatus.PARTIAL_CONTENT, byte_range
+            headers["Content-Range"] = f"bytes {first}-{last}/{stat.st_size}"
+        length = last - first + 1
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+        if head or not length:
+            return status, 0, encoding
+        with open(served, "rb") as f:
+            try:
+                sent = self.connection.sendfile(f, offset=first, count=length)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+                sent = 0
+        return status, sent, encoding
+
+    def _not_modified(self, etag: str, mtime: float) -> bool:
+        """Evaluate the conditional headers of the request.
+
+        If-None-Match takes precedence over If-Modified-Since, as in RFC 9110.
+
+        Args:
+            etag (str): Current ETag of the file
+            mtime (float): Modification time of the file
+
+        Returns:
+            bool: Whether the client's copy is current
+        """
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since
+        return False
+
+    def _requested_range(self, etag: str, last_modified: str, size: int) -> Optional[Tuple[int, int]]:
+        """Evaluate the Range and If-Range headers of the request.
+
+        Args:
+            etag (str): Current ETag of the file
+            last_modified (str): Current Last-Modified date of the file
+            size (int): Size of the file
+
+        Returns:
+            Optional[Tuple[int, int]]: The range to send as returned by _byte_range, or
+                None to send the whole file
+        """
+        header = self.headers.get("Range")
+        if not header:
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range and if_range.strip() not in (etag, last_modified):
+            # The client's partial copy is stale: send the whole file
+            return None
+        return _byte_range(header, size)
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTP server that handles each connection on a thread pool."""
+
+    def __init__(self, address: Tuple[str, int], handler: type, threads: int):
+        super().__init__(address, handler)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="serve")
+        self.latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms: float) -> None:
+        """Count a request and keep its latency in the window of recent requests."""
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(latency_ms)
+
+    def process_request(self, request, client_address) -> None:
+        self.executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _latency_summary(latencies: Iterable[float]) -> Dict[str, float]:
+    """Summarize request latencies.
+
+    Args:
+        latencies (Iterable[float]): Latency of each request in milliseconds
+
+    Returns:
+        Dict[str, float]: The number of latencies and their p50, p95 and max
+    """
+    latencies = list(latencies)
+    if len(latencies) < 2:
+        return {"requests": len(latencies), "p50_ms": sum(latencies), "p95_ms": sum(latencies), "max_ms": sum(latencies)}
+    cuts = statistics.quantiles(latencies, n=20, method="inclusive")
+    return {"requests": len(latencies), "p50_ms": statistics.median(latencies), "p95_ms": cuts[18], "max_ms": max(latencies)}
+
+
+def main(
+    directory: Union[str, Path] = "_site",
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    threads: int = 32,
+    keep_alive: float = 15.0,
+) -> None:
+    """Serve the exported site.
+
+    Command line arguments:
+        --directory: Folder to serve (default: _site)
+        --host: Address to bind (default: 127.0.0.1)
+        --port: Port to listen on (default: 8000)
+        --threads: Connections handled at the same time (default: 32)
+        --keep-alive: Seconds an idle connection is kept open (default: 15)
+
+    Returns:
+        None
+    """
+    directory = Path(directory)
+    if not directory.is_dir():
+        logger.error(f"{directory} does not exist; run build.py first")
+        return
+    handler = type("Handler", (StaticHandler,), {"timeout": keep_alive})
+    server = PooledHTTPServer((host, port), partial(handler, directory=os.fspath(directory)), threads)
+    logger.info(f"Serving {directory} at http://{host}:{server.server_port} with {threads} threads")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        summary = _latency_summary(server.latencies)
+        logger.info(
+            f"Served {server.requests:,} requests; last {summary['requests']:,}: p50 {summary['p50_ms']:.1f} ms, "
+            f"p95 {summary['p95_ms']:.1f} ms, max {summary['max_ms']:.1f} ms"
+        )
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
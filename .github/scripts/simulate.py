@@ -0,0 +1,321 @@
+"""
+Monte Carlo simulation of next year's loss ratios.
+
+This script fits a distribution to the annual claims of every segment of
+dm_insurance_profitability (occupation, wealth bracket and insurance status) and
+samples next year's claims of the portfolio many times. Each segment's claims per
+policy follow a PERT distribution between the min and max claims of the segment, with
+the segment's average as mean; segments with many policies use the normal
+approximation of their total. Claims are drawn from a table of the quantiles of each
+distribution, which only takes a random index per draw. Batches of scenarios are drawn
+with vectorized NumPy calls on a process pool, and their loss ratios are added to fixed-bin histograms, so
+the confidence bands can be reported as soon as each batch finishes.
+
+The bands of the portfolio and of every occupation are written to the
+dm_loss_ratio_forecast table, which the dashboard draws next to the 60% limit line of
+its loss ratio trend chart.
+
+The script can be run from the command line with optional arguments:
+    uv run .github/scripts/simulate.py [--scenarios SCENARIOS] [--output OUTPUT]
+"""
+
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "fire==0.7.0",
+#     "loguru==0.7.0",
+#     "numpy==2.2.6",
+#     "pandas==2.3.0",
+#     "pyarrow==20.0.0"
+# ]
+# ///
+
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple, Union
+
+import fire
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+# Loss ratio above which a segment is unprofitable, as in the dashboard
+LOSS_RATIO_LIMIT = 0.60
+
+# Quantiles reported as confidence bands
+QUANTILES = {"p05": 0.05, "p25": 0.25, "p50": 0.50, "p75": 0.75, "p95": 0.95}
+
+# Loss ratios are counted in histograms with these bins (the last bin takes everything
+# above), which batches add up exactly whatever order they finish in
+BIN_WIDTH = 0.0005
+MAX_LOSS_RATIO = 5.0
+
+# Segments with more policies than this draw their total from the normal approximation
+MAX_EXACT_POLICIES = 30
+
+# Quantiles tabulated per segment, and grid points of the density they are computed from
+QUANTILE_POINTS = 4096
+DENSITY_POINTS = 16385
+
+# Values drawn per batch; bounds the memory of a worker
+BATCH_DRAWS = 5_000_000
+
+# Column of the forecast with the content version of the input it was simulated from, as in
+# the marts manifest of the build; build.py only reruns the simulation when it changed
+VERSION_COLUMN = "mart_version"
+
+INPUT_COLUMNS = [
+    "occupational_category", "wealth_bracket", "insurance_status", "unique_customers",
+    "avg_annual_premium", "avg_annual_claims", "min_claims", "max_claims",
+]
+
+
+def fit_segments(df: pd.DataFrame) -> pd.DataFrame:
+    """Fit a PERT distribution to the annual claims per policy of every segment.
+
+    The mode is chosen so that the PERT mean, (min + 4 * mode + max) / 6, is the average
+    claims of the segment, within [min, max].
+
+    Args:
+        df (pd.DataFrame): Rows of dm_insurance_profitability with the INPUT_COLUMNS
+
+    Returns:
+        pd.DataFrame: Per segment the policies, expected premiums, the PERT parameters and
+            the mean and standard deviation of the claims of one policy
+    """
+    df = df[INPUT_COLUMNS].dropna(subset=["unique_customers", "avg_annual_premium", "avg_annual_claims"])
+    df = df[df["unique_customers"] > 0]
+    low = df["min_claims"].fillna(df["avg_annual_claims"]).to_numpy(dtype=np.float64)
+    high = df["max_claims"].fillna(df["avg_annual_claims"]).to_numpy(dtype=np.float64)
+    high = np.maximum(high, low)
+    spread = high - low
+    mode = np.clip((6 * df["avg_annual_claims"].to_numpy() - low - high) / 4, low, high)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha = np.where(spread > 0, 1 + 4 * (mode - low) / spread, 1.0)
+        beta = np.where(spread > 0, 1 + 4 * (high - mode) / spread, 1.0)
+    mean = (low + 4 * mode + high) / 6
+    policies = df["unique_customers"].to_numpy(dtype=np.int64)
+
+    return pd.DataFrame({
+        "occupational_category": df["occupational_category"].fillna("unknown").to_numpy(),
+        "wealth_bracket": df["wealth_bracket"].to_numpy(),
+        "insurance_status": df["insurance_status"].to_numpy(),
+        "policies": policies,
+        "premiums": policies * df["avg_annual_premium"].to_numpy(dtype=np.float64),
+        "low": low,
+        "spread": spread,
+        "alpha": alpha,
+        "beta": beta,
+        "mean": mean,
+        # Standard deviation of the PERT distribution
+        "std": np.sqrt(np.clip((mean - low) * (high - mean) / 7, 0, None)),
+    })
+
+
+def pert_quantiles(segments: pd.DataFrame, points: int = QUANTILE_POINTS) -> np.ndarray:
+    """Tabulate the claims of one policy at `points` evenly spaced probabilities, per segment.
+
+    The quantiles are those of the beta distribution of the PERT fit, from its density
+    integrated on a fine grid, and are scaled to the claims range of the segment.
+
+    Args:
+        segments (pd.DataFrame): Segments fitted by fit_segments()
+        points (int, optional): Number of quantiles. Defaults to QUANTILE_POINTS.
+
+    Returns:
+        np.ndarray: float32 array of shape (segments, points); row i is sorted
+    """
+    x = np.linspace(0, 1, DENSITY_POINTS)
+    alpha, beta = segments["alpha"].to_numpy()[:, None], segments["beta"].to_numpy()[:, None]
+    density = x ** (alpha - 1) * (1 - x) ** (beta - 1)
+    cdf = np.concatenate([np.zeros((len(density), 1)), np.cumsum(density[:, 1:] + density[:, :-1], axis=1)], axis=1)
+    cdf /= cdf[:, -1:]
+    probabilities = (np.arange(points) + 0.5) / points
+    quantiles = np.array([np.interp(probabilities, row, x) for row in cdf])
+    return (quantiles * segments["spread"].to_numpy()[:, None] + segments["low"].to_numpy()[:, None]).astype(np.float32)
+
+
+def _sample_claims(segments: Dict[str, np.ndarray], n: int, rng: np.random.Generator) -> np.ndarray:
+    """Draw the total claims of every segment in n scenarios, shape (n, segments)."""
+    policies = segments["policies"]
+    claims = np.empty((n, len(policies)))
+
+    exact = np.flatnonzero(policies <= MAX_EXACT_POLICIES)
+    if len(exact):
+        # One draw per policy, as a random quantile of its segment's table; the policies
+        # of a segment are contiguous columns
+        repeat = policies[exact]
+        quantiles = segments["quantiles"]
+        draws = rng.integers(0, quantiles.shape[1], size=(n, repeat.sum()), dtype=np.int32)
+        draws += np.repeat(exact.astype(np.int32) * quantiles.shape[1], repeat)
+        draws = np.take(quantiles.ravel(), draws)
+        starts = np.concatenate([[0], np.cumsum(repeat)[:-1]])
+        claims[:, exact] = np.add.reduceat(draws, starts, axis=1, dtype=np.float64)
+
+    approximated = np.flatnonzero(policies > MAX_EXACT_POLICIES)
+    if len(approximated):
+        count = policies[approximated]
+        total = rng.standard_normal((n, len(approximated))) * (np.sqrt(count) * segments["std"][approximated])
+        total += count * segments["mean"][approximated]
+        claims[:, approximated] = np.maximum(total, count * segments["low"][approximated])
+    return claims
+
+
+def _simulate_batch(
+    segments: Dict[str, np.ndarray],
+    groups: np.ndarray,
+    n_groups: int,
+    n: int,
+    seed: np.random.SeedSequence,
+) -> Dict[str, np.ndarray]:
+    """Simulate n scenarios and count their loss ratios per group. Runs in a worker process.
+
+    Group 0 is the portfolio and groups[i] is the group of segment i.
+
+    Returns:
+        Dict[str, np.ndarray]: The histogram of loss ratios per group, their sums, and the
+            number of scenarios above the limit
+    """
+    rng = np.random.default_rng(seed)
+    claims = _sample_claims(segments, n, rng)
+
+    # Claims and premiums per group: column 0 adds up all segments
+    membership = np.zeros((len(groups), n_groups))
+    membership[:, 0] = 1
+    membership[np.arange(len(groups)), groups] = 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        loss_ratio = (claims @ membership) / (segments["premiums"] @ membership)
+    loss_ratio = np.nan_to_num(loss_ratio, nan=0.0, posinf=MAX_LOSS_RATIO)
+
+    n_bins = int(round(MAX_LOSS_RATIO / BIN_WIDTH)) + 1
+    bins = np.minimum((loss_ratio / BIN_WIDTH).astype(np.int64), n_bins - 1)
+    histogram = np.bincount((bins + np.arange(n_groups) * n_bins).ravel(), minlength=n_groups * n_bins)
+    return {
+        "histogram": histogram.reshape(n_groups, n_bins),
+        "sum": loss_ratio.sum(axis=0),
+        "above_limit": (loss_ratio > LOSS_RATIO_LIMIT).sum(axis=0),
+    }
+
+
+def _summarize(totals: Dict[str, np.ndarray], names: List[str], levels: List[str], premiums: np.ndarray) -> pd.DataFrame:
+    """Turn the accumulated histograms into the forecast table (loss ratios in percent)."""
+    histogram = totals["histogram"]
+    scenarios = histogram.sum(axis=1)
+    cumulative = np.cumsum(histogram, axis=1)
+    summary = pd.DataFrame({
+        "level": levels,
+        "segment": names,
+        "scenarios": scenarios,
+        "expected_premiums": premiums.round(2),
+        "loss_ratio_pct_mean": (100 * totals["sum"] / scenarios).round(2),
+    })
+    for name, q in QUANTILES.items():
+        # Upper edge of the bin that holds the quantile
+        index = np.array([np.searchsorted(row, q * total) for row, total in zip(cumulative, scenarios)])
+        summary[f"loss_ratio_pct_{name}"] = (100 * (index + 1) * BIN_WIDTH).round(2)
+    summary["pct_above_limit"] = (100 * totals["above_limit"] / scenarios).round(3)
+    summary["limit_pct"] = 100 * LOSS_RATIO_LIMIT
+    return summary
+
+
+def simulate(
+    segments: pd.DataFrame,
+    scenarios: int = 1_000_000,
+    workers: int = None,
+    batch_size: int = None,
+    seed: int = 0,
+) -> Iterator[Tuple[int, pd.DataFrame]]:
+    """Simulate next year's loss ratios, yielding the bands so far after every batch.
+
+    Args:
+        segments (pd.DataFrame): Segments fitted by fit_segments()
+        scenarios (int, optional): Number of scenarios. Defaults to 1,000,000.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        batch_size (int, optional): Scenarios per batch. Defaults to what keeps a batch
+            under BATCH_DRAWS draws.
+        seed (int, optional): Seed of the batches; the results do not depend on the number
+            of workers. Defaults to 0.
+
+    Yields:
+        Tuple[int, pd.DataFrame]: The scenarios done, and the forecast table over them
+    """
+    occupations, occupation_names = pd.factorize(segments["occupational_category"], sort=True)
+    groups = occupations + 1
+    names = ["Portfolio"] + list(occupation_names)
+    levels = ["portfolio"] + ["occupation"] * len(occupation_names)
+    premiums = np.bincount(groups, weights=segments["premiums"], minlength=len(names))
+    premiums[0] = segments["premiums"].sum()
+    arrays = {column: segments[column].to_numpy() for column in ["policies", "premiums", "mean", "std", "low"]}
+    arrays["quantiles"] = pert_quantiles(segments)
+
+    draws_per_scenario = int(np.minimum(arrays["policies"], MAX_EXACT_POLICIES + 1).sum()) + len(names)
+    batch_size = batch_size or max(1_000, BATCH_DRAWS // max(draws_per_scenario, 1))
+    sizes = [min(batch_size, scenarios - start) for start in range(0, scenarios, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    totals, done = None, 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = [
+            pool.submit(_simulate_batch, arrays, groups, len(names), size, batch_seed)
+            for size, batch_seed in zip(sizes, seeds)
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            totals = result if totals is None else {key: totals[key] + result[key] for key in totals}
+            done += int(result["histogram"][0].sum())
+            yield done, _summarize(totals, names, levels, premiums)
+
+
+def main(
+    input: Union[str, Path] = "apps/public/dm_insurance_profitability.csv",
+    output: Union[str, Path] = "apps/public/dm_loss_ratio_forecast.csv",
+    scenarios: int = 1_000_000,
+    workers: int = None,
+    seed: int = 0,
+) -> None:
+    """Simulate next year's loss ratios and write the confidence bands.
+
+    Command line arguments:
+        --input: CSV or Parquet file of dm_insurance_profitability
+                 (default: apps/public/dm_insurance_profitability.csv)
+        --output: Forecast table to write (default: apps/public/dm_loss_ratio_forecast.csv)
+        --scenarios: Number of scenarios (default: 1,000,000)
+        --workers: Number of worker processes (default: number of CPUs)
+        --seed: Seed of the simulation (default: 0)
+
+    Returns:
+        None
+    """
+    start = time.perf_counter()
+    input, output = Path(input), Path(output)
+    if input.suffix == ".parquet":
+        df = pd.read_parquet(input, columns=INPUT_COLUMNS)
+    else:
+        df = pd.read_csv(input, usecols=INPUT_COLUMNS)
+    segments = fit_segments(df)
+    logger.info(f"Simulating {scenarios:,} scenarios of {len(segments)} segments ({segments['policies'].sum():,} policies)")
+
+    summary = None
+    for done, summary in simulate(segments, scenarios=scenarios, workers=workers, seed=seed):
+        portfolio = summary.iloc[0]
+        logger.info(
+            f"{done:,}/{scenarios:,} scenarios: portfolio loss ratio "
+            f"{portfolio['loss_ratio_pct_p05']:.1f}%-{portfolio['loss_ratio_pct_p95']:.1f}% (90% band), "
+            f"{portfolio['pct_above_limit']:.2f}% above {100 * LOSS_RATIO_LIMIT:.0f}%"
+        )
+
+    summary[VERSION_COLUMN] = hashlib.sha256(input.read_bytes()).hexdigest()[:12]
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if output.suffix == ".parquet":
+        summary.to_parquet(output, index=False)
+    else:
+        summary.to_csv(output, index=False)
+    logger.info(f"Wrote {len(summary)} rows to {output} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
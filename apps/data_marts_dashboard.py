@@ -1,9 +1,12 @@
 # /// script
 # requires-python = ">=3.12"
 # dependencies = [
-#     "marimo>=0.13.15",
+#     "marimo>=0.16.0",
 #     "pandas>=2.0.0",
 #     "plotly>=5.0.0",
+#     "pyarrow>=14.0.0",
+#     "duckdb>=1.0.0",
+#     "polars>=1.25.0",
 # ]
 # ///
 
@@ -15,14 +18,17 @@ app = marimo.App(width="full")
 
 @app.cell
 def _():
+    # Only light imports here: under Pyodide every third-party package is a download
+    # plus a slow import, so pandas and plotly are imported by the cells that need
+    # them, after the header and the mart selector have rendered.
+    import json
     import marimo as mo
-    import pandas as pd
-    import plotly.express as px
-    import plotly.graph_objects as go
+    import os
+    import sys
+    import urllib.request
     from pathlib import Path
-    from plotly.subplots import make_subplots
 
-    return go, make_subplots, mo, pd, px
+    return Path, json, mo, os, sys, urllib
 
 
 @app.cell
@@ -37,13 +43,6 @@ def _(mo):
     return
 
 
-@app.cell
-def _():
-    # Base URL for CSV files from GitHub raw content
-    base_url = "https://raw.githubusercontent.com/njaltran/health-insurance-dashboard/main/apps/public"
-    return (base_url,)
-
-
 @app.cell
 def _(mo):
     mo.md("""
@@ -54,24 +53,772 @@ def _(mo):
 
 @app.cell
 def _(mo):
+    mart_names = [
+        "dm_customer_360",
+        "dm_health_by_demographics",
+        "dm_insurance_profitability",
+        "dm_sleep_health_analysis",
+        "dm_data_quality_dashboard"
+    ]
+    default_mart = "dm_customer_360"
     data_mart_selector = mo.ui.dropdown(
-        options=[
-            "dm_customer_360",
-            "dm_health_by_demographics",
-            "dm_insurance_profitability",
-            "dm_sleep_health_analysis",
-            "dm_data_quality_dashboard"
-        ],
-        value="dm_customer_360",
+        options=mart_names,
+        value=default_mart,
         label="Choose a Data Mart:"
     )
     data_mart_selector
-    return (data_mart_selector,)
+    return data_mart_selector, default_mart, mart_names
+
+
+@app.cell
+def _(Path, json, mo, urllib):
+    # Data files are published in the public/ folder next to the app. The build gives them
+    # content-hash fingerprints (dm_customer_360.1a2b3c4d.csv), the canonical variant, and
+    # writes an asset manifest mapping logical names to fingerprinted ones under "files";
+    # without a manifest the plain names are used.
+    data_root = mo.notebook_location() / "public"
+
+    def read_asset_text(location):
+        # Local runs get a filesystem path, the WebAssembly export gets a URL
+        if isinstance(location, Path):
+            return location.read_text()
+        with urllib.request.urlopen(str(location)) as response:
+            return response.read().decode("utf-8")
+
+    try:
+        asset_manifest = json.loads(read_asset_text(data_root / "asset-manifest.json"))["files"]
+    except Exception:
+        asset_manifest = {}
+
+    def resolve_asset(name):
+        return data_root / asset_manifest.get(name, name)
+    return read_asset_text, resolve_asset
+
+
+@app.cell
+def _(Path, json, read_asset_text, resolve_asset):
+    import hashlib
+    # numpy is loaded by pandas anyway; importing it here rather than with the plotting
+    # stack keeps the light computations of the what-if and percentile cells from
+    # waiting for plotly
+    import numpy as np
+    import pandas as pd
+
+    # The build bundles the marts as Parquet and lists them in a marts manifest.
+    # Parquet is smaller and much faster to parse than CSV under Pyodide; marts that
+    # are bundled as CSV or missing from the manifest (local runs) are read from CSV.
+    try:
+        import pyarrow  # noqa: F401 - pandas' Parquet engine
+        marts_manifest = json.loads(read_asset_text(resolve_asset("marts-manifest.json")))
+    except Exception:
+        marts_manifest = {}
+
+    def mart_file(name):
+        entry = marts_manifest.get(name, {})
+        if entry.get("format") == "parquet":
+            return resolve_asset(entry["file"]), "parquet"
+        return resolve_asset(f"{name}.csv"), "csv"
+
+    # Columns that a view reads from the marts besides the selected one, with their dtypes:
+    # mart -> view (the selected mart whose charts read it) -> {column: dtype}. The
+    # selected mart itself is read in full for the data preview.
+    view_columns = {
+        "dm_customer_360": {
+            "dm_insurance_profitability": {
+                "occupational_category": "str", "insurance_sign_up_date": "str", "created_at": "str",
+                "current_heart_rate_bpm": "float64", "lifetime_premiums_paid": "float64",
+                "lifetime_claims_amount": "float64", "health_status": "str", "insurance_status": "str",
+                # Risk factors of the what-if scoring
+                "current_sleep_hours": "float64", "current_daily_steps": "float64",
+                "current_blood_oxygen_pct": "float64", "current_systolic_bp": "float64",
+                "current_sleep_disorder": "str",
+            },
+        },
+        "dm_loss_ratio_forecast": {
+            "dm_insurance_profitability": {
+                "level": "str", "segment": "str", "loss_ratio_pct_p05": "float64", "loss_ratio_pct_p25": "float64",
+                "loss_ratio_pct_p50": "float64", "loss_ratio_pct_p75": "float64", "loss_ratio_pct_p95": "float64",
+                "pct_above_limit": "float64",
+            },
+        },
+        "dm_customer_anomalies": {
+            "dm_data_quality_dashboard": {
+                "PersonID": "int64", "activity_level_numeric": "int64", "current_daily_steps": "float64",
+                "steps_z": "float64", "anomaly_status": "str", "anomaly_score": "float64",
+                "outlier_metrics": "str", "mart_version": "str",
+            },
+        },
+    }
+
+    # Tables that a view reads besides the selected mart
+    view_marts = {}
+    for _mart, _views in view_columns.items():
+        for _view in _views:
+            view_marts.setdefault(_view, []).append(_mart)
+
+    def mart_columns(name, view=None):
+        """Return the columns of a mart that a view reads, or None for all of them."""
+        if view is None or view == name:
+            return None
+        return view_columns.get(name, {}).get(view)
+
+    def read_mart(source, file_format, columns=None):
+        """Parse a mart file or buffer, only the given {column: dtype} if any.
+
+        Skipped columns are not parsed at all: usecols for CSV, a column-pruned read for
+        Parquet. Columns missing from the file (such as the sign-up date of older
+        exports) are left out.
+        """
+        if file_format == "parquet":
+            if columns is not None:
+                import pyarrow.parquet as pq
+                available = set(pq.read_schema(source).names)
+                if hasattr(source, "seek"):
+                    source.seek(0)
+                columns = [column for column in columns if column in available]
+            return pd.read_parquet(source, columns=columns)
+        if columns is None:
+            return pd.read_csv(source)
+        return pd.read_csv(source, usecols=lambda column: column in columns, dtype=columns)
+
+    def load_mart(name, columns=None):
+        location, file_format = mart_file(name)
+        return read_mart(str(location), file_format, columns)
+
+    _local_versions = {}
+
+    def mart_version(name):
+        """Return the content version of a mart, as in the marts manifest of the build.
+
+        Local runs have no manifest, so the version is hashed from the local file.
+        """
+        if name in marts_manifest:
+            return marts_manifest[name]["version"]
+        location, _ = mart_file(name)
+        if not isinstance(location, Path):
+            return None
+        if name not in _local_versions:
+            _local_versions[name] = hashlib.sha256(location.read_bytes()).hexdigest()[:12]
+        return _local_versions[name]
+
+    return (
+        load_mart,
+        mart_columns,
+        mart_file,
+        mart_version,
+        np,
+        pd,
+        read_mart,
+        view_columns,
+        view_marts,
+    )
+
+
+@app.cell
+def _(
+    default_mart,
+    load_mart,
+    mart_columns,
+    mart_file,
+    mart_names,
+    read_mart,
+    sys,
+    view_columns,
+    view_marts,
+):
+    # Background prefetch: every mart starts downloading as soon as the app opens, so
+    # switching marts only waits for a fetch that is still in flight. Under Pyodide the
+    # fetches are asyncio tasks using pyfetch, with a high fetch priority for the mart
+    # shown first; on a server they run on a thread pool, the shown mart queued first.
+    import asyncio
+    import io
+    from concurrent.futures import Future
+
+    mart_cache = {}
+    # Columns read into the cache and columns being prefetched, per mart (None: all)
+    _cached_columns = {}
+    _pending = {}
+    _prefetch = list(dict.fromkeys(mart_names + [n for names in view_marts.values() for n in names]))
+
+    def _covers(columns, needed):
+        return columns is None or (needed is not None and set(needed) <= set(columns))
+
+    def _union(columns, more):
+        return None if columns is None or more is None else {**columns, **more}
+
+    def _prefetch_columns(name):
+        # The marts read by the first view get only its columns. Other marts are read in
+        # full, as they can be selected, except those that are only read by views: they
+        # get the union of the columns of those views.
+        if name in view_marts.get(default_mart, []):
+            return mart_columns(name, default_mart)
+        if name in mart_names:
+            return None
+        columns = {}
+        for _columns in view_columns[name].values():
+            columns.update(_columns)
+        return columns
+
+    if sys.platform == "emscripten":
+        from pyodide.http import pyfetch
+
+        async def _fetch_mart(name, priority, columns):
+            location, file_format = mart_file(name)
+            response = await pyfetch(str(location), priority=priority)
+            response.raise_for_status()
+            return read_mart(io.BytesIO(await response.bytes()), file_format, columns)
+
+        for _name in _prefetch:
+            _columns = _prefetch_columns(_name)
+            _task = asyncio.ensure_future(
+                _fetch_mart(_name, "high" if _name == default_mart else "low", _columns)
+            )
+            _pending[_name] = (_task, _columns)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        _pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mart-prefetch")
+        for _name in sorted(_prefetch, key=lambda name: name != default_mart):
+            _columns = _prefetch_columns(_name)
+            _pending[_name] = (_pool.submit(load_mart, _name, _columns), _columns)
+
+    def _missing(name, view):
+        """Return whether the cache lacks columns that a view reads, and the columns to read."""
+        columns = mart_columns(name, view)
+        if name not in mart_cache:
+            return True, columns
+        if _covers(_cached_columns[name], columns):
+            return False, None
+        # Read it again with the union, so that it keeps serving the views that used it before
+        return True, _union(_cached_columns[name], columns)
+
+    def _take_pending(name, columns):
+        """Return the prefetch of a mart if it reads at least the given columns."""
+        pending, pending_columns = _pending.pop(name, (None, None))
+        if pending is None:
+            return None, columns
+        if not _covers(pending_columns, columns) or (isinstance(pending, Future) and pending.cancel()):
+            # Too few columns, or still queued behind other marts: load it right away instead
+            if isinstance(pending, Future):
+                pending.cancel()
+            return None, columns
+        return pending, pending_columns
+
+    def _store(name, frame, columns):
+        mart_cache[name] = frame
+        _cached_columns[name] = columns
+        return frame
+
+    async def get_mart(name, view=None):
+        """Return a mart from the cache, waiting only while its prefetch is in flight.
+
+        Args:
+            name: The mart to return
+            view: The selected mart whose view reads it; only the columns that view
+                needs (see view_columns) are read. Defaults to all columns.
+        """
+        missing, columns = _missing(name, view)
+        if not missing:
+            return mart_cache[name]
+        pending, pending_columns = _take_pending(name, columns)
+        if pending is not None:
+            try:
+                frame = await (asyncio.wrap_future(pending) if isinstance(pending, Future) else pending)
+                return _store(name, frame, pending_columns)
+            except Exception as e:
+                print(f"Prefetch of {name} failed, loading it again: {e}")
+        return _store(name, load_mart(name, columns), columns)
+
+    def cached_mart(name, view=None):
+        """Synchronous access to the mart cache for cells that run after get_mart."""
+        missing, columns = _missing(name, view)
+        if not missing:
+            return mart_cache[name]
+        pending, pending_columns = _take_pending(name, columns)
+        if pending is not None and (isinstance(pending, Future) or pending.done()):
+            try:
+                return _store(name, pending.result(), pending_columns)
+            except Exception as e:
+                print(f"Prefetch of {name} failed, loading it again: {e}")
+        return _store(name, load_mart(name, columns), columns)
+    return cached_mart, get_mart
+
+
+@app.cell
+def _(Path, cached_mart, mart_file, mart_version, os, pd, sys):
+    # Query layer: the data prep of each chart is written once as SQL for an embedded
+    # DuckDB database and once as the equivalent pandas chain. DuckDB scans the mart files
+    # directly, with projection and predicate pushdown, runs multi-threaded and spills to
+    # disk when a mart outgrows memory. The pandas chains are the fallback wherever DuckDB
+    # cannot be imported, and the default under Pyodide, where the marts are already in
+    # memory; DASHBOARD_QUERY_BACKEND=pandas|duckdb|polars picks the backend of a
+    # deployment. The polars backend builds each query as a LazyFrame over
+    # scan_csv/scan_parquet and runs it on the streaming engine. DuckDB and polars are
+    # only imported when used, through importlib, so that the WebAssembly export, which
+    # installs every module a cell imports, does not download them.
+    # Queries over aggregates that ingest.py keeps up to date from the deltas of
+    # dm_customer_360, or that partitioned.py computes on several cores, read those
+    # instead, whatever the backend, as long as they were computed from the version of
+    # the mart that is shown. Tables that scripts derive
+    # from a mart, such as the anomaly table, are checked the same way.
+    import importlib
+
+    def _polars():
+        return importlib.import_module("polars")
+
+    def _duckdb():
+        return importlib.import_module("duckdb")
+
+    query_backend = os.environ.get(
+        "DASHBOARD_QUERY_BACKEND", "pandas" if sys.platform == "emscripten" else "duckdb"
+    )
+    try:
+        if query_backend == "polars":
+            _polars()
+        elif query_backend == "duckdb":
+            _duckdb()
+    except ImportError:
+        query_backend = "pandas"
+
+    occupation_labels = {
+        "it specialist": "IT-Specialist", "healthcare_worker": "Healthcare Worker",
+        "office_worker": "Office Worker", "retail_worker": "Retail Worker",
+        "self-employed": "Self-Employed", "student": "Student",
+        "engineer": "Engineer", "nurse": "Nurse",
+        "teacher": "Teacher", "unemployed": "Unemployed"
+    }
+    portfolio_columns = [
+        'age', 'avg_annual_doctor_visits', 'lifetime_doctor_visits', 'lifetime_premiums_paid',
+        'current_sleep_hours', 'current_daily_steps', 'current_heart_rate_bpm',
+        'avg_annual_claims', 'lifetime_claims_amount'
+    ]
+
+    _connection = {}
+    _registered = {}
+    _frames = {}
+    # The profitability queries read the customers through the columns of its view
+    _customers_view = "dm_insurance_profitability"
+
+    def _sign_up_column(columns):
+        return 'insurance_sign_up_date' if 'insurance_sign_up_date' in columns else 'created_at'
+
+    def _duck():
+        """Return the DuckDB connection, opened on first use."""
+        if "duckdb" not in _connection:
+            _connection["duckdb"] = _duckdb().connect()
+        return _connection["duckdb"]
+
+    def _register(name, view=None):
+        """Register a mart (or the customers view) with DuckDB, unless it already is.
+
+        Returns what it was registered from: the local file, or the identity of the
+        parsed frame, which changes when the cache reads more of its columns.
+        """
+        duck = _duck()
+        if name == "customers":
+            source = _register("dm_customer_360", _customers_view)
+            if _registered.get(name) == source:
+                return source
+            # Customer-level view shared by the profitability queries: readable occupation
+            # labels, the sign-up month and the heart rate category
+            date_col = _sign_up_column(duck.table("dm_customer_360").columns)
+            duck.register("occupation_labels", pd.DataFrame(list(occupation_labels.items()), columns=["raw", "label"]))
+            duck.execute(f"""
+                CREATE OR REPLACE VIEW customers AS
+                SELECT
+                    c.* EXCLUDE (occupational_category),
+                    coalesce(l.label, c.occupational_category) AS occupational_category,
+                    TRY_CAST(c.{date_col} AS TIMESTAMP) AS temp_date,
+                    CASE
+                        WHEN c.current_heart_rate_bpm IS NULL THEN 'Unknown'
+                        WHEN c.current_heart_rate_bpm > 100 THEN 'High'
+                        WHEN c.current_heart_rate_bpm < 60 THEN 'Low'
+                        ELSE 'Normal'
+                    END AS heart_rate_category
+                FROM dm_customer_360 c
+                LEFT JOIN occupation_labels l ON c.occupational_category = l.raw
+            """)
+        else:
+            location, file_format = mart_file(name)
+            if isinstance(location, Path):
+                # Local file: DuckDB scans it itself and only reads the columns a query uses
+                source = location
+                if _registered.get(name) == source:
+                    return source
+                reader = "read_parquet" if file_format == "parquet" else "read_csv_auto"
+                path = location.as_posix().replace("'", "''")
+                duck.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM {reader}('{path}')")
+            else:
+                # Under Pyodide the mart comes over HTTP, so register the parsed frame, which
+                # is not copied. The frame is kept below, so its identity stays unique.
+                frame = cached_mart(name, view)
+                source = id(frame)
+                if _registered.get(name) == source:
+                    return source
+                duck.register(name, frame)
+                _frames[name] = frame
+        _registered[name] = source
+        return source
+
+    def _customers_frame():
+        customers = cached_mart("dm_customer_360", _customers_view).copy()
+        customers['occupational_category'] = customers['occupational_category'].replace(occupation_labels)
+        customers['temp_date'] = pd.to_datetime(customers[_sign_up_column(customers.columns)], errors='coerce')
+        bpm = customers['current_heart_rate_bpm']
+        customers['heart_rate_category'] = 'Normal'
+        customers.loc[bpm < 60, 'heart_rate_category'] = 'Low'
+        customers.loc[bpm > 100, 'heart_rate_category'] = 'High'
+        customers.loc[bpm.isna(), 'heart_rate_category'] = 'Unknown'
+        return customers
+
+    def _lazy_mart(pl, name, view=None):
+        location, file_format = mart_file(name)
+        if isinstance(location, Path):
+            if file_format == "parquet":
+                return pl.scan_parquet(location)
+            return pl.scan_csv(location, infer_schema_length=None)
+        return pl.from_pandas(cached_mart(name, view)).lazy()
+
+    def _lazy_customers(pl):
+        customers = _lazy_mart(pl, "dm_customer_360", _customers_view)
+        date_col = _sign_up_column(customers.collect_schema().names())
+        bpm = pl.col('current_heart_rate_bpm')
+        return customers.with_columns(
+            pl.col('occupational_category').replace(occupation_labels),
+            pl.col(date_col).cast(pl.String).str.to_datetime(strict=False).alias('temp_date'),
+            pl.when(bpm.is_null()).then(pl.lit('Unknown'))
+            .when(bpm > 100).then(pl.lit('High'))
+            .when(bpm < 60).then(pl.lit('Low'))
+            .otherwise(pl.lit('Normal')).alias('heart_rate_category'),
+        )
+
+    def _lazy_sums(pl):
+        return [pl.col('lifetime_premiums_paid').sum(), pl.col('lifetime_claims_amount').sum()]
+
+    def _lazy_deviation(pl):
+        customers = _lazy_customers(pl)
+        claims, premiums = pl.col('lifetime_claims_amount'), pl.col('lifetime_premiums_paid')
+        portfolio = customers.select((claims.sum() / premiums.sum()).alias('portfolio_avg'))
+        return (
+            customers.filter(pl.col('occupational_category').is_not_null())
+            .group_by('occupational_category').agg(claims.sum(), premiums.sum())
+            .with_columns((claims / premiums).alias('Segment Loss Ratio'))
+            .join(portfolio, how='cross')
+            .with_columns((pl.col('Segment Loss Ratio') - pl.col('portfolio_avg')).alias('Deviation'))
+            .drop('portfolio_avg')
+            .sort(['Deviation', 'occupational_category'])
+        )
+
+    def _lazy_flows(pl, source, target):
+        return (
+            _lazy_customers(pl).filter(pl.col(source).is_not_null() & pl.col(target).is_not_null())
+            .group_by([source, target]).agg(pl.len().alias('Value'))
+            .rename({source: 'Source', target: 'Target'})
+            .sort(['Source', 'Target'])
+        )
+
+    def _collect(lazy):
+        try:
+            frame = lazy.collect(engine="streaming")
+        except TypeError:
+            # Polars releases before the new streaming engine
+            frame = lazy.collect(streaming=True)
+        return frame.to_pandas()
+
+    def _profitability_trend(rows=None):
+        # Customer rows, or the monthly sums of a maintained aggregate
+        if rows is None:
+            customers = _customers_frame()
+            rows = customers.assign(sign_up_month=customers['temp_date'].dt.to_period("M").dt.to_timestamp())
+        else:
+            rows = rows.assign(sign_up_month=pd.to_datetime(rows['sign_up_month']))
+        trend = rows.groupby('sign_up_month')[['lifetime_premiums_paid', 'lifetime_claims_amount']].sum().reset_index()
+        return trend.rename(columns={'sign_up_month': 'Date'})
+
+    def current_table(name, source, view=None):
+        """Return a table derived from the mart `source` by a script, or None if it is missing
+        or was computed from another version of that mart (its mart_version column)."""
+        try:
+            rows = cached_mart(name, view=view)
+            current = len(rows) > 0 and (rows['mart_version'] == mart_version(source)).all()
+        except Exception:
+            return None
+        return rows if current else None
+
+    _maintained = {}
+
+    def _maintained_rows(name, mart="dm_customer_360"):
+        """Return an aggregate published by ingest.py or partitioned.py, with readable
+        occupations, if it is current."""
+        if (mart, name) not in _maintained:
+            rows = current_table(f"{mart}_{name}", mart)
+            if rows is not None and 'occupational_category' in rows:
+                rows = rows.assign(occupational_category=rows['occupational_category'].replace(occupation_labels))
+            _maintained[mart, name] = rows
+        return _maintained[mart, name]
+
+    def _from_maintained(name, prepare, mart="dm_customer_360"):
+        rows = _maintained_rows(name, mart)
+        return None if rows is None else prepare(rows)
+
+    def _maintained_scatter(cost_col):
+        # Means from the published sums and counts of non-missing values, as the pandas mean
+        if cost_col != 'avg_insurance_cost':
+            return None
+        rows = _maintained_rows("age_group_totals", "dm_health_by_demographics")
+        if rows is None:
+            return None
+        totals = rows.groupby('age_group').sum(numeric_only=True)
+        return pd.DataFrame({
+            'avg_sleep_hours': totals['avg_sleep_hours'] / totals['avg_sleep_hours_count'],
+            cost_col: totals[cost_col] / totals[f'{cost_col}_count'],
+            'avg_sleep_quality_score': totals['avg_sleep_quality_score'],
+        }).reset_index()
+
+    def _maintained_heart_rate(rows):
+        totals = rows.groupby(['age_group', 'gender'])[['avg_heart_rate_bpm', 'avg_heart_rate_bpm_count']].sum()
+        return (totals['avg_heart_rate_bpm'] / totals['avg_heart_rate_bpm_count']).rename('avg_heart_rate_bpm').reset_index()
+
+    def _profitability_cost_matrix(rows=None):
+        # Customer rows, or the per-group sums of a maintained aggregate: summing either gives the matrix
+        rows = _customers_frame() if rows is None else rows
+        cost_matrix = rows.groupby(['occupational_category', 'heart_rate_category']).agg({
+            'lifetime_premiums_paid': 'sum', 'lifetime_claims_amount': 'sum'
+        }).reset_index()
+        cost_matrix['Loss Ratio'] = cost_matrix['lifetime_claims_amount'] / cost_matrix['lifetime_premiums_paid']
+        return cost_matrix
+
+    def _profitability_deviation(rows=None):
+        customers = _customers_frame() if rows is None else rows
+        portfolio_avg = customers['lifetime_claims_amount'].sum() / customers['lifetime_premiums_paid'].sum()
+        dev_df = customers.groupby('occupational_category').agg({
+            'lifetime_claims_amount': 'sum', 'lifetime_premiums_paid': 'sum'
+        }).reset_index()
+        dev_df['Segment Loss Ratio'] = dev_df['lifetime_claims_amount'] / dev_df['lifetime_premiums_paid']
+        dev_df['Deviation'] = dev_df['Segment Loss Ratio'] - portfolio_avg
+        return dev_df.sort_values('Deviation', ascending=True).reset_index(drop=True)
+
+    def _flows(source, target, rows=None):
+        # Customer rows, or the per-pair counts of a maintained aggregate
+        if rows is None:
+            flows = _customers_frame().groupby([source, target]).size().reset_index(name='count')
+        else:
+            flows = rows.groupby([source, target])['count'].sum().reset_index()
+        flows.columns = ['Source', 'Target', 'Value']
+        return flows
+
+    # name -> marts it reads, SQL, pandas and polars equivalents and the columns that identify a row
+    queries = {
+        "portfolio_averages": {
+            "marts": ["dm_customer_360"],
+            "sql": "SELECT " + ", ".join(f"avg({c}) AS {c}" for c in portfolio_columns) + " FROM dm_customer_360",
+            "pandas": lambda: cached_mart("dm_customer_360")[portfolio_columns].mean().to_frame().T,
+            "polars": lambda pl: _lazy_mart(pl, "dm_customer_360").select(
+                [pl.col(c).mean() for c in portfolio_columns]
+            ),
+            "keys": [],
+        },
+        "demographics_scatter": {
+            "marts": ["dm_health_by_demographics"],
+            "sql": """
+                SELECT age_group, avg(avg_sleep_hours) AS avg_sleep_hours, avg({cost_col}) AS {cost_col},
+                       sum(avg_sleep_quality_score) AS avg_sleep_quality_score
+                FROM dm_health_by_demographics WHERE age_group IS NOT NULL
+                GROUP BY age_group ORDER BY age_group
+            """,
+            "pandas": lambda cost_col: cached_mart("dm_health_by_demographics").groupby('age_group', observed=True).agg({
+                'avg_sleep_hours': 'mean', cost_col: 'mean', 'avg_sleep_quality_score': 'sum'
+            }).reset_index(),
+            "maintained": _maintained_scatter,
+            "polars": lambda pl, cost_col: _lazy_mart(pl, "dm_health_by_demographics")
+                .filter(pl.col('age_group').is_not_null())
+                .group_by('age_group')
+                .agg(pl.col('avg_sleep_hours').mean(), pl.col(cost_col).mean(), pl.col('avg_sleep_quality_score').sum())
+                .sort('age_group'),
+            "params": {"cost_col": "avg_insurance_cost"},
+            "keys": ["age_group"],
+        },
+        "demographics_heart_rate": {
+            "marts": ["dm_health_by_demographics"],
+            "sql": """
+                SELECT age_group, gender, avg(avg_heart_rate_bpm) AS avg_heart_rate_bpm
+                FROM dm_health_by_demographics WHERE age_group IS NOT NULL AND gender IS NOT NULL
+                GROUP BY age_group, gender ORDER BY age_group, gender
+            """,
+            "pandas": lambda: cached_mart("dm_health_by_demographics").groupby(
+                ['age_group', 'gender'], observed=True
+            )['avg_heart_rate_bpm'].mean().reset_index(),
+            "maintained": lambda: _from_maintained(
+                "age_gender_heart_rate", _maintained_heart_rate, "dm_health_by_demographics"
+            ),
+            "polars": lambda pl: _lazy_mart(pl, "dm_health_by_demographics")
+                .filter(pl.col('age_group').is_not_null() & pl.col('gender').is_not_null())
+                .group_by(['age_group', 'gender']).agg(pl.col('avg_heart_rate_bpm').mean())
+                .sort(['age_group', 'gender']),
+            "keys": ["age_group", "gender"],
+        },
+        "sleep_by_stress": {
+            "marts": ["dm_sleep_health_analysis"],
+            "sql": """
+                SELECT stress_level, avg(avg_sleep_hours) AS avg_sleep_hours, avg(pct_sleep_deprived) AS pct_sleep_deprived
+                FROM dm_sleep_health_analysis WHERE stress_level IS NOT NULL
+                GROUP BY stress_level ORDER BY stress_level
+            """,
+            "pandas": lambda: cached_mart("dm_sleep_health_analysis").groupby('stress_level').agg({
+                'avg_sleep_hours': 'mean', 'pct_sleep_deprived': 'mean'
+            }).reset_index(),
+            "polars": lambda pl: _lazy_mart(pl, "dm_sleep_health_analysis")
+                .filter(pl.col('stress_level').is_not_null())
+                .group_by('stress_level')
+                .agg(pl.col('avg_sleep_hours').mean(), pl.col('pct_sleep_deprived').mean())
+                .sort('stress_level'),
+            "keys": ["stress_level"],
+        },
+        "profitability_trend": {
+            "marts": ["customers"],
+            "sql": """
+                SELECT date_trunc('month', temp_date) AS "Date",
+                       sum(lifetime_premiums_paid) AS lifetime_premiums_paid,
+                       sum(lifetime_claims_amount) AS lifetime_claims_amount
+                FROM customers WHERE temp_date IS NOT NULL
+                GROUP BY 1 ORDER BY 1
+            """,
+            "pandas": _profitability_trend,
+            "maintained": lambda: _from_maintained("monthly_totals", _profitability_trend),
+            "polars": lambda pl: _lazy_customers(pl).filter(pl.col('temp_date').is_not_null())
+                .group_by(pl.col('temp_date').dt.truncate('1mo').alias('Date')).agg(_lazy_sums(pl))
+                .sort('Date'),
+            "keys": ["Date"],
+        },
+        "profitability_cost_matrix": {
+            "marts": ["customers"],
+            "sql": """
+                SELECT occupational_category, heart_rate_category,
+                       sum(lifetime_premiums_paid) AS lifetime_premiums_paid,
+                       sum(lifetime_claims_amount) AS lifetime_claims_amount,
+                       sum(lifetime_claims_amount) / sum(lifetime_premiums_paid) AS "Loss Ratio"
+                FROM customers WHERE occupational_category IS NOT NULL
+                GROUP BY 1, 2 ORDER BY 1, 2
+            """,
+            "pandas": _profitability_cost_matrix,
+            "maintained": lambda: _from_maintained("cost_matrix", _profitability_cost_matrix),
+            "polars": lambda pl: _lazy_customers(pl).filter(pl.col('occupational_category').is_not_null())
+                .group_by(['occupational_category', 'heart_rate_category']).agg(_lazy_sums(pl))
+                .with_columns((pl.col('lifetime_claims_amount') / pl.col('lifetime_premiums_paid')).alias('Loss Ratio'))
+                .sort(['occupational_category', 'heart_rate_category']),
+            "keys": ["occupational_category", "heart_rate_category"],
+        },
+        "profitability_deviation": {
+            "marts": ["customers"],
+            "sql": """
+                SELECT occupational_category,
+                       sum(lifetime_claims_amount) AS lifetime_claims_amount,
+                       sum(lifetime_premiums_paid) AS lifetime_premiums_paid,
+                       sum(lifetime_claims_amount) / sum(lifetime_premiums_paid) AS "Segment Loss Ratio",
+                       sum(lifetime_claims_amount) / sum(lifetime_premiums_paid)
+                           - (SELECT sum(lifetime_claims_amount) / sum(lifetime_premiums_paid) FROM customers) AS "Deviation"
+                FROM customers WHERE occupational_category IS NOT NULL
+                GROUP BY 1 ORDER BY "Deviation", occupational_category
+            """,
+            "pandas": _profitability_deviation,
+            "maintained": lambda: _from_maintained("segment_totals", _profitability_deviation),
+            "polars": _lazy_deviation,
+            "keys": ["occupational_category"],
+        },
+        "profitability_flows_health": {
+            "marts": ["customers"],
+            "sql": """
+                SELECT occupational_category AS "Source", health_status AS "Target", count(*) AS "Value"
+                FROM customers WHERE occupational_category IS NOT NULL AND health_status IS NOT NULL
+                GROUP BY 1, 2 ORDER BY 1, 2
+            """,
+            "pandas": lambda: _flows('occupational_category', 'health_status'),
+            "maintained": lambda: _from_maintained(
+                "flows_health", lambda rows: _flows('occupational_category', 'health_status', rows)
+            ),
+            "polars": lambda pl: _lazy_flows(pl, 'occupational_category', 'health_status'),
+            "keys": ["Source", "Target"],
+        },
+        "profitability_flows_status": {
+            "marts": ["customers"],
+            "sql": """
+                SELECT health_status AS "Source", insurance_status AS "Target", count(*) AS "Value"
+                FROM customers WHERE health_status IS NOT NULL AND insurance_status IS NOT NULL
+                GROUP BY 1, 2 ORDER BY 1, 2
+            """,
+            "pandas": lambda: _flows('health_status', 'insurance_status'),
+            "maintained": lambda: _from_maintained(
+                "flows_status", lambda rows: _flows('health_status', 'insurance_status', rows)
+            ),
+            "polars": lambda pl: _lazy_flows(pl, 'health_status', 'insurance_status'),
+            "keys": ["Source", "Target"],
+        },
+        "quality_segments": {
+            "marts": ["dm_data_quality_dashboard"],
+            "sql": """
+                SELECT * EXCLUDE (created_at) FROM dm_data_quality_dashboard
+                WHERE data_source IN ('By Occupation', 'All Sources')
+            """,
+            "pandas": lambda: cached_mart("dm_data_quality_dashboard").query(
+                "data_source in ['By Occupation', 'All Sources']"
+            ).drop(columns='created_at').reset_index(drop=True),
+            "polars": lambda pl: _lazy_mart(pl, "dm_data_quality_dashboard")
+                .filter(pl.col('data_source').is_in(['By Occupation', 'All Sources']))
+                .drop('created_at'),
+            "keys": ["data_source", "quality_dimension"],
+        },
+    }
+
+    def run_query(name, backend=None, **params):
+        """Return the result of a named chart query as a DataFrame."""
+        query = queries[name]
+        params = {**query.get("params", {}), **params}
+        if backend in (None, "maintained") and "maintained" in query:
+            result = query["maintained"](**params)
+            if result is not None:
+                return result
+            if backend == "maintained":
+                raise ValueError("no current aggregate of ingest.py or partitioned.py")
+        backend = backend or query_backend
+        if backend == "duckdb":
+            for mart in query["marts"]:
+                _register(mart)
+            return _duck().execute(query["sql"].format(**params)).df()
+        if backend == "polars":
+            # Stays lazy until here; only the aggregated result is converted for plotly
+            return _collect(query["polars"](_polars(), **params))
+        return query["pandas"](**params)
+
+    def check_query_backends():
+        """Run every query on the DuckDB and polars backends, and on the aggregates of
+        ingest.py and partitioned.py where they have them, and compare them with pandas."""
+        results = []
+        for name, query in queries.items():
+            for backend in ("duckdb", "polars") + (("maintained",) if "maintained" in query else ()):
+                try:
+                    expected, actual = (
+                        run_query(name, backend=b).sort_values(query["keys"]).reset_index(drop=True)
+                        if query["keys"] else run_query(name, backend=b)
+                        for b in ("pandas", backend)
+                    )
+                    pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+                    results.append({"query": name, "backend": backend, "equal": True, "detail": ""})
+                except Exception as e:
+                    detail = str(e).strip().splitlines()[0]
+                    results.append({"query": name, "backend": backend, "equal": False, "detail": detail})
+        return pd.DataFrame(results)
+    return (
+        check_query_backends,
+        current_table,
+        occupation_labels,
+        query_backend,
+        run_query,
+    )
 
 
 @app.cell
-def _(base_url, data_mart_selector, pd):
-    # Load selected data mart from CSV
+async def _(data_mart_selector, get_mart, view_marts):
+    # Load selected data mart
     selected_table = data_mart_selector.value
 
     # Display name mapping
@@ -84,9 +831,11 @@ def _(base_url, data_mart_selector, pd):
     }
     display_name = display_names.get(selected_table, selected_table)
 
-    # Read CSV file from GitHub raw URL
-    csv_url = f"{base_url}/{selected_table}.csv"
-    df = pd.read_csv(csv_url)
+    # Take the mart from the prefetch cache, waiting only if it is still downloading
+    df = await get_mart(selected_table)
+    for _name in view_marts.get(selected_table, []):
+        # Only the columns this view reads of the other marts
+        await get_mart(_name, view=selected_table)
     return df, display_name, selected_table
 
 
@@ -130,28 +879,442 @@ def _(df, mo, selected_table):
 
 
 @app.cell
-def _(
-    base_url,
+def _(cached_mart, df, mo, np, occupation_labels, pd, selected_table):
+    # What-if health risk scoring. The health_risk_score of dm_customer_360 adds points for
+    # each risk factor of a customer, and health_status buckets the score; the factors
+    # below reproduce both. The sliders move the thresholds, and every move re-scores the
+    # whole portfolio in one vectorized pass over arrays that are prepared once per mart.
+    risk_factors = {
+        # name: column, comparison and threshold of the mart, points, slider range and label
+        "sleep": {"column": "current_sleep_hours", "op": "<", "threshold": 6.0, "points": 2,
+                  "range": (3.0, 9.0, 0.25), "label": "Short sleep: fewer hours than"},
+        "steps": {"column": "current_daily_steps", "op": "<", "threshold": 5000, "points": 1,
+                  "range": (1000, 15000, 500), "label": "Inactive: fewer daily steps than"},
+        "heart_rate": {"column": "current_heart_rate_bpm", "op": ">", "threshold": 100, "points": 2,
+                       "range": (60, 140, 1), "label": "High heart rate: more bpm than"},
+        "blood_oxygen": {"column": "current_blood_oxygen_pct", "op": "<", "threshold": 95.0, "points": 2,
+                         "range": (85.0, 100.0, 0.5), "label": "Low blood oxygen: less % than"},
+        "blood_pressure": {"column": "current_systolic_bp", "op": ">=", "threshold": 140, "points": 3,
+                           "range": (100, 180, 1), "label": "Hypertension: systolic mmHg from"},
+    }
+    # Points of a diagnosed sleep disorder, which has no threshold
+    sleep_disorder_points = 3
+    # Lowest score of each health status
+    risk_statuses = {"Low Risk": 0, "Moderate Risk": 4, "High Risk": 8}
+    _comparisons = {"<": np.less, ">": np.greater, ">=": np.greater_equal}
+
+    def prepare_risk_model(customers):
+        """Convert the customers to the arrays the what-if scoring runs on.
+
+        Args:
+            customers (pd.DataFrame): Rows of dm_customer_360 with the risk factor columns
+
+        Returns:
+            Dict[str, object]: The factor values, the fixed points, the claims, premiums and
+                category codes of every customer, and the segment totals of the mart
+        """
+        disorder = customers['current_sleep_disorder'].fillna('none').str.lower()
+        occupations, occupation_names = pd.factorize(customers['occupational_category'])
+        insurance, insurance_names = pd.factorize(customers['insurance_status'])
+        mart_status = pd.Categorical(customers['health_status'], categories=list(risk_statuses)).codes
+        model = {
+            "values": {name: customers[f["column"]].to_numpy(dtype=np.float64) for name, f in risk_factors.items()},
+            "fixed_points": np.where(disorder.to_numpy() != 'none', sleep_disorder_points, 0).astype(np.int8),
+            "claims": customers['lifetime_claims_amount'].fillna(0).to_numpy(dtype=np.float64),
+            "premiums": customers['lifetime_premiums_paid'].fillna(0).to_numpy(dtype=np.float64),
+            "occupations": occupations,
+            "occupation_names": [occupation_labels.get(o, o) for o in occupation_names],
+            "insurance": insurance,
+            "insurance_names": list(insurance_names),
+        }
+        model["mart_segments"] = _segments(model, mart_status)
+        return model
+
+    def _segments(model, status):
+        """Customers, claims, premiums and loss ratio per health status (code -1 is left out)."""
+        known = status >= 0
+        totals = {
+            key: np.bincount(status[known], weights=None if key == "customers" else model[key][known], minlength=len(risk_statuses))
+            for key in ("customers", "claims", "premiums")
+        }
+        with np.errstate(divide='ignore', invalid='ignore'):
+            loss_ratio = totals["claims"] / totals["premiums"]
+        return pd.DataFrame({
+            "health_status": list(risk_statuses), "customers": totals["customers"].astype(np.int64),
+            "claims": totals["claims"], "premiums": totals["premiums"], "loss_ratio": loss_ratio,
+        })
+
+    def _flows(source, source_names, target, target_names):
+        """Customers per (source, target) pair, as Source/Target/Value rows like the flow queries."""
+        known = (source >= 0) & (target >= 0)
+        counts = np.bincount(source[known] * len(target_names) + target[known], minlength=len(source_names) * len(target_names))
+        flows = pd.DataFrame({
+            "Source": np.repeat(source_names, len(target_names)),
+            "Target": np.tile(target_names, len(source_names)),
+            "Value": counts,
+        })
+        return flows[flows["Value"] > 0].reset_index(drop=True)
+
+    def score_portfolio(model, thresholds, cutoffs=None):
+        """Re-score every customer with the given thresholds, in one pass over the arrays.
+
+        Args:
+            model (Dict[str, object]): Arrays of prepare_risk_model()
+            thresholds (Dict[str, float]): Threshold per risk factor name
+            cutoffs (Dict[str, int], optional): Lowest score per health status. Defaults to
+                the ones of the mart.
+
+        Returns:
+            Dict[str, object]: The score and status code of every customer, the totals and
+                loss ratio per status, and the flows of the profitability Sankey diagram
+        """
+        cutoffs = cutoffs or risk_statuses
+        # Scores fit in int8, which keeps every step of the pass a small, cheap array
+        score = model["fixed_points"].copy()
+        for name, factor in risk_factors.items():
+            flagged = _comparisons[factor["op"]](model["values"][name], thresholds[name])
+            score += flagged.view(np.int8) * np.int8(factor["points"])
+        # The status code is the number of cutoffs above Low Risk that the score reaches
+        status = np.zeros(len(score), dtype=np.int8)
+        for status_name in list(risk_statuses)[1:]:
+            status += (score >= cutoffs[status_name]).view(np.int8)
+        return {
+            "scores": score,
+            "status": status,
+            "segments": _segments(model, status),
+            "flows_health": _flows(model["occupations"], model["occupation_names"], status, list(risk_statuses)),
+            "flows_status": _flows(status, list(risk_statuses), model["insurance"], model["insurance_names"]),
+        }
+
+    if selected_table in ("dm_customer_360", "dm_insurance_profitability"):
+        _customers = df if selected_table == "dm_customer_360" else cached_mart("dm_customer_360", view=selected_table)
+        risk_model = prepare_risk_model(_customers)
+    else:
+        risk_model = None
+
+    risk_thresholds = mo.ui.dictionary({
+        name: mo.ui.slider(*f["range"], value=f["threshold"], label=f["label"], show_value=True)
+        for name, f in risk_factors.items()
+    })
+    risk_cutoffs = mo.ui.dictionary({
+        status: mo.ui.slider(1, 15, value=score, label=f"{status} from score", show_value=True)
+        for status, score in risk_statuses.items() if score > 0
+    })
+
+    mo.vstack([
+        mo.md("### 🎚️ What-if Risk Scoring"),
+        mo.md("Move the thresholds of the health risk score to re-segment the portfolio. "
+              "The defaults reproduce the `health_risk_score` and `health_status` of the mart."),
+        mo.hstack([risk_thresholds.vstack(), risk_cutoffs.vstack()], justify="start", gap=4),
+    ]) if risk_model is not None else mo.md("")
+    return (
+        risk_cutoffs,
+        risk_factors,
+        risk_model,
+        risk_statuses,
+        risk_thresholds,
+        score_portfolio,
+    )
+
+
+@app.cell
+def _(risk_cutoffs, risk_factors, risk_model, risk_statuses, risk_thresholds, score_portfolio):
+    # Re-scored on every slider move; None when the view has no what-if scoring
+    risk_scenario = None
+    if risk_model is not None:
+        _cutoffs = {"Low Risk": 0, **risk_cutoffs.value}
+        risk_scenario = score_portfolio(risk_model, risk_thresholds.value, _cutoffs)
+        risk_scenario["changed"] = _cutoffs != risk_statuses or any(
+            risk_thresholds.value[name] != f["threshold"] for name, f in risk_factors.items()
+        )
+    return (risk_scenario,)
+
+
+@app.cell
+def _(df, np, occupation_labels, pd, run_query, selected_table):
+    # Benchmarks of the Customer 360 drill-down. They only depend on the loaded mart, so
+    # they are computed once per version of it, not on every customer selection: the
+    # portfolio averages, and the percentile ranks of every customer on each metric,
+    # overall and within their cohort (occupation and age band). Looking up a customer
+    # is then a single index access.
+    ranked_metrics = [
+        'current_heart_rate_bpm', 'avg_annual_claims', 'avg_annual_doctor_visits',
+        'current_sleep_hours', 'current_daily_steps',
+        'lifetime_premiums_paid', 'lifetime_claims_amount'
+    ]
+    # Age bands, as in dm_health_by_demographics
+    age_bins = [0, 30, 40, 50, 60, 70, float("inf")]
+    age_bands = ['18-29', '30-39', '40-49', '50-59', '60-69', '70+']
+
+    def _run_ends(*sorted_keys):
+        """For each element of sorted keys, the position after the last element equal to it."""
+        new = np.zeros(len(sorted_keys[0]), dtype=bool)
+        new[:1] = True
+        for keys in sorted_keys:
+            new[1:] |= keys[1:] != keys[:-1]
+        ends = np.flatnonzero(np.append(new[1:], True)) + 1
+        return ends[np.cumsum(new) - 1]
+
+    def _percentiles(values, cohorts, n_cohorts):
+        """Percent of the values, overall and in the same cohort, at most as high as each value.
+
+        One sort by value, then a stable sort by cohort code, which keeps the values
+        sorted within each cohort. Missing values get no percentile and are not counted.
+        """
+        overall = np.full(len(values), np.nan, dtype=np.float32)
+        within = overall.copy()
+        valid = np.flatnonzero(~np.isnan(values))
+        values, cohorts = values[valid], cohorts[valid]
+
+        order = np.argsort(values, kind='stable')
+        overall[valid[order]] = _run_ends(values[order]) / max(len(values), 1) * 100
+
+        order = order[np.argsort(cohorts[order], kind='stable')]
+        sorted_cohorts = cohorts[order]
+        counts = np.bincount(sorted_cohorts, minlength=n_cohorts)
+        starts = np.cumsum(counts) - counts
+        at_most = _run_ends(values[order], sorted_cohorts) - starts[sorted_cohorts]
+        within[valid[order]] = at_most / counts[sorted_cohorts] * 100
+        return overall, within
+
+    def rank_customers(customers):
+        """Return the percentile ranks of every customer on the ranked metrics.
+
+        The percentile of a value is the share of rows, in the portfolio or in the
+        cohort, whose value is at most as high (pandas' rank(method='max', pct=True)).
+
+        Args:
+            customers (pd.DataFrame): Rows of dm_customer_360
+
+        Returns:
+            pd.DataFrame: Indexed by PersonID, the `cohort` label, and `<metric>_pct` and
+                `<metric>_cohort_pct` for each metric, from 0 to 100
+        """
+        occupations, occupation_names = pd.factorize(customers['occupational_category'])
+        age_codes = pd.cut(customers['age'], bins=age_bins, labels=age_bands, right=False).cat.codes.to_numpy()
+        # Code -1 (missing) becomes the last cohort of each axis, labelled "unknown"
+        occupation_names = np.append(occupation_names.map(lambda o: occupation_labels.get(o, o)).astype(object), 'unknown')
+        band_names = np.array(age_bands + ['unknown'], dtype=object)
+        cohorts = (
+            np.where(occupations < 0, len(occupation_names) - 1, occupations) * len(band_names)
+            + np.where(age_codes < 0, len(band_names) - 1, age_codes)
+        )
+        n_cohorts = len(occupation_names) * len(band_names)
+        # Small codes make the stable sort by cohort a radix sort
+        cohorts = cohorts.astype(np.int16 if n_cohorts < 2**15 else np.int64)
+
+        # A person with several policies is shown with their first one, as in the drill-down
+        first = ~customers['PersonID'].duplicated().to_numpy()
+        cohort_names = np.array([f"{o}, {b}" for o in occupation_names for b in band_names], dtype=object)
+        ranks = {'cohort': cohort_names[cohorts[first]]}
+        for metric in [c for c in ranked_metrics if c in customers.columns]:
+            overall, within = _percentiles(customers[metric].to_numpy(dtype=np.float64), cohorts, n_cohorts)
+            ranks[f'{metric}_pct'] = overall[first]
+            ranks[f'{metric}_cohort_pct'] = within[first]
+        return pd.DataFrame(ranks, index=pd.Index(customers['PersonID'].to_numpy()[first], name='PersonID'))
+
+    if selected_table == "dm_customer_360":
+        portfolio_averages = run_query("portfolio_averages").iloc[0].to_dict()
+        percentile_ranks = rank_customers(df) if 'PersonID' in df.columns else None
+    else:
+        portfolio_averages, percentile_ranks = {}, None
+    return percentile_ranks, portfolio_averages
+
+
+@app.cell
+def _(json, np, pd):
+    # The plotting stack is the heaviest download of the app; importing it in its own
+    # cell lets the selectors and the data preview render while it loads
+    import base64
+    import time
+
+    import plotly.express as px
+    import plotly.graph_objects as go
+    import plotly.offline
+    from plotly.subplots import make_subplots
+    from plotly.utils import PlotlyJSONEncoder
+
+    try:
+        import orjson
+    except ImportError:
+        orjson = None
+
+    # Compact chart payloads: numeric trace arrays are sent as base64 typed arrays, which
+    # plotly.js decodes itself from version 2.28, instead of JSON number lists that take
+    # several times the bytes and time to write and parse. The rest of the figure is
+    # written with orjson where it is installed.
+    _plotlyjs_version = plotly.offline.get_plotlyjs_version()
+    _typed_arrays = tuple(int(part) for part in _plotlyjs_version.split(".")[:2]) >= (2, 28)
+    # Trace attributes that can hold numbers; arrays with text in them are left as they are
+    _numeric_keys = {
+        "x", "y", "z", "r", "theta", "lat", "lon", "values", "value", "source", "target",
+        "size", "color", "base", "width", "open", "high", "low", "close", "customdata",
+    }
+    # Shorter arrays are smaller as JSON than as base64
+    _min_typed_length = 8
+
+    def _typed_array(values):
+        """Return a numeric array as a plotly.js typed array, or None if it is not numeric."""
+        try:
+            array = np.asarray(values)
+        except ValueError:
+            return None
+        if array.dtype.kind == "O":
+            # Numbers with gaps (None) become floats with NaN; anything else is kept
+            if not all(v is None or (isinstance(v, (int, float)) and not isinstance(v, bool)) for v in array.flat):
+                return None
+            array = array.astype("float64")
+        if array.dtype.kind not in "iuf" or array.size < _min_typed_length:
+            return None
+        if array.dtype.kind in "iu" and array.dtype.itemsize == 8:
+            # plotly.js has no 64-bit integer arrays
+            fits = np.iinfo(np.int32).min <= array.min() and array.max() <= np.iinfo(np.int32).max
+            array = array.astype("int32" if fits else "float64")
+        elif array.dtype.kind == "f" and array.dtype.itemsize == 2:
+            array = array.astype("float32")
+        dtype = f"{array.dtype.kind}{array.dtype.itemsize}"
+        typed = {"dtype": dtype, "bdata": base64.b64encode(np.ascontiguousarray(array, dtype=f"<{dtype}").tobytes()).decode("ascii")}
+        if array.ndim > 1:
+            typed["shape"] = ", ".join(str(n) for n in array.shape)
+        return typed
+
+    def _encode_arrays(node):
+        """Replace the numeric arrays of a trace (and its nested attributes) by typed arrays."""
+        count = 0
+        for key, value in node.items():
+            if isinstance(value, dict):
+                count += _encode_arrays(value)
+            elif key in _numeric_keys and isinstance(value, (list, tuple, np.ndarray)):
+                typed = _typed_array(value)
+                if typed is not None:
+                    node[key] = typed
+                    count += 1
+        return count
+
+    def _dumps(payload):
+        if orjson is not None:
+            return orjson.dumps(
+                payload,
+                default=PlotlyJSONEncoder().default,
+                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+            ).decode("utf-8")
+        return json.dumps(payload, cls=PlotlyJSONEncoder, separators=(",", ":"))
+
+    def figure_html(fig, config=None):
+        """Return a standalone HTML page for a figure, and the size and time of its payload.
+
+        Drop-in for plotly.io.to_html(fig, full_html=True, include_plotlyjs="cdn", config=config).
+        """
+        start = time.perf_counter()
+        figure = fig.to_dict()
+        arrays = sum(_encode_arrays(trace) for trace in figure["data"]) if _typed_arrays else 0
+        payload = _dumps({"data": figure["data"], "layout": figure["layout"], "config": config or {}})
+        # Keep the payload from closing its script element
+        payload = payload.replace("</", "<\\/")
+        html = f"""<html>
+<head><meta charset="utf-8" /></head>
+<body>
+    <div id="chart" class="plotly-graph-div" style="height:100%; width:100%;"></div>
+    <script charset="utf-8" src="https://cdn.plot.ly/plotly-{_plotlyjs_version}.min.js"></script>
+    <script type="text/javascript">
+        var figure = {payload};
+        Plotly.newPlot("chart", figure.data, figure.layout, figure.config);
+    </script>
+</body>
+</html>"""
+        stats = {
+            "payload bytes": len(payload.encode("utf-8")),
+            "typed arrays": arrays,
+            "serialize ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+        return html, stats
+
+    def heatmap(data, x, y, z, histfunc="avg", title=None, labels=None, category_orders=None, color_continuous_scale=None):
+        """Return a heatmap of z aggregated over the categories of x and y.
+
+        Drop-in for px.density_heatmap(data, x=x, y=y, z=z, histfunc=histfunc, ...) on
+        categorical axes, but the grid is aggregated here, with group codes and
+        np.bincount, so the figure holds one value per cell instead of every row for
+        plotly.js to bin. Cells without rows are left blank.
+        """
+        labels = labels or {}
+        category_orders = category_orders or {}
+        axes = []
+        for column in (x, y):
+            codes, uniques = pd.factorize(data[column])
+            # The listed categories first, then the others in order of appearance, as px does
+            present = set(uniques)
+            order = [value for value in category_orders.get(column, []) if value in present]
+            order += [value for value in uniques if value not in set(order)]
+            if column == y and column in category_orders:
+                # px lists the y categories from the top down
+                order.reverse()
+            recode = pd.Index(order).get_indexer(uniques)
+            axes.append((order, np.where(codes >= 0, recode[codes], -1)))
+        (x_values, x_codes), (y_values, y_codes) = axes
+
+        values = pd.to_numeric(data[z], errors="coerce").to_numpy(dtype="float64")
+        keep = (x_codes >= 0) & (y_codes >= 0) & ~np.isnan(values)
+        cells = y_codes[keep] * len(x_values) + x_codes[keep]
+        size = len(x_values) * len(y_values)
+        counts = np.bincount(cells, minlength=size)
+        sums = np.bincount(cells, weights=values[keep], minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            grid = sums / counts if histfunc == "avg" else np.where(counts > 0, sums, np.nan)
+
+        x_label, y_label = labels.get(x, x), labels.get(y, y)
+        z_label = f"{histfunc} of {labels.get(z, z)}"
+        fig = go.Figure(go.Heatmap(
+            x=x_values, y=y_values, z=grid.reshape(len(y_values), len(x_values)), coloraxis="coloraxis",
+            hovertemplate=f"{x_label}=%{{x}}<br>{y_label}=%{{y}}<br>{z_label}=%{{z}}<extra></extra>",
+        ))
+        fig.update_layout(
+            title=title,
+            xaxis=dict(title=x_label, type="category"),
+            yaxis=dict(title=y_label, type="category"),
+            coloraxis=dict(colorscale=color_continuous_scale, colorbar_title_text=z_label),
+        )
+        return fig
+
+    return figure_html, go, heatmap, make_subplots, px
+
+
+@app.cell
+def build_chart_slots(
+    cached_mart,
+    current_table,
     customer_selector,
     df,
     go,
+    heatmap,
     make_subplots,
-    mo,
+    occupation_labels,
     pd,
+    percentile_ranks,
+    portfolio_averages,
     px,
+    risk_model,
+    risk_scenario,
+    run_query,
     selected_table,
 ):
-    # Dynamic visualizations based on selected data mart
-    customer_360_charts = []
+    # Dynamic visualizations based on selected data mart. Each chart is a slot: a function
+    # that queries its data and builds the figure, and the height the figure takes. The
+    # slots are only built when they are shown (see the next cell).
+    import functools
+
+    chart_slots = []
 
     if selected_table == "dm_customer_360":
-            # 1. Calculate Global Averages (Used for Reference Lines)
-            avg_hr = df['current_heart_rate_bpm'].mean()
-            avg_claims = df['avg_annual_claims'].mean()
-            avg_visits = df['avg_annual_doctor_visits'].mean()
+            # 1. Global Averages (Used for Reference Lines), computed with the percentile ranks
+            portfolio = portfolio_averages
+            avg_hr = portfolio['current_heart_rate_bpm']
+            avg_claims = portfolio['avg_annual_claims']
+            avg_visits = portfolio['avg_annual_doctor_visits']
 
             # 2. Determine Data Source (Single User vs. Global Average)
             cust_data = {}
+            cust_ranks = None
             view_title = ""
 
             if customer_selector.value is not None:
@@ -160,73 +1323,82 @@ def _(
                 cust_rows = df[df['PersonID'] == pid]
             
                 if cust_rows.empty:
-                    customer_360_charts = [go.Figure().add_annotation(text="Customer ID Not Found")]
+                    chart_slots = [(lambda: go.Figure().add_annotation(text="Customer ID Not Found"), 450)]
                 else:
                     # FIX: Convert to dictionary immediately to avoid Pandas "Ambiguous Truth" error
                     cust_data = cust_rows.iloc[0].to_dict()
                     view_title = f"Customer Profile: {pid}"
+                    if percentile_ranks is not None and pid in percentile_ranks.index:
+                        cust_ranks = percentile_ranks.loc[pid]
             else:
                 # CASE B: No Selection -> Use Portfolio Averages
-                cust_data = {
-                    'age': df['age'].mean(),
-                    'avg_annual_doctor_visits': avg_visits,
-                    'lifetime_doctor_visits': df['lifetime_doctor_visits'].mean(),
-                    'lifetime_premiums_paid': df['lifetime_premiums_paid'].mean(),
-                    'current_sleep_hours': df['current_sleep_hours'].mean(),
-                    'current_daily_steps': df['current_daily_steps'].mean(),
-                    'current_heart_rate_bpm': avg_hr,
-                    'avg_annual_claims': avg_claims,
-                    'lifetime_claims_amount': df['lifetime_claims_amount'].mean()
-                }
+                cust_data = portfolio
                 view_title = "Global Portfolio Average (All Customers)"
 
             # 3. Generate Visualizations (If valid data exists)
             if cust_data:
                 # --- FIG 1: STATS CARD ---
-                fig_stats = go.Figure()
-                stats_text = [
-                    f"<b>Age:</b> {int(cust_data.get('age', 0))}",
-                    f"<b>Annual DV's:</b> {cust_data.get('avg_annual_doctor_visits', 0):.1f}",
-                    f"<b>Lifetime DV's:</b> {int(cust_data.get('lifetime_doctor_visits', 0))}",
-                    f"<b>Lifetime Prem:</b> ${cust_data.get('lifetime_premiums_paid', 0):,.0f}"
-                ]
-                fig_stats.add_annotation(
-                    x=0.5, y=0.5, text="<br>".join(stats_text), showarrow=False,
-                    font=dict(size=14, color="#333"), align="left",
-                    bgcolor="#f0f0f0", bordercolor="#ccc", borderwidth=1, borderpad=20, width=200
-                )
-                fig_stats.update_layout(
-                    height=180, margin=dict(l=0, r=0, t=30, b=0),
-                    title_text=view_title,
-                    xaxis=dict(visible=False), yaxis=dict(visible=False),
-                    plot_bgcolor='rgba(0,0,0,0)'
-                )
+                def build_stats():
+                    fig_stats = go.Figure()
+                    stats_text = [
+                        f"<b>Age:</b> {int(cust_data.get('age', 0))}",
+                        f"<b>Annual DV's:</b> {cust_data.get('avg_annual_doctor_visits', 0):.1f}",
+                        f"<b>Lifetime DV's:</b> {int(cust_data.get('lifetime_doctor_visits', 0))}",
+                        f"<b>Lifetime Prem:</b> ${cust_data.get('lifetime_premiums_paid', 0):,.0f}"
+                    ]
+                    fig_stats.add_annotation(
+                        x=0.5, y=0.5, text="<br>".join(stats_text), showarrow=False,
+                        font=dict(size=14, color="#333"), align="left",
+                        bgcolor="#f0f0f0", bordercolor="#ccc", borderwidth=1, borderpad=20, width=200
+                    )
+                    fig_stats.update_layout(
+                        height=180, margin=dict(l=0, r=0, t=30, b=0),
+                        title_text=view_title,
+                        xaxis=dict(visible=False), yaxis=dict(visible=False),
+                        plot_bgcolor='rgba(0,0,0,0)'
+                    )
+                    return fig_stats
 
                 # --- FIG 2: LIFESTYLE AUDIT ---
-                fig_lifestyle = make_subplots(rows=1, cols=2, subplot_titles=("Avg Sleep Hours (Target: 7h)", "Daily Steps (Target: 10k)"))
+                def build_lifestyle():
+                    fig_lifestyle = make_subplots(rows=1, cols=2, subplot_titles=("Avg Sleep Hours (Target: 7h)", "Daily Steps (Target: 10k)"))
             
-                # Sleep
-                sleep_val = cust_data.get('current_sleep_hours', 0)
-                fig_lifestyle.add_trace(go.Bar(
-                    x=[sleep_val], y=[''], orientation='h', name='Sleep', marker_color='#4e79a7', 
-                    text=[f"{sleep_val:.1f}h"], textposition='auto'
-                ), row=1, col=1)
-                fig_lifestyle.add_vline(x=7, line_width=2, line_dash="dash", line_color="gray", annotation_text="Target", row=1, col=1)
-
-                # Steps
-                steps_val = cust_data.get('current_daily_steps', 0)
-                fig_lifestyle.add_trace(go.Bar(
-                    x=[steps_val], y=[''], orientation='h', name='Steps', marker_color='#4e79a7',
-                    text=[f"{int(steps_val):,}"], textposition='auto'
-                ), row=1, col=2)
-                fig_lifestyle.add_vline(x=10000, line_width=2, line_dash="dash", line_color="gray", annotation_text="Target", row=1, col=2)
-
-                fig_lifestyle.update_layout(height=250, showlegend=False, title_text="Lifestyle Audit")
-                fig_lifestyle.update_xaxes(range=[0, 12], row=1, col=1) 
-                fig_lifestyle.update_xaxes(range=[0, 15000], row=1, col=2) 
+                    # Sleep
+                    sleep_val = cust_data.get('current_sleep_hours', 0)
+                    fig_lifestyle.add_trace(go.Bar(
+                        x=[sleep_val], y=[''], orientation='h', name='Sleep', marker_color='#4e79a7', 
+                        text=[f"{sleep_val:.1f}h"], textposition='auto'
+                    ), row=1, col=1)
+                    fig_lifestyle.add_vline(x=7, line_width=2, line_dash="dash", line_color="gray", annotation_text="Target", row=1, col=1)
+
+                    # Steps
+                    steps_val = cust_data.get('current_daily_steps', 0)
+                    fig_lifestyle.add_trace(go.Bar(
+                        x=[steps_val], y=[''], orientation='h', name='Steps', marker_color='#4e79a7',
+                        text=[f"{int(steps_val):,}"], textposition='auto'
+                    ), row=1, col=2)
+                    fig_lifestyle.add_vline(x=10000, line_width=2, line_dash="dash", line_color="gray", annotation_text="Target", row=1, col=2)
+
+                    fig_lifestyle.update_layout(height=250, showlegend=False, title_text="Lifestyle Audit")
+                    fig_lifestyle.update_xaxes(range=[0, 12], row=1, col=1) 
+                    fig_lifestyle.update_xaxes(range=[0, 15000], row=1, col=2) 
+                    return fig_lifestyle
 
                 # --- FIG 3-5: COMPARISON CHARTS (Teal Dot vs Red Line) ---
-                def create_comparison_chart(val, avg, title, max_range):
+                def ordinal(n):
+                    n = int(round(n))
+                    return f"{n}{'th' if 11 <= n % 100 <= 13 else {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')}"
+
+                def percentile_text(metric, label):
+                    """Percentiles of the selected customer on a metric, e.g. "92nd percentile for claims"."""
+                    if cust_ranks is None or pd.isna(cust_ranks.get(f"{metric}_pct")):
+                        return ""
+                    return (
+                        f" | {ordinal(cust_ranks[f'{metric}_pct'])} percentile for {label}"
+                        f" ({ordinal(cust_ranks[f'{metric}_cohort_pct'])} among {cust_ranks['cohort']})"
+                    )
+
+                def create_comparison_chart(val, avg, title, max_range, percentiles=""):
                     fig = go.Figure()
                     # The Dot (Customer/Average)
                     fig.add_trace(go.Scatter(
@@ -238,7 +1410,7 @@ def _(
                     fig.add_vline(x=avg, line_width=3, line_color="#e15759")
                 
                     fig.add_annotation(
-                        x=0.5, y=-0.3, text=f"Global Avg: {avg:,.1f}", 
+                        x=0.5, y=-0.3, text=f"Global Avg: {avg:,.1f}{percentiles}", 
                         showarrow=False, font=dict(size=12, color="#e15759"), xref="paper", yref="paper"
                     )
 
@@ -251,107 +1423,127 @@ def _(
                     fig.update_xaxes(showgrid=True, gridcolor='#f0f0f0')
                     return fig
 
-                fig_hr = create_comparison_chart(cust_data.get('current_heart_rate_bpm', 0), avg_hr, "Average Heart Rate vs. Global Average", 120)
-                fig_claims = create_comparison_chart(cust_data.get('avg_annual_claims', 0), avg_claims, "Annual Claims vs. Global Average", 6000)
-                fig_visits = create_comparison_chart(cust_data.get('avg_annual_doctor_visits', 0), avg_visits, "Average Doctor Visits vs. Global Average", 20)
-
                 # --- FIG 6: FINANCIAL BALANCE ---
-                fig_fin = go.Figure()
-                # Expenses (Red)
-                claim_amt = cust_data.get('lifetime_claims_amount', 0)
-                fig_fin.add_trace(go.Bar(
-                    y=['Balance'], x=[claim_amt * -1],
-                    name='Lifetime Claims', orientation='h', marker_color='#e15759',
-                    text=[f"${claim_amt:,.0f}"], textposition='inside'
-                ))
-                # Income (Green)
-                prem_amt = cust_data.get('lifetime_premiums_paid', 0)
-                fig_fin.add_trace(go.Bar(
-                    y=['Balance'], x=[prem_amt],
-                    name='Lifetime Premiums', orientation='h', marker_color='#59a14f',
-                    text=[f"${prem_amt:,.0f}"], textposition='inside'
-                ))
-                fig_fin.update_layout(
-                    title="Financial Balance", barmode='relative', height=200,
-                    xaxis=dict(title='Amount ($)', tickformat='s'), yaxis=dict(visible=False),
-                    legend=dict(orientation="h", y=-0.2)
-                )
+                def build_financial_balance():
+                    fig_fin = go.Figure()
+                    # Expenses (Red)
+                    claim_amt = cust_data.get('lifetime_claims_amount', 0)
+                    fig_fin.add_trace(go.Bar(
+                        y=['Balance'], x=[claim_amt * -1],
+                        name='Lifetime Claims', orientation='h', marker_color='#e15759',
+                        text=[f"${claim_amt:,.0f}"], textposition='inside'
+                    ))
+                    # Income (Green)
+                    prem_amt = cust_data.get('lifetime_premiums_paid', 0)
+                    fig_fin.add_trace(go.Bar(
+                        y=['Balance'], x=[prem_amt],
+                        name='Lifetime Premiums', orientation='h', marker_color='#59a14f',
+                        text=[f"${prem_amt:,.0f}"], textposition='inside'
+                    ))
+                    fig_fin.update_layout(
+                        title="Financial Balance", barmode='relative', height=200,
+                        xaxis=dict(title='Amount ($)', tickformat='s'), yaxis=dict(visible=False),
+                        legend=dict(orientation="h", y=-0.2)
+                    )
+                    return fig_fin
+
+                chart_slots = [
+                    (build_stats, 180),
+                    (build_lifestyle, 250),
+                    (lambda: create_comparison_chart(cust_data.get('current_heart_rate_bpm', 0), avg_hr, "Average Heart Rate vs. Global Average", 120, percentile_text('current_heart_rate_bpm', "heart rate")), 150),
+                    (lambda: create_comparison_chart(cust_data.get('avg_annual_claims', 0), avg_claims, "Annual Claims vs. Global Average", 6000, percentile_text('avg_annual_claims', "claims")), 150),
+                    (lambda: create_comparison_chart(cust_data.get('avg_annual_doctor_visits', 0), avg_visits, "Average Doctor Visits vs. Global Average", 20, percentile_text('avg_annual_doctor_visits', "doctor visits")), 150),
+                    (build_financial_balance, 200),
+                ]
 
-                customer_360_charts = [fig_stats, fig_lifestyle, fig_hr, fig_claims, fig_visits, fig_fin]
-        
     elif selected_table == "dm_health_by_demographics":
         # Health by Demographics visualizations
         age_order = ['18-29', '30-39', '40-49', '50-59', '60-69', '70+']
 
         # FIG 1: Scatter (Sleep vs Cost)
-        cost_col = next((c for c in df.columns if 'insurance' in c.lower() and 'cost' in c.lower()), 'avg_insurance_cost')
-        scatter_data = df.groupby('age_group', observed=True).agg({
-            'avg_sleep_hours': 'mean', cost_col: 'mean', 'avg_sleep_quality_score': 'sum' 
-        }).reset_index()
-
-        fig1 = px.scatter(
-            scatter_data, x='avg_sleep_hours', y=cost_col, color='age_group', size='avg_sleep_quality_score',
-            title='Effect of Average Sleep Hours on Insurance Cost by Age Group',
-            labels={'avg_sleep_hours': 'Avg Sleep Hours', cost_col: 'Avg Insurance Cost ($)', 'age_group': 'Age Group'},
-            category_orders={'age_group': age_order}, color_discrete_sequence=px.colors.qualitative.Bold
-        )
-        fig1.update_traces(textposition='top center', text=scatter_data[cost_col].round(2))
+        def build_sleep_cost_scatter():
+            cost_col = next((c for c in df.columns if 'insurance' in c.lower() and 'cost' in c.lower()), 'avg_insurance_cost')
+            scatter_data = run_query("demographics_scatter", cost_col=cost_col)
+
+            fig1 = px.scatter(
+                scatter_data, x='avg_sleep_hours', y=cost_col, color='age_group', size='avg_sleep_quality_score',
+                title='Effect of Average Sleep Hours on Insurance Cost by Age Group',
+                labels={'avg_sleep_hours': 'Avg Sleep Hours', cost_col: 'Avg Insurance Cost ($)', 'age_group': 'Age Group'},
+                category_orders={'age_group': age_order}, color_discrete_sequence=px.colors.qualitative.Bold
+            )
+            fig1.update_traces(textposition='top center', text=scatter_data[cost_col].round(2))
+            return fig1
 
         # FIG 2: Heatmap
-        fig2 = px.density_heatmap(
-            df, x='age_group', y='family_status', z='pct_with_sleep_disorder', histfunc='avg', 
-            title='Average Percentage with Sleep Disorder by Age Group and Family Status',
-            labels={'age_group': 'Age Group', 'family_status': 'Family Status', 'pct_with_sleep_disorder': '% With Disorder'},
-            category_orders={'age_group': age_order}, color_continuous_scale='Teal' 
-        )
+        def build_sleep_disorder_heatmap():
+            fig2 = heatmap(
+                df, x='age_group', y='family_status', z='pct_with_sleep_disorder', histfunc='avg', 
+                title='Average Percentage with Sleep Disorder by Age Group and Family Status',
+                labels={'age_group': 'Age Group', 'family_status': 'Family Status', 'pct_with_sleep_disorder': '% With Disorder'},
+                category_orders={'age_group': age_order}, color_continuous_scale='Teal' 
+            )
+            return fig2
 
         # FIG 3: Bar (Heart Rate)
-        hr_by_demo = df.groupby(['age_group', 'gender'], observed=True)['avg_heart_rate_bpm'].mean().reset_index()
-        fig3 = px.bar(
-            hr_by_demo, x='age_group', y='avg_heart_rate_bpm', color='gender', barmode='group',
-            title='Average Heart Rate by Age Group and Gender',
-            labels={'avg_heart_rate_bpm': 'Avg Heart Rate (BPM)', 'age_group': 'Age Group'},
-            category_orders={'age_group': age_order},
-            color_discrete_map={'female': '#e15759', 'male': '#4e79a7', 'other': '#bab0ac'}
-        )
-        customer_360_charts = [fig1, fig2, fig3]
+        def build_heart_rate_bars():
+            hr_by_demo = run_query("demographics_heart_rate")
+            fig3 = px.bar(
+                hr_by_demo, x='age_group', y='avg_heart_rate_bpm', color='gender', barmode='group',
+                title='Average Heart Rate by Age Group and Gender',
+                labels={'avg_heart_rate_bpm': 'Avg Heart Rate (BPM)', 'age_group': 'Age Group'},
+                category_orders={'age_group': age_order},
+                color_discrete_map={'female': '#e15759', 'male': '#4e79a7', 'other': '#bab0ac'}
+            )
+            return fig3
+
+        chart_slots = [(build_sleep_cost_scatter, 450), (build_sleep_disorder_heatmap, 450), (build_heart_rate_bars, 450)]
     elif selected_table == "dm_insurance_profitability":
         # Insurance Profitability visualizations
-    
-        # Initialize variables
-        top_row_fig = go.Figure()
-        middle_row_fig = go.Figure()
-        # fig_final = go.Figure() # Placeholder for your new specific visual
+        # Occupation labels, sign-up month and heart rate category are derived
+        # per customer by the query layer
+        def or_error(build):
+            """Show an empty chart instead of a figure whose data could not be loaded."""
+            def guarded():
+                try:
+                    return build()
+                except Exception as e:
+                    print(f"Could not load data: {e}")
+                    return go.Figure().update_layout(title="Error Loading Data")
+            return guarded
+
+        def add_forecast_bands(fig, start, start_ratio):
+            """Fan out from the last loss ratio to the bands simulated for the year after it."""
+            try:
+                # Written by simulate.py
+                forecast = cached_mart("dm_loss_ratio_forecast", view="dm_insurance_profitability")
+                portfolio = forecast[forecast['level'] == 'portfolio'].iloc[0]
+            except Exception as e:
+                print(f"Could not load the loss ratio forecast: {e}")
+                return
+            end = pd.Timestamp(start) + pd.DateOffset(years=1)
+            for low, high, color, name in (
+                ('p05', 'p95', 'rgba(78, 121, 167, 0.15)', 'Forecast 90% band'),
+                ('p25', 'p75', 'rgba(78, 121, 167, 0.3)', 'Forecast 50% band'),
+            ):
+                fig.add_trace(go.Scatter(
+                    x=[start, end, end, start],
+                    y=[start_ratio, portfolio[f'loss_ratio_pct_{high}'], portfolio[f'loss_ratio_pct_{low}'], start_ratio],
+                    fill='toself', fillcolor=color, line=dict(width=0), mode='lines', name=name, hoverinfo='skip'
+                ), row=1, col=2)
+            fig.add_trace(go.Scatter(
+                x=[start, end], y=[start_ratio, portfolio['loss_ratio_pct_p50']], mode='lines',
+                name='Forecast median', line=dict(color='#4e79a7', dash='dash')
+            ), row=1, col=2)
+            fig.add_annotation(
+                x=end, y=portfolio['loss_ratio_pct_p95'], yshift=10, showarrow=False, xanchor='right',
+                text=f"P(>60%): {portfolio['pct_above_limit']:.1f}%", row=1, col=2
+            )
 
         # ---------------------------------------------------------
-        # DATA LOADING & PREP
+        # TOP ROW: Time Series
         # ---------------------------------------------------------
-        try:
-            # Load raw data
-            ts_raw_df = pd.read_csv(f"{base_url}/dm_customer_360.csv")
-        
-            # 1. RENAME OCCUPATIONS
-            ts_raw_df['occupational_category'] = ts_raw_df['occupational_category'].replace({
-                "it specialist": "IT-Specialist", "healthcare_worker": "Healthcare Worker",
-                "office_worker": "Office Worker", "retail_worker": "Retail Worker",
-                "self-employed": "Self-Employed", "student": "Student",
-                "engineer": "Engineer", "nurse": "Nurse",
-                "teacher": "Teacher", "unemployed": "Unemployed"
-            })
-
-            # 2. Date Conversion
-            date_col = 'insurance_sign_up_date'
-            if date_col not in ts_raw_df.columns:
-                date_col = 'created_at'  
-            ts_raw_df['temp_date'] = pd.to_datetime(ts_raw_df[date_col], errors='coerce')
-
-            # ---------------------------------------------------------
-            # TOP ROW: Time Series
-            # ---------------------------------------------------------
-            trend_df = ts_raw_df.groupby(ts_raw_df['temp_date'].dt.to_period("M").dt.to_timestamp())[[
-                'lifetime_premiums_paid', 'lifetime_claims_amount'
-            ]].sum().reset_index()
-            trend_df.rename(columns={'temp_date': 'Date'}, inplace=True)
+        def build_trend():
+            trend_df = run_query("profitability_trend")
             trend_df['Loss Ratio %'] = (trend_df['lifetime_claims_amount'] / trend_df['lifetime_premiums_paid'].replace(0, 1)) * 100
 
             top_row_fig = make_subplots(
@@ -367,7 +1559,7 @@ def _(
             # RIGHT: Loss Ratio
             top_row_fig.add_trace(go.Scatter(x=trend_df['Date'], y=trend_df['Loss Ratio %'], mode='lines', name='Loss Ratio %', line=dict(color='#4e79a7', width=3)), row=1, col=2)
             top_row_fig.add_hline(y=60, line_dash="solid", line_color="gray", annotation_text="Limit (60%)", row=1, col=2)
-        
+
             if not trend_df.empty:
                 last_val = trend_df.iloc[-1]
                 top_row_fig.add_annotation(
@@ -375,41 +1567,24 @@ def _(
                     text=f"{last_val['Loss Ratio %']:.1f}%",
                     showarrow=True, arrowhead=2, yshift=10, row=1, col=2
                 )
+                add_forecast_bands(top_row_fig, last_val['Date'], last_val['Loss Ratio %'])
 
             top_row_fig.update_layout(height=450, showlegend=True, margin=dict(l=50, r=20, t=60, b=20))
             top_row_fig.update_yaxes(title_text="Amount ($)", row=1, col=1)
             top_row_fig.update_yaxes(title_text="Loss Ratio (%)", row=1, col=2)
+            return top_row_fig
 
-            # ---------------------------------------------------------
-            # MIDDLE ROW: Deviation & Heatmap
-            # ---------------------------------------------------------
-        
+        # ---------------------------------------------------------
+        # MIDDLE ROW: Deviation & Heatmap
+        # ---------------------------------------------------------
+        def build_deviation_and_heatmap():
             # Heatmap Prep
-            def get_hr_category(bpm):
-                if pd.isna(bpm): return "Unknown"
-                if bpm > 100: return 'High'
-                elif bpm < 60: return 'Low'
-                else: return 'Normal'
-
-            ts_raw_df['Heart Rate Category'] = ts_raw_df['current_heart_rate_bpm'].apply(get_hr_category)
-            cost_matrix = ts_raw_df.groupby(['occupational_category', 'Heart Rate Category']).agg({
-                'lifetime_premiums_paid': 'sum', 'lifetime_claims_amount': 'sum'
-            }).reset_index()
-            cost_matrix['Loss Ratio'] = cost_matrix['lifetime_claims_amount'] / cost_matrix['lifetime_premiums_paid']
-            heatmap_data = cost_matrix.pivot(index='occupational_category', columns='Heart Rate Category', values='Loss Ratio')
-
-            # Deviation Prep
-            total_claims_global = ts_raw_df['lifetime_claims_amount'].sum()
-            total_premiums_global = ts_raw_df['lifetime_premiums_paid'].sum()
-            portfolio_avg = total_claims_global / total_premiums_global
-
-            dev_df = ts_raw_df.groupby('occupational_category').agg({
-                'lifetime_claims_amount': 'sum', 'lifetime_premiums_paid': 'sum'
-            }).reset_index()
-            dev_df['Segment Loss Ratio'] = dev_df['lifetime_claims_amount'] / dev_df['lifetime_premiums_paid']
-            dev_df['Deviation'] = dev_df['Segment Loss Ratio'] - portfolio_avg
-            dev_df = dev_df.sort_values('Deviation', ascending=True)
-        
+            cost_matrix = run_query("profitability_cost_matrix")
+            heatmap_data = cost_matrix.pivot(index='occupational_category', columns='heart_rate_category', values='Loss Ratio')
+
+            # Deviation Prep (sorted by deviation from the portfolio loss ratio)
+            dev_df = run_query("profitability_deviation")
+
             # Reorder Heatmap
             sorted_occupations = dev_df['occupational_category'].tolist()
             heatmap_data = heatmap_data.reindex(sorted_occupations)
@@ -421,7 +1596,7 @@ def _(
             )
 
             colors = ['#e15759' if x > 0 else '#4e79a7' for x in dev_df['Deviation']]
-        
+
             # Bar Chart
             middle_row_fig.add_trace(go.Bar(
                 x=dev_df['Deviation'], y=dev_df['occupational_category'], orientation='h',
@@ -440,18 +1615,22 @@ def _(
             middle_row_fig.update_yaxes(categoryorder='trace', row=1, col=2)
             middle_row_fig.update_xaxes(title_text="Deviation", row=1, col=1)
             middle_row_fig.update_xaxes(title_text="Risk Category", row=1, col=2)
+            return middle_row_fig
 
-            # ---------------------------------------------------------
-            # BOTTOM ROW: Sankey Diagram (Occupation -> Health -> Status)
-            # ---------------------------------------------------------
+        # ---------------------------------------------------------
+        # BOTTOM ROW: Sankey Diagram (Occupation -> Health -> Status)
+        # ---------------------------------------------------------
+        def build_customer_journey():
             # 1. Aggregate data for the flows
-            # Flow 1: Occupation -> Health Status
-            flow1 = ts_raw_df.groupby(['occupational_category', 'health_status']).size().reset_index(name='count')
-            flow1.columns = ['Source', 'Target', 'Value']
-        
-            # Flow 2: Health Status -> Insurance Status
-            flow2 = ts_raw_df.groupby(['health_status', 'insurance_status']).size().reset_index(name='count')
-            flow2.columns = ['Source', 'Target', 'Value']
+            if risk_scenario is not None and risk_scenario["changed"]:
+                # Health status as re-scored with the what-if thresholds
+                flow1, flow2 = risk_scenario["flows_health"], risk_scenario["flows_status"]
+            else:
+                # Flow 1: Occupation -> Health Status
+                flow1 = run_query("profitability_flows_health")
+
+                # Flow 2: Health Status -> Insurance Status
+                flow2 = run_query("profitability_flows_status")
 
             # 2. Create unique labels for nodes
             all_nodes = list(pd.concat([flow1['Source'], flow1['Target'], flow2['Target']]).unique())
@@ -500,345 +1679,356 @@ def _(
                 height=500,
                 font_size=12
             )
+            return bottom_row_fig
 
-        except Exception as e:
-            print(f"Could not load data: {e}")
-            top_row_fig = go.Figure().update_layout(title="Error Loading Data")
-            middle_row_fig = go.Figure().update_layout(title="Error Loading Data")
-            bottom_row_fig = go.Figure().update_layout(title="Error Loading Data")
-
-        customer_360_charts = [top_row_fig, middle_row_fig, bottom_row_fig]
+        chart_slots = [
+            (or_error(build_trend), 450),
+            (or_error(build_deviation_and_heatmap), 500),
+            (or_error(build_customer_journey), 500),
+        ]
 
     elif selected_table == "dm_sleep_health_analysis":
         # Sleep Health visualizations
-        fig1 = px.box(df, x='sleep_disorder', y=['avg_sleep_hours', 'avg_sleep_quality_score'], title='Sleep Metrics by Disorder Type', points='all')
-        fig2 = px.scatter(df, x='avg_daily_steps', y='avg_sleep_quality_score', color='activity_level', size='unique_persons', title='Daily Steps vs Sleep Quality')
-        fig3 = px.bar(df.groupby('stress_level').agg({'avg_sleep_hours': 'mean', 'pct_sleep_deprived': 'mean'}).reset_index(), x='stress_level', y=['avg_sleep_hours', 'pct_sleep_deprived'], title='Sleep Metrics by Stress Level', barmode='group')
-        fig4 = px.scatter(df, x='avg_heart_rate_bpm', y='avg_blood_oxygen_pct', color='sleep_disorder', size='unique_persons', title='Heart Rate vs Blood Oxygen')
-        customer_360_charts = [fig1, fig2, fig3, fig4]
+        chart_slots = [
+            (lambda: px.box(df, x='sleep_disorder', y=['avg_sleep_hours', 'avg_sleep_quality_score'], title='Sleep Metrics by Disorder Type', points='all'), 450),
+            (lambda: px.scatter(df, x='avg_daily_steps', y='avg_sleep_quality_score', color='activity_level', size='unique_persons', title='Daily Steps vs Sleep Quality'), 450),
+            (lambda: px.bar(run_query("sleep_by_stress"), x='stress_level', y=['avg_sleep_hours', 'pct_sleep_deprived'], title='Sleep Metrics by Stress Level', barmode='group'), 450),
+            (lambda: px.scatter(df, x='avg_heart_rate_bpm', y='avg_blood_oxygen_pct', color='sleep_disorder', size='unique_persons', title='Heart Rate vs Blood Oxygen'), 450),
+        ]
 
     elif selected_table == "dm_data_quality_dashboard":
         # Data Quality Dashboard visualizations
 
-        overall_row = df[
-            (df['data_source'] == 'All Sources') & 
-            (df['quality_dimension'] == 'Overall')
-        ].iloc[0]
+        def build_quality_kpis():
+            overall_row = df[
+                (df['data_source'] == 'All Sources') & 
+                (df['quality_dimension'] == 'Overall')
+            ].iloc[0]
 
-        # Metric calculation - Missing Rows
-        avg_missing = (overall_row['missing_blood_oxygen_pct'] + overall_row['missing_stress_level_pct']) / 2
-        completeness_score = 100 - avg_missing
+            # Metric calculation - Missing Rows
+            avg_missing = (overall_row['missing_blood_oxygen_pct'] + overall_row['missing_stress_level_pct']) / 2
+            completeness_score = 100 - avg_missing
     
-        # Error Counts for Donut
-        error_counts = {
-            "Missing Data": overall_row['missing_blood_oxygen_count'] + overall_row['missing_stress_level_count'],
-            "Extreme/Anomalies": (
-                overall_row['extreme_heart_rate_count'] + 
-                overall_row['extreme_sleep_hours_count'] + 
-                overall_row['extreme_step_count_count'] + 
-                overall_row['excessive_claims_count']
-            ),
-            "Invalid Format": (
-                overall_row['invalid_heart_rate_count'] + 
-                overall_row['invalid_steps_count'] + 
-                overall_row['invalid_blood_oxygen_count']
+            # Error Counts for Donut
+            error_counts = {
+                "Missing Data": overall_row['missing_blood_oxygen_count'] + overall_row['missing_stress_level_count'],
+                "Extreme/Anomalies": (
+                    overall_row['extreme_heart_rate_count'] + 
+                    overall_row['extreme_sleep_hours_count'] + 
+                    overall_row['extreme_step_count_count'] + 
+                    overall_row['excessive_claims_count']
+                ),
+                "Invalid Format": (
+                    overall_row['invalid_heart_rate_count'] + 
+                    overall_row['invalid_steps_count'] + 
+                    overall_row['invalid_blood_oxygen_count']
+                )
+            }
+            total_errors = sum(error_counts.values())
+
+            # Subplots created
+            kpi_fig = make_subplots(
+                rows=1, cols=3,
+                specs=[[{'type': 'domain'}, {'type': 'domain'}, {'type': 'domain'}]],
+                subplot_titles=("Overall Quality Score", "Data Completeness", "Quality Issues Distribution")
             )
-        }
-        total_errors = sum(error_counts.values())
 
-        # Subplots created
-        kpi_fig = make_subplots(
-            rows=1, cols=3,
-            specs=[[{'type': 'domain'}, {'type': 'domain'}, {'type': 'domain'}]],
-            subplot_titles=("Overall Quality Score", "Data Completeness", "Quality Issues Distribution")
-        )
+            # COLUMN 1: Overall Quality Gauge
+            kpi_fig.add_trace(go.Indicator(
+                mode="gauge+number+delta",
+                value=overall_row['overall_quality_score'],
+                delta={'reference': 99.0, 'position': "top", 'suffix': "%"},
+                gauge={
+                    'axis': {'range': [90, 100]},
+                    'bar': {'color': "#59a14f"},
+                    'steps': [
+                        {'range': [90, 98], 'color': "#f28e2b"},
+                        {'range': [98, 100], 'color': "#f1f1f1"}
+                    ],
+                    'threshold': {'line': {'color': "red", 'width': 4}, 'thickness': 0.75, 'value': 99.0}
+                }
+            ), row=1, col=1)
 
-        # COLUMN 1: Overall Quality Gauge
-        kpi_fig.add_trace(go.Indicator(
-            mode="gauge+number+delta",
-            value=overall_row['overall_quality_score'],
-            delta={'reference': 99.0, 'position': "top", 'suffix': "%"},
-            gauge={
-                'axis': {'range': [90, 100]},
-                'bar': {'color': "#59a14f"},
-                'steps': [
-                    {'range': [90, 98], 'color': "#f28e2b"},
-                    {'range': [98, 100], 'color': "#f1f1f1"}
-                ],
-                'threshold': {'line': {'color': "red", 'width': 4}, 'thickness': 0.75, 'value': 99.0}
-            }
-        ), row=1, col=1)
-
-        # COLUMN 2: Data Completeness Gauge
-        kpi_fig.add_trace(go.Indicator(
-            mode="gauge+number",
-            value=completeness_score,
-            gauge={
-                'axis': {'range': [0, 100]},
-                'bar': {'color': "#4e79a7"},
-                'steps': [{'range': [0, 95], 'color': "#e5e5e5"}]
-            }
-        ), row=1, col=2)
-
-        # COLUMN 3: Error Composition Donut
-        kpi_fig.add_trace(go.Pie(
-            values=list(error_counts.values()),
-            labels=list(error_counts.keys()),
-            hole=0.6,
-            marker_colors=px.colors.qualitative.Pastel
-        ), row=1, col=3)
-
-        # Add total error count in the center of the donut
-        kpi_fig.add_annotation(
-            text=f"{int(total_errors):,}", 
-            x=0.88, y=0.5, # Approximate center of 3rd plot
-            font_size=20, showarrow=False, xref="paper", yref="paper"
-        )
-    
-        # Clean up layout
-        kpi_fig.update_layout(height=350, margin=dict(l=20, r=20, t=50, b=20))
-
-        scorecard_df = df[
-            (df['data_source'] == 'By Occupation') | 
-            (df['data_source'] == 'All Sources')
-        ].copy()
-
-        scorecard_df['quality_dimension'] = scorecard_df['quality_dimension'].replace({
-                "it specialist": "IT-Specialist",
-                "healthcare_worker": "Healthcare Worker",
-                "office_worker": "Office Worker",
-                "retail_worker": "Retail Worker",
-                "self-employed": "Self-Employed",
-                "student": "Student",
-                "engineer": "Engineer",
-                "nurse": "Nurse",
-                "teacher": "Teacher",
-                "unemployed": "Unemployed",
-                "Overall": " OVERALL BENCHMARK"
-            })
+            # COLUMN 2: Data Completeness Gauge
+            kpi_fig.add_trace(go.Indicator(
+                mode="gauge+number",
+                value=completeness_score,
+                gauge={
+                    'axis': {'range': [0, 100]},
+                    'bar': {'color': "#4e79a7"},
+                    'steps': [{'range': [0, 95], 'color': "#e5e5e5"}]
+                }
+            ), row=1, col=2)
 
-        def categorize_quality(row):
-            if row['quality_dimension'].strip() == "OVERALL BENCHMARK":
-                return "BENCHMARK"
-            
-            score = row['overall_quality_score']    
-            if score > 99.25:
-                return "PERFECT (>99.25-100%)"
-            elif score >= 99.0:
-                return "EXCELLENT (99%-99.25%)"
-            else:
-                return "GOOD (98.8%-99%)"
-
-        scorecard_df['Quality Alert'] = scorecard_df.apply(categorize_quality, axis=1)
-        scorecard_df = scorecard_df.sort_values('overall_quality_score', ascending=True)
-
-        # 4. Plot
-        fig4 = px.bar(
-            scorecard_df,
-            x="overall_quality_score",
-            y="quality_dimension",
-            color="Quality Alert",
-            title="Segment Reliability Scorecard (vs Benchmark)",
-            orientation='h',
-            color_discrete_map={
-                "PERFECT (>99.25-100%)": "#59a14f",  # Dark Green
-                "EXCELLENT (99%-99.25%)": "#8cd17d", # Light Green
-                "GOOD (98.8%-99%)": "#bab0ac",       # Grey
-                "BENCHMARK": "#4e79a7"               # Blue (Distinct color for Overall)
-            },
-            labels={
-                "overall_quality_score": "Quality Score",
-                "quality_dimension": "Segment"
-            }
-        )
+            # COLUMN 3: Error Composition Donut
+            kpi_fig.add_trace(go.Pie(
+                values=list(error_counts.values()),
+                labels=list(error_counts.keys()),
+                hole=0.6,
+                marker_colors=px.colors.qualitative.Pastel
+            ), row=1, col=3)
+
+            # Add total error count in the center of the donut
+            kpi_fig.add_annotation(
+                text=f"{int(total_errors):,}", 
+                x=0.88, y=0.5, # Approximate center of 3rd plot
+                font_size=20, showarrow=False, xref="paper", yref="paper"
+            )
     
-        fig4.update_layout(xaxis_range=[98, 100])
-
-        # 5. Hygiene Matrix Heatmap
-        metric_cols = [
-            'missing_blood_oxygen_pct',
-            'missing_stress_level_pct',
-            'invalid_blood_oxygen_pct', 
-            'invalid_heart_rate_pct',
-            'invalid_steps_pct',
-            'extreme_heart_rate_pct',
-            'extreme_sleep_hours_pct',
-            'extreme_step_count_pct',
-            'excessive_claims_pct'
-        ]
+            # Clean up layout
+            kpi_fig.update_layout(height=350, margin=dict(l=20, r=20, t=50, b=20))
+            return kpi_fig
 
-        # Filter to focus on occupations
-        heatmap_df = df[
-            (df['data_source'] == 'By Occupation') | 
-            (df['data_source'] == 'All Sources')
-        ].copy()
-
-        # Rename rows for better readability
-        heatmap_df['quality_dimension'] = heatmap_df['quality_dimension'].replace({
-            "it specialist": "IT-Specialist",
-            "healthcare_worker": "Healthcare Worker",
-            "office_worker": "Office Worker",
-            "retail_worker": "Retail Worker",
-            "self-employed": "Self-Employed",
-            "student": "Student",
-            "engineer": "Engineer",
-            "nurse": "Nurse",
-            "teacher": "Teacher",
-            "unemployed": "Unemployed",
-            "Overall": "TOTAL (Average)"
-        })
+        # The scorecard and the hygiene matrix share one query, run by whichever is shown first
+        quality_segments = functools.cache(lambda: run_query("quality_segments"))
 
-        overall_row = heatmap_df[heatmap_df['data_source'] == 'All Sources']
-        occupations = heatmap_df[heatmap_df['data_source'] == 'By Occupation']
-        occupations_sorted = occupations.sort_values('overall_quality_score', ascending=True)
-        heatmap_sorted = pd.concat([overall_row, occupations_sorted])
-        final_row_order = heatmap_sorted['quality_dimension'].tolist()
-        # Sort columns
-        avg_errors = heatmap_df[metric_cols].mean()
-        sorted_metrics = avg_errors.sort_values(ascending=False).index.tolist()
-        clean_col_map = {m: m.replace('_pct', '').replace('_', ' ').title() for m in sorted_metrics}
-        col_order = [clean_col_map[m] for m in sorted_metrics]
-
-        # Melt dataframe
-        heatmap_melted = heatmap_df.melt(
-            id_vars=['quality_dimension'], 
-            value_vars=metric_cols,
-            var_name='Metric',
-            value_name='Error Rate (%)'
-        )
-        heatmap_melted['Metric'] = heatmap_melted['Metric'].map(lambda x: x.replace('_pct', '').replace('_', ' ').title())
-
-        fig5 = px.density_heatmap(
-            heatmap_melted,
-            x="Metric",
-            y="quality_dimension",
-            z="Error Rate (%)",
-            title="Field-Level Hygiene Matrix",
-            color_continuous_scale="OrRd",
-            labels={"quality_dimension": "Segment", "Metric": "Quality Indicator"},
-            category_orders={
-                "quality_dimension": final_row_order, 
-                "Metric": col_order
-            }
-        )
-    
-        fig5.update_traces(texttemplate="%{z:.1f}", textfont={"size": 10})
+        def build_scorecard():
+            scorecard_df = quality_segments().copy()
 
-        # 6. Self-report vs actuals
-        # Clustering logic
-        fig6 = None 
+            scorecard_df['quality_dimension'] = scorecard_df['quality_dimension'].replace({
+                    **occupation_labels,
+                    "Overall": " OVERALL BENCHMARK"
+                })
 
-        try:
-            # 1. Load data
-            raw_df = pd.read_csv(f"{base_url}/dm_customer_360.csv")
-        
-            # 2. Clean data
-            activity_mapper = {
-                "sedentary": 1, "seddentary": 1,
-                "active": 2, "actve": 2,
-                "highly_active": 3, "highly active": 3
-            }
-            raw_df['activity_level_numeric'] = raw_df['current_activity_level'].str.lower().map(activity_mapper).fillna(0)
-
-            # 3. Classify Anomalies 
-            def classify_anomaly(row):
-                level = row['activity_level_numeric']
-                steps = row.get('current_daily_steps', 0)
-
-                if level == 3 and steps < 4000:
-                    return "Over-Reporter"       # Matches your screenshot
-                elif level == 1 and steps > 8000:
-                    return "Under-Reporter"      # Matches your screenshot
-                elif level == 3 and steps >= 8000:
-                    return "Verified Active"
-                elif level == 1 and steps <= 4000:
-                    return "Verified Sedentary"
+            def categorize_quality(row):
+                if row['quality_dimension'].strip() == "OVERALL BENCHMARK":
+                    return "BENCHMARK"
+            
+                score = row['overall_quality_score']    
+                if score > 99.25:
+                    return "PERFECT (>99.25-100%)"
+                elif score >= 99.0:
+                    return "EXCELLENT (99%-99.25%)"
                 else:
-                    return "Normal Range"
-
-            raw_df['Anomaly Status'] = raw_df.apply(classify_anomaly, axis=1)
-
-
-
-            # 4. Define the Exact Order
-            custom_order = [
-                "Over-Reporter", 
-                "Under-Reporter", 
-                "Normal Range", 
-                "Verified Sedentary", 
-                "Verified Active"
-            ]
-
-            # 5. Plot
-            fig6 = px.strip(
-                raw_df,
-                x="activity_level_numeric",
-                y="current_daily_steps",
-                color="Anomaly Status",
-                title="Anomaly Detection: Actual vs. Reported Activity",
-                stripmode='overlay',
+                    return "GOOD (98.8%-99%)"
+
+            scorecard_df['Quality Alert'] = scorecard_df.apply(categorize_quality, axis=1)
+            scorecard_df = scorecard_df.sort_values('overall_quality_score', ascending=True)
+
+            # 4. Plot
+            fig4 = px.bar(
+                scorecard_df,
+                x="overall_quality_score",
+                y="quality_dimension",
+                color="Quality Alert",
+                title="Segment Reliability Scorecard (vs Benchmark)",
+                orientation='h',
                 color_discrete_map={
-                    "Over-Reporter": "#e15759",      # Red
-                    "Under-Reporter": "#f28e2b",     # Orange
-                    "Normal Range": "#bab0ac",       # Grey
-                    "Verified Sedentary": "#76b7b2", # Teal/Grey
-                    "Verified Active": "#59a14f"     # Green
+                    "PERFECT (>99.25-100%)": "#59a14f",  # Dark Green
+                    "EXCELLENT (99%-99.25%)": "#8cd17d", # Light Green
+                    "GOOD (98.8%-99%)": "#bab0ac",       # Grey
+                    "BENCHMARK": "#4e79a7"               # Blue (Distinct color for Overall)
                 },
-                category_orders={"Anomaly Status": custom_order},
                 labels={
-                    "activity_level_numeric": "Activity Level",
-                    "current_daily_steps": "Recorded Daily Steps"
+                    "overall_quality_score": "Quality Score",
+                    "quality_dimension": "Segment"
                 }
             )
-        
-            # Add threshold lines
-            fig6.add_hline(y=4000, line_dash="dash", line_color="gray", annotation_text="Sedentary Threshhold (<4k)")
-            fig6.add_hline(y=8000, line_dash="dash", line_color="gray", annotation_text="Active Threshhold (>8k)")
-            fig6.update_xaxes(tickvals=[1, 2, 3])
+    
+            fig4.update_layout(xaxis_range=[98, 100])
+            return fig4
+
+        def build_hygiene_matrix():
+            # 5. Hygiene Matrix Heatmap
+            metric_cols = [
+                'missing_blood_oxygen_pct',
+                'missing_stress_level_pct',
+                'invalid_blood_oxygen_pct', 
+                'invalid_heart_rate_pct',
+                'invalid_steps_pct',
+                'extreme_heart_rate_pct',
+                'extreme_sleep_hours_pct',
+                'extreme_step_count_pct',
+                'excessive_claims_pct'
+            ]
+
+            # Filter to focus on occupations
+            heatmap_df = quality_segments().copy()
+
+            # Rename rows for better readability
+            heatmap_df['quality_dimension'] = heatmap_df['quality_dimension'].replace({
+                **occupation_labels,
+                "Overall": "TOTAL (Average)"
+            })
 
-        except Exception as e:
-            print(f"Could not generate Anomaly Chart: {e}")
+            overall_row = heatmap_df[heatmap_df['data_source'] == 'All Sources']
+            occupations = heatmap_df[heatmap_df['data_source'] == 'By Occupation']
+            occupations_sorted = occupations.sort_values('overall_quality_score', ascending=True)
+            heatmap_sorted = pd.concat([overall_row, occupations_sorted])
+            final_row_order = heatmap_sorted['quality_dimension'].tolist()
+            # Sort columns
+            avg_errors = heatmap_df[metric_cols].mean()
+            sorted_metrics = avg_errors.sort_values(ascending=False).index.tolist()
+            clean_col_map = {m: m.replace('_pct', '').replace('_', ' ').title() for m in sorted_metrics}
+            col_order = [clean_col_map[m] for m in sorted_metrics]
+
+            # Melt dataframe
+            heatmap_melted = heatmap_df.melt(
+                id_vars=['quality_dimension'], 
+                value_vars=metric_cols,
+                var_name='Metric',
+                value_name='Error Rate (%)'
+            )
+            heatmap_melted['Metric'] = heatmap_melted['Metric'].map(lambda x: x.replace('_pct', '').replace('_', ' ').title())
+
+            fig5 = heatmap(
+                heatmap_melted,
+                x="Metric",
+                y="quality_dimension",
+                z="Error Rate (%)",
+                histfunc="sum",
+                title="Field-Level Hygiene Matrix",
+                color_continuous_scale="OrRd",
+                labels={"quality_dimension": "Segment", "Metric": "Quality Indicator"},
+                category_orders={
+                    "quality_dimension": final_row_order, 
+                    "Metric": col_order
+                }
+            )
     
-        # Update the list
-        customer_360_charts = [kpi_fig, fig4, fig5]
-        if fig6:
-            customer_360_charts.append(fig6)
+            fig5.update_traces(texttemplate="%{z:.1f}", textfont={"size": 10})
+            return fig5
+
+        def build_anomalies():
+            # 6. Self-report vs actuals
+            # Clustering logic
+            try:
+                # 1. Load the anomaly table written by score_anomalies.py, which labels
+                #    each customer's reported activity level against the robust z-score
+                #    of their steps within their occupation and age band
+                #    The table is only shown if it was scored from the current dm_customer_360
+                raw_df = current_table("dm_customer_anomalies", "dm_customer_360", view="dm_data_quality_dashboard")
+                if raw_df is None:
+                    return go.Figure().update_layout(
+                        title="Anomaly table is missing or out of date: rerun score_anomalies.py"
+                    )
+                raw_df = raw_df.rename(columns={'anomaly_status': 'Anomaly Status'})
+
+                # 2. Define the Exact Order
+                custom_order = [
+                    "Over-Reporter", 
+                    "Under-Reporter", 
+                    "Segment Outlier",
+                    "Normal Range", 
+                    "Verified Sedentary", 
+                    "Verified Active"
+                ]
 
-    else:
-        customer_360_charts = []
+                # 3. Plot
+                fig6 = px.strip(
+                    raw_df,
+                    x="activity_level_numeric",
+                    y="steps_z",
+                    color="Anomaly Status",
+                    title="Anomaly Detection: Actual vs. Reported Activity",
+                    stripmode='overlay',
+                    color_discrete_map={
+                        "Over-Reporter": "#e15759",      # Red
+                        "Under-Reporter": "#f28e2b",     # Orange
+                        "Segment Outlier": "#b07aa1",    # Purple
+                        "Normal Range": "#bab0ac",       # Grey
+                        "Verified Sedentary": "#76b7b2", # Teal/Grey
+                        "Verified Active": "#59a14f"     # Green
+                    },
+                    category_orders={"Anomaly Status": custom_order},
+                    hover_data=["PersonID", "current_daily_steps", "anomaly_score", "outlier_metrics"],
+                    labels={
+                        "activity_level_numeric": "Activity Level",
+                        "steps_z": "Daily Steps (robust z vs. occupation & age band)",
+                        "current_daily_steps": "Recorded Daily Steps",
+                        "anomaly_score": "Segment Anomaly Score"
+                    }
+                )
+        
+                # Add threshold lines (OUTLIER_THRESHOLD of score_anomalies.py)
+                fig6.add_hline(y=-3.5, line_dash="dash", line_color="gray", annotation_text="Over-Reporting Threshold (z < -3.5)")
+                fig6.add_hline(y=3.5, line_dash="dash", line_color="gray", annotation_text="Under-Reporting Threshold (z > 3.5)")
+                fig6.update_xaxes(tickvals=[1, 2, 3])
+
+            except Exception as e:
+                print(f"Could not generate Anomaly Chart: {e}")
+                fig6 = go.Figure().update_layout(title="Could not generate Anomaly Chart")
+            return fig6
+
+        chart_slots = [(build_quality_kpis, 350), (build_scorecard, 450), (build_hygiene_matrix, 450), (build_anomalies, 450)]
+
+    # What-if risk segments, below the charts of the views with what-if scoring
+    def build_risk_segments():
+        mart, scenario = risk_model["mart_segments"], risk_scenario["segments"]
+        fig = make_subplots(
+            rows=1, cols=2, horizontal_spacing=0.12,
+            subplot_titles=("Customers per Health Status", "Loss Ratio per Health Status")
+        )
+        for name, segments, color in (("Mart", mart, '#bab0ac'), ("What-if", scenario, '#4e79a7')):
+            fig.add_trace(go.Bar(
+                x=segments['health_status'], y=segments['customers'], name=name, marker_color=color,
+                legendgroup=name, text=segments['customers'], textposition='outside'
+            ), row=1, col=1)
+            fig.add_trace(go.Bar(
+                x=segments['health_status'], y=segments['loss_ratio'], name=name, marker_color=color,
+                legendgroup=name, showlegend=False, texttemplate="%{y:.1%}", textposition='outside'
+            ), row=1, col=2)
+        fig.add_hline(y=0.6, line_dash="solid", line_color="gray", annotation_text="Limit (60%)", row=1, col=2)
+        fig.update_layout(
+            title_text="What-if Risk Segments", barmode='group', height=400,
+            legend=dict(orientation="h", y=-0.15)
+        )
+        fig.update_yaxes(tickformat='.0%', row=1, col=2)
+        return fig
+
+    if risk_scenario is not None and chart_slots:
+        chart_slots.append((build_risk_segments, 400))
+
+    def finished(build):
+        """Wrap a chart builder to fix the axes of the figure it returns."""
+        def build_finished():
+            fig = build()
+            fig.update_layout(autosize=True, dragmode=False)
+            layout_json = fig.layout.to_plotly_json()
+            for key in list(layout_json.keys()):
+                if key.startswith('xaxis') or key.startswith('yaxis'):
+                    axis_props = layout_json.get(key, {})
+                    if 'range' in axis_props:
+                        fig.update_layout({key: dict(fixedrange=True)})
+                    else:
+                        fig.update_layout({key: dict(autorange=True, fixedrange=True)})
+            return fig
+        return build_finished
+
+    chart_slots = [(finished(build), height) for build, height in chart_slots]
+    return (chart_slots,)
 
+
+@app.cell
+def _(chart_slots, figure_html, mo):
     # Render each chart inside its own iframe via mo.iframe().
     # This completely isolates each plotly chart in a separate document,
     # preventing ghost state from Plotly.react() reusing DOM containers
     # when switching between data marts.
-    import plotly.io as _pio
-    for _fig in customer_360_charts:
-        _fig.update_layout(autosize=True, dragmode=False)
-        _layout_json = _fig.layout.to_plotly_json()
-        for key in list(_layout_json.keys()):
-            if key.startswith('xaxis') or key.startswith('yaxis'):
-                axis_props = _layout_json.get(key, {})
-                if 'range' in axis_props:
-                    _fig.update_layout({key: dict(fixedrange=True)})
-                else:
-                    _fig.update_layout({key: dict(autorange=True, fixedrange=True)})
-
-    if customer_360_charts:
-        _chart_iframes = []
-        for _fig in customer_360_charts:
-            _fig_height = _fig.layout.height or 450
-            _html_str = _pio.to_html(
-                _fig, full_html=True, include_plotlyjs="cdn",
-                config={"displayModeBar": False, "scrollZoom": False, "responsive": True}
-            )
-            _chart_iframes.append(
-                mo.iframe(_html_str, width="100%", height=f"{_fig_height + 40}px")
-            )
-        _charts_output = mo.vstack(_chart_iframes)
+    # Every slot after the first is lazy: its figure is built and serialized once the
+    # slot scrolls into view, so the first paint only waits for the charts on screen.
+    # The lazy slots keep the height of their charts, so the ones below the fold stay
+    # hidden. The first chart is always on screen and is rendered right away, since its
+    # iframe is what replaces the build-time snapshots and marks the first chart.
+    def _chart_frame(build):
+        fig = build()
+        html, _ = figure_html(
+            fig, config={"displayModeBar": False, "scrollZoom": False, "responsive": True}
+        )
+        return mo.iframe(html, width="100%", height=f"{(fig.layout.height or 450) + 40}px")
+
+    if chart_slots:
+        _charts_output = mo.vstack([
+            _chart_frame(build) if index == 0 else
+            mo.lazy(lambda build=build: _chart_frame(build), show_loading_indicator=True)
+            .style(min_height=f"{height + 40}px")
+            for index, (build, height) in enumerate(chart_slots)
+        ])
     else:
         _charts_output = mo.md("*Select a data mart to view visualizations*")
 
     _charts_output
+    return
 
 
 @app.cell
@@ -863,6 +2053,49 @@ def _(df, mo):
     return
 
 
+@app.cell
+def _(check_query_backends, mo, os, query_backend):
+    # DASHBOARD_CHECK_QUERIES=1 runs every chart query on both backends and compares them
+    if os.environ.get("DASHBOARD_CHECK_QUERIES"):
+        _query_check = mo.vstack([
+            mo.md(f"### 🧪 Query Backend Check (active backend: `{query_backend}`)"),
+            mo.ui.table(check_query_backends(), selection=None)
+        ])
+    else:
+        _query_check = mo.md("")
+    _query_check
+    return
+
+
+@app.cell
+def _(chart_slots, figure_html, mo, os, pd):
+    # DASHBOARD_PAYLOAD_REPORT=1 shows the payload of each chart against plain plotly JSON.
+    # The charts are built here for the report, whether or not their slots were shown
+    if os.environ.get("DASHBOARD_PAYLOAD_REPORT") and chart_slots:
+        import time as _time
+
+        _rows = []
+        for _build, _ in chart_slots:
+            _fig = _build()
+            _, _stats = figure_html(_fig)
+            _start = _time.perf_counter()
+            _plain_bytes = len(_fig.to_json().encode("utf-8"))
+            _rows.append({
+                "chart": _fig.layout.title.text or f"Chart {len(_rows) + 1}",
+                **_stats,
+                "plain JSON bytes": _plain_bytes,
+                "plain JSON ms": round((_time.perf_counter() - _start) * 1000, 1),
+            })
+        _payload_report = mo.vstack([
+            mo.md("### 📦 Chart Payloads"),
+            mo.ui.table(pd.DataFrame(_rows), selection=None)
+        ])
+    else:
+        _payload_report = mo.md("")
+    _payload_report
+    return
+
+
 @app.cell
 def _(mo):
     mo.md("""
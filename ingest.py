@@ -0,0 +1 @@
+.github/scripts/ingest.py
\ No newline at end of file
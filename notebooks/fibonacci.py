@@ -10,15 +10,28 @@ __generated_with = "0.10.6"
 app = marimo.App()
 
 with app.setup:
+    import itertools
+    import math
+    import timeit
+
     import marimo as mo
-    
+
+    # Terms computed so far, shared by all cells and extended only by the missing terms
+    FIB_CACHE = [0, 1]
+    # Longest prefix kept in memory: the first 20,000 terms take about 17 MB, and the
+    # size grows quadratically, so longer ranges are streamed instead of cached
+    CACHE_LIMIT = 20_000
+    # Ranges up to this length are printed in full, longer ones are abbreviated
+    FULL_DISPLAY_LIMIT = 100
+
 @app.cell
 def _():
     mo.md(
         r"""
         # Fibonacci Calculator
 
-        Use the slider above to calculate the first {n.value} numbers in the Fibonacci sequence.
+        Enter how many numbers of the Fibonacci sequence to calculate below. Up to
+        100 numbers are listed in full; longer ranges show their first and last terms.
         """
     )
     return
@@ -26,24 +39,165 @@ def _():
 
 @app.cell
 def _():
-    # Create an interactive slider
-    n = mo.ui.slider(1, 100, value=50, label="Number of Fibonacci numbers")
+    # Create an interactive input; ranges up to a million terms are supported
+    n = mo.ui.number(start=1, stop=1_000_000, value=50, label="Number of Fibonacci numbers")
     n
     return n
 
 
 @app.cell
 def _(n):
-    fib = fibonacci(n.value)
-    mo.md(", ".join([str(f) for f in fib]))
-    
+    if n.value <= FULL_DISPLAY_LIMIT:
+        text = ", ".join(str(f) for f in fibonacci_cached(n.value))
+    else:
+        # Only the first and last terms are shown; beyond the cache they are streamed
+        # from a fast-doubling seed instead of building the whole prefix
+        if n.value <= CACHE_LIMIT:
+            fib = fibonacci_cached(n.value)
+            head, tail = fib[:10], fib[-5:]
+        else:
+            head = list(itertools.islice(fib_stream(0), 10))
+            tail = list(itertools.islice(fib_stream(n.value - 5), 5))
+        text = (
+            ", ".join(format_term(f) for f in head)
+            + f", … ({n.value - 15:,} more) …, "
+            + ", ".join(format_term(f) for f in tail)
+        )
+    mo.md(text)
+
 @app.function
 def fibonacci(n):
     sequence = [0, 1]
     for i in range(2, n):
         sequence.append(sequence[i - 1] + sequence[i - 2])
     return sequence
-    
+
+
+@app.function
+def fib_pair(n):
+    """Return (F(n), F(n + 1)) by fast doubling, in O(log n) big-integer steps."""
+    a, b = 0, 1
+    for bit in bin(n)[2:]:
+        # F(2k) = F(k) * (2 F(k+1) - F(k)), F(2k+1) = F(k)^2 + F(k+1)^2
+        c = a * (2 * b - a)
+        d = a * a + b * b
+        a, b = (d, c + d) if bit == "1" else (c, d)
+    return a, b
+
+
+@app.function
+def fib_nth(n):
+    """Return the nth Fibonacci number, counting from F(0) = 0."""
+    return fib_pair(n)[0]
+
+
+@app.function
+def fib_stream(start):
+    """Yield F(start), F(start + 1), ... without computing the terms before start."""
+    a, b = fib_pair(start)
+    while True:
+        yield a
+        a, b = b, a + b
+
+
+@app.function
+def fibonacci_cached(n):
+    """Return the first n Fibonacci numbers, extending the shared cache as needed."""
+    if n > CACHE_LIMIT:
+        raise ValueError(f"Only the first {CACHE_LIMIT:,} terms are cached; use fib_stream for more")
+    while len(FIB_CACHE) < n:
+        FIB_CACHE.append(FIB_CACHE[-1] + FIB_CACHE[-2])
+    return FIB_CACHE[:n]
+
+
+@app.function
+def format_term(value, max_digits=40):
+    """Format a term, abbreviating numbers with more than max_digits digits.
+
+    Converting a big integer to a decimal string takes quadratic time, so long numbers
+    are shown by their leading digits (from a logarithm), trailing digits and length.
+    """
+    if value < 10**max_digits:
+        return str(value)
+    shift = max(value.bit_length() - 64, 0)
+    log10 = math.log10(value >> shift) + shift * math.log10(2)
+    leading = int(10 ** (log10 - int(log10) + 7))
+    return f"{leading}…{value % 10**8:08d} ({int(log10) + 1:,} digits)"
+
+
+@app.cell
+def _():
+    mo.md(
+        r"""
+        ## Browse the sequence
+
+        Terms are streamed from the chosen index, so any window up to a million is fast.
+        """
+    )
+    return
+
+
+@app.cell
+def _():
+    window_start = mo.ui.number(start=0, stop=1_000_000, value=0, label="First index")
+    window_start
+    return (window_start,)
+
+
+@app.cell
+def _(window_start):
+    window = itertools.islice(fib_stream(window_start.value), 20)
+    mo.ui.table(
+        [{"n": window_start.value + i, "F(n)": format_term(f)} for i, f in enumerate(window)],
+        selection=None,
+    )
+    return
+
+
+@app.cell
+def _():
+    mo.md(
+        r"""
+        ## Benchmark
+
+        Time to get the last of the first *n* terms with the list implementation, the
+        fast-doubling function and a cold fill of the sequence cache, which is what its
+        first use costs; later calls only copy the terms already built.
+        """
+    )
+    return
+
+
+@app.cell
+def _():
+    run_benchmark = mo.ui.run_button(label="Run benchmark")
+    run_benchmark
+    return (run_benchmark,)
+
+
+@app.cell
+def _(run_benchmark):
+    mo.stop(not run_benchmark.value, mo.md("*Click the button to run the benchmark.*"))
+
+    def _empty_cache():
+        del FIB_CACHE[2:]
+
+    results = []
+    for size in (1_000, 5_000, 20_000):
+        assert fibonacci(size)[-1] == fib_nth(size - 1) == fibonacci_cached(size)[-1]
+        # label -> (timed call, setup run before each repeat)
+        timings = {
+            "list (ms)": (lambda: fibonacci(size)[-1], "pass"),
+            "fast doubling (ms)": (lambda: fib_nth(size - 1), "pass"),
+            "cache, cold fill (ms)": (lambda: fibonacci_cached(size)[-1], _empty_cache),
+        }
+        row = {"n": size}
+        for label, (func, setup) in timings.items():
+            row[label] = round(min(timeit.repeat(func, setup=setup, number=1, repeat=5)) * 1000, 3)
+        results.append(row)
+    mo.ui.table(results, selection=None)
+    return
+
 
 if __name__ == "__main__":
     app.run()
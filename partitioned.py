@@ -0,0 +1 @@
+.github/scripts/partitioned.py
\ No newline at end of file
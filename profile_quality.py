@@ -0,0 +1 @@
+.github/scripts/profile_quality.py
\ No newline at end of file
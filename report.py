@@ -0,0 +1 @@
+.github/scripts/report.py
\ No newline at end of file
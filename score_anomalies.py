@@ -0,0 +1 @@
+.github/scripts/score_anomalies.py
\ No newline at end of file
@@ -0,0 +1 @@
+.github/scripts/serve.py
\ No newline at end of file
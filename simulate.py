@@ -0,0 +1 @@
+.github/scripts/simulate.py
\ No newline at end of file
@@ -0,0 +1,79 @@
+import hashlib
+import json
+
+import build
+
+
+def _site(tmp_path, size=4096):
+    public = tmp_path / "apps" / "public"
+    public.mkdir(parents=True)
+    (public / "dm_example.csv").write_text("a,b\n" + "1,2\n" * (size // 4))
+    return tmp_path
+
+
+def test_fingerprint_records_the_canonical_variant(tmp_path):
+    site = _site(tmp_path)
+    manifests = build._fingerprint_assets(site)
+
+    fingerprinted = manifests["apps/public"]["dm_example.csv"]
+    assert fingerprinted.startswith("dm_example.") and fingerprinted != "dm_example.csv"
+    assert (site / "apps" / "public" / fingerprinted).read_bytes() == (site / "apps" / "public" / "dm_example.csv").read_bytes()
+
+    manifest = json.loads((site / "apps" / "public" / build.ASSET_MANIFEST_NAME).read_text())
+    assert manifest == {"canonical": "fingerprinted", "files": {"dm_example.csv": fingerprinted}}
+
+
+def test_compress_only_the_fingerprinted_copy(tmp_path):
+    site = _site(tmp_path)
+    manifests = build._fingerprint_assets(site)
+    totals = build._compress_assets(site, manifests=manifests)
+
+    public = site / "apps" / "public"
+    fingerprinted = manifests["apps/public"]["dm_example.csv"]
+    assert (public / f"{fingerprinted}.gz").exists() and (public / f"{fingerprinted}.br").exists()
+    assert not (public / "dm_example.csv.gz").exists() and not (public / "dm_example.csv.br").exists()
+    assert totals["files"] == 1
+
+
+def test_compress_skips_small_files(tmp_path):
+    site = _site(tmp_path, size=100)
+    assert build._compress_assets(site)["files"] == 0
+    assert not list(site.rglob("*.gz"))
+
+
+def _lock():
+    return {"packages": {
+        "pandas": {"imports": ["pandas"], "depends": ["numpy"], "file_name": "pandas.whl", "version": "2.2.3"},
+        "numpy": {"imports": ["numpy"], "depends": [], "file_name": "numpy.whl", "version": "2.0.2"},
+    }}
+
+
+def test_offline_downloads_use_only_cached_sizes():
+    size_cache = {build.PYODIDE_CDN_URL + "pandas.whl": 100, "https://pypi.org/pypi/orjson/3.10.0/json": 7}
+    downloads = build._package_downloads(
+        ["pandas", "orjson", "duckdb"], _lock(), size_cache,
+        distributions={"orjson": ["orjson", "3.10.0"]}, offline=True,
+    )
+    assert [(d["package"], d["version"], d["bytes"]) for d in downloads] == [
+        ("numpy", "2.0.2", None), ("pandas", "2.2.3", 100), ("duckdb", None, None), ("orjson", "3.10.0", 7),
+    ]
+
+
+def test_pyodide_lock_is_read_from_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(build, "PROFILE_CACHE_DIR", tmp_path)
+    (tmp_path / "pyodide-lock-v0.27.7.json").write_text(json.dumps(_lock()))
+    assert build._load_pyodide_lock() == (_lock(), True)
+
+
+def test_forecast_is_skipped_while_its_mart_is_unchanged(tmp_path, monkeypatch):
+    mart, forecast = tmp_path / "mart.csv", tmp_path / "forecast.csv"
+    mart.write_text("a\n1\n")
+    version = hashlib.sha256(mart.read_bytes()).hexdigest()[:12]
+    forecast.write_text(f"segment,mart_version\nPortfolio,{version}\n")
+    runs = []
+    monkeypatch.setattr(build.subprocess, "run", lambda cmd, **kwargs: runs.append(cmd))
+
+    assert not build._refresh_forecast(build.FORECAST_SCRIPT, mart, forecast)
+    mart.write_text("a\n2\n")
+    assert build._refresh_forecast(build.FORECAST_SCRIPT, mart, forecast)
+    assert len(runs) == 1 and runs[0][-4:] == ["--input", str(mart), "--output", str(forecast)]
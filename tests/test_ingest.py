@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+
+import ingest
+
+MART = "dm_customer_360"
+
+
+def _export(path, rows=6, **changes):
+    """Write a small dm_customer_360 export, with column overrides, and return its frame."""
+    df = pd.DataFrame({
+        "PersonID": range(rows),
+        "insurance_sign_up_date": "2020-01-01",
+        "occupational_category": ["teacher", "nurse", None] * (rows // 3),
+        "current_heart_rate_bpm": [55, 70, 110] * (rows // 3),
+        "current_daily_steps": [5000 + 100 * i for i in range(rows)],
+        "lifetime_premiums_paid": [1000.0 + i for i in range(rows)],
+        "lifetime_claims_amount": [500.0 + i for i in range(rows)],
+        "created_at": "2026-01-01T00:00:00",
+    }).assign(**changes)
+    df.to_csv(path, index=False)
+    return df
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    return {"store": tmp_path / "snapshots", "publish": tmp_path / "public"}
+
+
+def _published(dirs):
+    return {name: pd.read_csv(dirs["publish"] / f"{MART}_{name}.csv") for name in ingest.AGGREGATES[MART]}
+
+
+def test_rerun_without_changes_upserts_nothing(tmp_path, dirs):
+    export = tmp_path / "export.csv"
+    _export(export)
+    first = ingest.ingest(MART, export, **dirs)
+    published = _published(dirs)
+
+    again = ingest.ingest(MART, export, **dirs)
+    assert (first["upserted"], again["version"], again["upserted"], again["deleted"]) == (6, 2, 0, 0)
+    for name, table in _published(dirs).items():
+        pd.testing.assert_frame_equal(table, published[name])
+    pd.testing.assert_frame_equal(ingest.materialize(MART, store=dirs["store"]), ingest.materialize(MART, 1, dirs["store"]))
+
+
+def test_new_export_timestamp_alone_is_not_a_change(tmp_path, dirs):
+    export = tmp_path / "export.csv"
+    _export(export)
+    ingest.ingest(MART, export, **dirs)
+    _export(export, created_at="2026-02-01T00:00:00")
+    assert ingest.ingest(MART, export, **dirs)["upserted"] == 0
+
+
+def test_dtype_drift_upserts_only_the_changed_row(tmp_path, dirs):
+    export = tmp_path / "export.csv"
+    df = _export(export)
+    ingest.ingest(MART, export, **dirs)
+
+    # A missing value makes pandas read the whole steps column as float64
+    _export(export, current_daily_steps=df["current_daily_steps"].where(df["PersonID"] != 2))
+    result = ingest.ingest(MART, export, **dirs)
+    assert (result["upserted"], result["deleted"]) == (1, 0)
+
+
+def test_aggregates_follow_changes_and_deletes(tmp_path, dirs):
+    export = tmp_path / "export.csv"
+    df = _export(export)
+    ingest.ingest(MART, export, **dirs)
+
+    changed = df.assign(lifetime_claims_amount=df["lifetime_claims_amount"] + (df["PersonID"] == 1) * 100)
+    changed.drop(index=0).to_csv(export, index=False)
+    result = ingest.ingest(MART, export, **dirs)
+    assert (result["upserted"], result["deleted"]) == (1, 1)
+
+    totals = ingest.read_aggregate(MART, "segment_totals", dirs["store"])
+    expected = (changed.drop(index=0).fillna({"occupational_category": ingest.MISSING_GROUP})
+                .groupby("occupational_category")[["lifetime_premiums_paid", "lifetime_claims_amount"]].sum())
+    pd.testing.assert_frame_equal(
+        totals.set_index("occupational_category")[expected.columns], expected, check_names=False
+    )
+    pd.testing.assert_frame_equal(
+        ingest.materialize(MART, store=dirs["store"]).sort_values("PersonID").reset_index(drop=True),
+        changed.drop(index=0).reset_index(drop=True), check_dtype=False,
+    )
@@ -0,0 +1,95 @@
+import hashlib
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import partitioned
+
+
+def _customers(rows=400):
+    """Customer rows with the columns of the dm_customer_360 aggregates, some of them missing."""
+    rng = np.random.default_rng(0)
+    dates = pd.Timestamp("2015-01-01") + pd.to_timedelta(rng.integers(0, 3000, rows), unit="D")
+    return pd.DataFrame({
+        "PersonID": rng.integers(0, rows // 2, rows),
+        "occupational_category": np.where(
+            rng.random(rows) < 0.05, None, rng.choice(["teacher", "nurse", "engineer"], rows)
+        ),
+        "health_status": rng.choice(["Healthy", "At Risk"], rows),
+        "insurance_status": rng.choice(["Active", "Lapsed"], rows),
+        "insurance_sign_up_date": np.where(rng.random(rows) < 0.05, None, dates.strftime("%Y-%m-%d")),
+        "current_heart_rate_bpm": np.where(rng.random(rows) < 0.1, np.nan, rng.uniform(45, 120, rows)),
+        "lifetime_premiums_paid": rng.uniform(1000, 50000, rows).round(2),
+        "lifetime_claims_amount": np.where(rng.random(rows) < 0.1, np.nan, rng.uniform(0, 30000, rows).round(2)),
+    })
+
+
+@pytest.fixture(params=["csv", "parquet"])
+def customers(request, tmp_path):
+    path = tmp_path / f"dm_customer_360.{request.param}"
+    if request.param == "csv":
+        _customers().to_csv(path, index=False)
+    else:
+        _customers().to_parquet(path, index=False, row_group_size=50)
+    return path
+
+
+@pytest.mark.parametrize("partition_by", [None, "occupational_category", "hash:PersonID"])
+def test_aggregates_match_pandas(customers, partition_by):
+    expected = partitioned._pandas_aggregate("dm_customer_360", customers)
+    actual = partitioned.aggregate("dm_customer_360", customers, workers=3, partition_by=partition_by)
+
+    assert actual.keys() == expected.keys()
+    for name, result in actual.items():
+        pd.testing.assert_frame_equal(result, expected[name], check_dtype=False)
+    # Missing keys are a group of their own, sorted last
+    assert actual["segment_totals"]["occupational_category"].isna().iloc[-1]
+
+
+def test_means_count_the_known_values(tmp_path):
+    path = tmp_path / "dm_health_by_demographics.csv"
+    pd.DataFrame({
+        "age_group": ["18-29", "18-29", "30-39", None],
+        "gender": ["female", "male", "female", "male"],
+        "avg_sleep_hours": [6.0, np.nan, 7.0, 8.0],
+        "avg_sleep_quality_score": [5.0, 6.0, np.nan, 7.0],
+        "avg_insurance_cost": [100.0, 300.0, 200.0, 400.0],
+        "avg_heart_rate_bpm": [70.0, 80.0, 90.0, 60.0],
+    }).to_csv(path, index=False)
+
+    totals = partitioned.aggregate("dm_health_by_demographics", path, workers=2)["age_group_totals"]
+
+    assert totals["age_group"].tolist()[:2] == ["18-29", "30-39"] and pd.isna(totals["age_group"].iloc[2])
+    assert totals["avg_sleep_hours"].tolist() == [6.0, 7.0, 8.0]
+    assert totals["avg_sleep_hours_count"].tolist() == [1, 1, 1]
+    assert totals["avg_sleep_quality_score"].tolist() == [11.0, 0.0, 7.0]
+    assert totals["count"].tolist() == [2, 1, 1]
+
+
+def test_close_unlinks_the_shared_blocks(customers):
+    mart = partitioned.PartitionedMart(customers, ["health_status"], ["lifetime_premiums_paid"], workers=2)
+    names = [block["name"] for block in mart._blocks]
+    assert mart.groupby(["health_status"])["count"].sum() == 400
+    mart.close()
+
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=name)
+
+
+def test_publish_stamps_the_mart_version(tmp_path):
+    path = tmp_path / "dm_customer_360.csv"
+    _customers().to_csv(path, index=False)
+    written = partitioned.publish("dm_customer_360", path, tmp_path / "public", workers=2)
+
+    assert [file.name for file in written] == [
+        f"dm_customer_360_{name}.csv" for name in partitioned.AGGREGATES["dm_customer_360"]
+    ]
+    cost_matrix = pd.read_csv(tmp_path / "public" / "dm_customer_360_cost_matrix.csv")
+    assert list(cost_matrix.columns) == [
+        "occupational_category", "heart_rate_category", "lifetime_premiums_paid", "lifetime_claims_amount",
+        "count", partitioned.VERSION_COLUMN,
+    ]
+    assert (cost_matrix[partitioned.VERSION_COLUMN] == hashlib.sha256(path.read_bytes()).hexdigest()[:12]).all()
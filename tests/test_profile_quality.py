@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import profile_quality
+
+
+def _customers(rows=300):
+    """Customer rows with the columns of the checks, some missing or out of range, and repeated persons."""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "PersonID": rng.integers(0, rows // 2, rows),
+        "occupational_category": rng.choice(["teacher", "nurse", "engineer"], rows),
+        "wealth_bracket": rng.choice(["low", "middle", "high"], rows),
+        "current_blood_oxygen_pct": np.where(rng.random(rows) < 0.1, np.nan, rng.uniform(90, 101, rows)),
+        "current_stress_level": np.where(rng.random(rows) < 0.2, np.nan, rng.integers(1, 10, rows)),
+        "current_heart_rate_bpm": rng.integers(-5, 320, rows),
+        "current_daily_steps": rng.integers(-100, 35000, rows),
+        "current_sleep_hours": rng.uniform(2, 13, rows).round(1),
+        "avg_annual_premium": rng.uniform(-100, 3000, rows).round(2),
+        "avg_annual_claims": rng.uniform(0, 3000, rows).round(2),
+    })
+
+
+@pytest.fixture(params=["csv", "parquet"])
+def customers(request, tmp_path):
+    df = _customers()
+    path = tmp_path / f"customers.{request.param}"
+    if request.param == "csv":
+        df.to_csv(path, index=False)
+    else:
+        df.to_parquet(path, index=False, row_group_size=40)
+    return path, df
+
+
+def test_csv_partitions_cover_the_rows_once(tmp_path):
+    path = tmp_path / "customers.csv"
+    _customers().to_csv(path, index=False)
+    partitions = profile_quality._partitions(path, 7)
+    data = path.read_bytes()
+
+    assert len(partitions) == 7
+    assert partitions[0][0] == data.index(b"\n") + 1 and partitions[-1][1] == len(data)
+    for (_, end), (start, _) in zip(partitions, partitions[1:]):
+        assert end == start and data[start - 1:start] == b"\n"
+
+
+def test_more_partitions_than_rows(tmp_path):
+    path = tmp_path / "customers.csv"
+    _customers(rows=2).to_csv(path, index=False)
+    assert len(profile_quality._partitions(path, 8)) == 2
+
+
+def test_partitioned_profile_matches_a_single_pass(customers):
+    path, df = customers
+    single = profile_quality.profile(path, workers=1).drop(columns="created_at")
+    partitioned = profile_quality.profile(path, workers=3, chunk_size=25).drop(columns="created_at")
+    pd.testing.assert_frame_equal(partitioned, single)
+
+    overall = single[single["data_source"] == "All Sources"].iloc[0]
+    assert overall["total_records"] == len(df)
+    assert overall["unique_persons"] == df["PersonID"].nunique()
+    assert overall["missing_stress_level_count"] == df["current_stress_level"].isna().sum()
+    by_occupation = single[single["data_source"] == "By Occupation"].set_index("quality_dimension")
+    assert by_occupation["unique_persons"].to_dict() == df.groupby("occupational_category")["PersonID"].nunique().to_dict()
@@ -0,0 +1,113 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import score_anomalies as sa
+
+
+def _customers(rows):
+    """Customer rows with the INPUT_COLUMNS from (occupation, age, activity level, steps) tuples."""
+    return pd.DataFrame([
+        {
+            "PersonID": i, "insurance_sign_up_date": "2020-01-01",
+            "occupational_category": occupation, "age": age, "current_activity_level": level,
+            "current_daily_steps": steps, "current_heart_rate_bpm": 70.0 + i % 3,
+            "current_sleep_hours": 7.0 + i % 2, "avg_annual_claims": 1000.0 + 10 * i,
+        }
+        for i, (occupation, age, level, steps) in enumerate(rows)
+    ])
+
+
+def _segment(occupation, age, steps, level="active"):
+    return [(occupation, age, level, value) for value in steps]
+
+
+def test_single_row_segment_falls_back_to_occupation():
+    df = _customers(
+        _segment("teacher", 35, [5000, 5200, 5400, 5600, 5800, 6000]) + [("teacher", 62, "active", 5100)]
+    )
+    stats = sa.segment_stats(df)
+    assert (stats["stats_level"].iloc[:6] == "segment").all()
+    assert stats["stats_level"].iloc[6] == "occupation"
+    assert stats["segment_size"].iloc[6] == 7
+
+
+def test_single_row_occupation_falls_back_to_everyone():
+    df = _customers(_segment("teacher", 35, [5000, 5200, 5400, 5600, 5800]) + [("nurse", 45, "active", 5100)])
+    stats = sa.segment_stats(df)
+    assert stats["stats_level"].iloc[5] == "all"
+    assert stats["segment_size"].iloc[5] == 6
+
+
+def test_single_row_group_has_zero_spread_and_scores_zero():
+    # A lone customer is their own median: the MAD and the IQR fallback are both zero
+    df = _customers([("nurse", 45, "active", 5100)])
+    stats = sa.segment_stats(df)
+    assert stats["stats_level"].iloc[0] == "all"
+    assert stats["steps_mad"].iloc[0] == 0
+
+    scores = sa.score_chunk(df, stats)
+    assert np.isnan(scores["steps_z"].iloc[0]) or scores["steps_z"].iloc[0] == 0
+    assert scores["anomaly_score"].iloc[0] == 0
+    assert scores["outlier_metrics"].iloc[0] == ""
+
+
+def test_zero_mad_uses_the_interquartile_range():
+    # Over half the values are equal, so the MAD is zero but the IQR is not
+    values = pd.DataFrame({"group": ["a"] * 8, **{metric: [1.0] * 5 + [2.0, 3.0, 4.0] for metric in sa.METRICS}})
+    stats = sa._robust_stats(values, ["group"])
+    expected = (values["steps"].quantile(0.75) - values["steps"].quantile(0.25)) / 1.349
+    assert stats["steps_mad"].iloc[0] == expected > 0
+
+
+def test_status_follows_the_segment_z_score():
+    steps = [5000, 5010, 5020, 5030, 5040, 5050, 5060, 5070]
+    df = _customers(
+        _segment("teacher", 35, steps)
+        + [
+            # Far below the segment median, but above the old fixed 4000 step threshold
+            ("teacher", 36, "highly_active", 4500),
+            # Far above the segment median, but below the old fixed 8000 step threshold
+            ("teacher", 37, "sedentary", 7500),
+            ("teacher", 38, "highly_active", 5060),
+            ("teacher", 39, "sedentary", 5010),
+        ]
+    )
+    scores = sa.score_chunk(df, sa.segment_stats(df))
+    assert scores["steps_z"].iloc[-4] < -sa.OUTLIER_THRESHOLD
+    assert scores["steps_z"].iloc[-3] > sa.OUTLIER_THRESHOLD
+    assert scores["anomaly_status"].iloc[-4:].tolist() == [
+        "Over-Reporter", "Under-Reporter", "Verified Active", "Verified Sedentary",
+    ]
+
+
+def test_refresh_reuses_unchanged_rows():
+    df = _customers(_segment("teacher", 35, [5000, 5200, 5400, 5600, 5800, 6000]))
+    first = sa.refresh(df)
+    again = sa.refresh(df, first["table"])
+    assert (first["rescored"], again["rescored"], again["reused"]) == (6, 0, 6)
+    pd.testing.assert_frame_equal(first["table"], again["table"], check_dtype=False)
+
+
+def test_dtype_drift_does_not_rescore():
+    df = _customers(_segment("teacher", 35, [5000, 5200, 5400, 5600, 5800, 6000]))
+    first = sa.refresh(df)
+    # A missing value elsewhere in the export makes pandas read the steps as float64
+    again = sa.refresh(df.astype({"current_daily_steps": "float64", "occupational_category": "string"}), first["table"])
+    assert (again["rescored"], again["reused"]) == (0, 6)
+
+
+def test_hashes_are_kept_out_of_the_published_table(tmp_path):
+    df = _customers(_segment("teacher", 35, [5000, 5200, 5400, 5600, 5800, 6000]))
+    paths = {"input": tmp_path / "customers.csv", "output": tmp_path / "anomalies.csv", "state": tmp_path / "state.parquet"}
+    df.to_csv(paths["input"], index=False)
+
+    sa.main(**paths)
+    published = pd.read_csv(paths["output"])
+    assert not set(sa.HASH_COLUMNS) & set(published.columns)
+    assert (published[sa.VERSION_COLUMN] == hashlib.sha256(paths["input"].read_bytes()).hexdigest()[:12]).all()
+    assert pd.read_parquet(paths["state"]).columns.tolist() == sa.KEY_COLUMNS + sa.HASH_COLUMNS
+
+    sa.main(**paths)
+    pd.testing.assert_frame_equal(pd.read_csv(paths["output"]), published)
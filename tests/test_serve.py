@@ -0,0 +1,58 @@
+from collections import deque
+
+import pytest
+
+import serve
+
+UNSATISFIABLE = (0, -1)
+
+
+@pytest.mark.parametrize("header, size, expected", [
+    ("bytes=0-99", 1000, (0, 99)),
+    ("bytes=500-", 1000, (500, 999)),
+    ("bytes=900-5000", 1000, (900, 999)),
+    ("bytes=-100", 1000, (900, 999)),
+    ("bytes=-5000", 1000, (0, 999)),
+])
+def test_byte_range(header, size, expected):
+    assert serve._byte_range(header, size) == expected
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", 1000),
+    ("bytes=5-2", 1000),
+    ("bytes=-0", 1000),
+    # Any range of an empty file
+    ("bytes=0-0", 0),
+    ("bytes=0-", 0),
+    ("bytes=-5", 0),
+])
+def test_byte_range_unsatisfiable(header, size):
+    assert serve._byte_range(header, size) == UNSATISFIABLE
+
+
+@pytest.mark.parametrize("header", ["bytes=-", "bytes=0-10,20-30", "items=0-10", "bytes=a-b", ""])
+def test_byte_range_ignored(header):
+    # Not a single byte range: the whole file is sent
+    assert serve._byte_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, []),
+    ("", []),
+    ("gzip, deflate, br", ["gzip", "deflate", "br"]),
+    ("GZIP;q=0.5, br;q=1.0", ["gzip", "br"]),
+    ("gzip, br;q=0", ["gzip"]),
+    ("br;q=0.0, gzip;q=0.000", []),
+    ("*;q=0, identity", ["identity"]),
+])
+def test_accepted_encodings(header, expected):
+    assert serve._accepted_encodings(header) == expected
+
+
+def test_latency_summary():
+    summary = serve._latency_summary(deque(range(1, 101), maxlen=100))
+    assert summary["requests"] == 100
+    assert summary["p50_ms"] == 50.5
+    assert summary["p50_ms"] <= summary["p95_ms"] <= summary["max_ms"] == 100
+    assert serve._latency_summary([]) == {"requests": 0, "p50_ms": 0, "p95_ms": 0, "max_ms": 0}
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import simulate
+
+
+def _profitability(**changes):
+    """Rows of dm_insurance_profitability: a symmetric, a right-skewed and a single-value segment."""
+    return pd.DataFrame({
+        "occupational_category": ["teacher", "teacher", "nurse"],
+        "wealth_bracket": ["low", "high", "low"],
+        "insurance_status": ["active"] * 3,
+        "unique_customers": [10, 40, 3],
+        "avg_annual_premium": [1500.0, 2500.0, 1200.0],
+        "avg_annual_claims": [1000.0, 800.0, 700.0],
+        "min_claims": [0.0, 200.0, 700.0],
+        "max_claims": [2000.0, 3200.0, 700.0],
+    }).assign(**changes)
+
+
+def test_pert_mean_is_the_average_claims():
+    segments = simulate.fit_segments(_profitability())
+    np.testing.assert_allclose(segments["mean"], [1000.0, 800.0, 700.0])
+    assert segments["alpha"].iloc[0] == segments["beta"].iloc[0] == 3
+
+
+def test_mode_is_clipped_to_the_claims_range():
+    # The average is too close to the minimum for a PERT mode inside [min, max]
+    segments = simulate.fit_segments(_profitability(avg_annual_claims=[100.0, 800.0, 700.0]))
+    assert segments["alpha"].iloc[0] == 1
+    assert segments["mean"].iloc[0] == pytest.approx(2000 / 6)
+
+
+def test_pert_quantiles_are_sorted_and_within_the_range():
+    segments = simulate.fit_segments(_profitability())
+    quantiles = simulate.pert_quantiles(segments, points=1024)
+    assert quantiles.shape == (3, 1024) and quantiles.dtype == np.float32
+    assert (np.diff(quantiles, axis=1) >= 0).all()
+    low, high = segments["low"].to_numpy(), (segments["low"] + segments["spread"]).to_numpy()
+    assert (quantiles >= low[:, None]).all() and (quantiles <= high[:, None]).all()
+    # A segment without spread always claims its single value
+    assert (quantiles[2] == 700).all()
+
+
+def test_pert_quantiles_match_the_distribution():
+    segments = simulate.fit_segments(_profitability())
+    quantiles = simulate.pert_quantiles(segments)
+    # Drawing a random quantile gives the PERT mean and standard deviation
+    np.testing.assert_allclose(quantiles.mean(axis=1), segments["mean"], rtol=1e-3)
+    np.testing.assert_allclose(quantiles.std(axis=1), segments["std"], rtol=1e-2)
+    # The symmetric segment has its median in the middle, the right-skewed one below its mean
+    assert quantiles[0, [2047, 2048]].mean() == pytest.approx(1000, abs=1)
+    assert np.median(quantiles[1]) < segments["mean"].iloc[1]
+
+
+def test_simulation_does_not_depend_on_the_workers():
+    segments = simulate.fit_segments(_profitability())
+    runs = [list(simulate.simulate(segments, scenarios=4_000, workers=workers, batch_size=1_000))[-1]
+            for workers in (1, 2)]
+    assert runs[0][0] == runs[1][0] == 4_000
+    pd.testing.assert_frame_equal(runs[0][1], runs[1][1])